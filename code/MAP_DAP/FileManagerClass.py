@@ -3,6 +3,10 @@ import numpy as np
 import sys
 from os import path
 import platform
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import maplog, runfile
 
 DATA_DIR = "../../../../test_data/"
 
@@ -54,7 +58,7 @@ class FileManager:
 
         # read test log in to dataframe
         try:
-            df = pd.read_excel(self.log_file, dtype='str')
+            df = maplog.read_sheet(self.log_file, 0, dtype='str')
             print("Successfully read excel file.")
             self.reset_selected_list()
         except:
@@ -102,14 +106,15 @@ class FileManager:
         sample_dict = {}
         print('Loading sample key...')
         print(self.sample_file)
-        xl = pd.ExcelFile(self.sample_file)
-        print(xl.sheet_names)
 
         try:
+            # all sheets are read in one pass (or from the workbook's snapshot,
+            # see map_fit/maplog.py)
+            sheets = maplog.read_workbook(self.sample_file, {}, default_dtype='str')
+            print(list(sheets))
             # sample key must be named 'sample-key'
             print('Looking for sample sheet named: ' + self.sample_sheet + ' in file: ' + self.sample_file)
-            df = pd.read_excel(self.sample_file, sheet_name=self.sample_sheet,
-                dtype='str')
+            df = sheets[self.sample_sheet]
         except:
             print('ERROR: Failed to find a sample key.')
             self.sample_dict = None
@@ -265,7 +270,7 @@ class FileManager:
         if file_name [-4:] != '.txt':
             file_name += '.txt'
 
-        data = np.genfromtxt(file_path + file_name)
+        data = runfile.load(file_path + file_name)
 
         if preprocess:
             print('todo: implement pre-processing')
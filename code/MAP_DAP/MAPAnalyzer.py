@@ -1,17 +1,44 @@
 # Magnetic Suscepibility Analyzer for the MAPDAP
+#
+# Analyzer.analyze_runs() is the headless entry point: it takes a DataFrame
+# of runs and returns a DataFrame of results, fitting the files in a process
+# pool. The GUI (analyze_v2) and the command line batch below both use it:
+# >>> python MAPAnalyzer.py <runs file> <results file> [-workers N] [-start T] [-density D] [-store file]
+#
+#   <runs file>  .csv or .xlsx table with a row per run and columns file_path,
+#                sample and magnet (a magnet id from magnets/)
+#   <results file>  .csv file the results table is written to
+#   -workers N   number of worker processes (default 1)
+#   -start T     start time of the analysis in s (default 0)
+#   -density D   intrinsic density of the nanomaterial (default 5150)
+#   -store file  read the runs from a run store (see map_fit/runstore.py); the
+#                runs file then has a key column (the file key) instead of
+#                file_path
 
 from Classes import MagFieldFit, ParamGuesser
+import multiprocessing
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import lightFunctions as lf
 from scipy.optimize import curve_fit
 import scipy.stats as stats
 import warnings
 import os
-import random
+import sys
 import codecs
 from tqdm import tqdm
 
+# shared fitting code in code/map_fit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import flags, runfile, runstore, varpro
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# columns of the results table of analyze_runs
+RESULT_COLUMNS = ['file_name', 'sample', 'magnet', 'magnet_name', 'start_time',
+    'chi', 'epsilon', 'delta1', 'delta2', 'omega', 'epsilon_init',
+    'delta1_init', 'delta2_init', 'error']
+
 # res - data resolution
 class Analyzer:
     def __init__(self, res=1000, start_time=0):
@@ -35,6 +62,9 @@ class Analyzer:
         self.file_groups = None
         self.analyzed_files = {}
 
+        # parameter guesses by (sample, magnet, start time), see get_param_guesses
+        self.param_guesses = {}
+
     def update_start_time(self, new_time):
         print("Previous start time: " + str(self.start_time))
         self.start_time = float(new_time)
@@ -125,27 +155,133 @@ class Analyzer:
         self.add_magnet(magnet['id'], magnet['name'], magnet['B_r'],
             magnet['length'], magnet['width'], magnet['thickness'])
 
-    def analyze_v2(self, file_manager):
+    def analyze_v2(self, file_manager, workers=1, progress=None):
         data_dict = file_manager.load_data()
+        runs = pd.DataFrame.from_dict(data_dict, orient='index')
+        results = self.analyze_runs(runs, workers=workers, progress=progress)
+
+        for i, row in results.iterrows():
+            if row['error'] is None:
+                full_results = row[RESULT_COLUMNS[5:-1]].to_dict()
+            else:
+                # shown as a file without results
+                print("ERROR: failed to analyze " + str(row['file_name'])
+                    + ": " + row['error'])
+                full_results = None
+            test_info = [row['magnet_name'], self.start_time]
+            file_manager.add_analysis_results(i, row['file_name'], full_results,
+                test_info)
+
+    def analyze_runs(self, runs, workers=1, progress=None, store=None):
+        """Analyze many runs without the GUI.
+
+        Keyword arguments:
+        runs - DataFrame with a row per run and columns sample, magnet and
+               either time_data and lux_data (arrays), file_path, or key (with
+               store); file_name is optional
+        workers - number of worker processes the files are fitted in
+        progress - optional function, progress(n_done, n_runs, index, error),
+                   called in this process each time a file is finished
+        store - optional runstore.RunStore the runs are read from by key
+        Returns: DataFrame with the index of runs and RESULT_COLUMNS. A run
+        that failed has its message in error (None otherwise) and no results,
+        the other runs are still analyzed.
+        """
+        data_dict, load_errors = self.load_runs(runs, store)
+        results = pd.DataFrame(index=runs.index, columns=RESULT_COLUMNS, dtype=object)
+
+        # the parameter scans, once per sample and magnet (see get_param_guesses)
+        tasks = {}
+        for i, file_dict in data_dict.items():
+            results.at[i, 'file_name'] = file_dict['file_name']
+            results.at[i, 'sample'] = file_dict['sample']
+            results.at[i, 'magnet'] = file_dict['magnet']
+            results.at[i, 'start_time'] = self.start_time
+            if i in load_errors:
+                results.at[i, 'error'] = load_errors[i]
+                continue
+            try:
+                if file_dict['magnet'] not in self.magnets:
+                    raise KeyError("unknown magnet id " + str(file_dict['magnet']))
+                mag = self.magnets[file_dict['magnet']]
+                results.at[i, 'magnet_name'] = mag['name']
+                fg = [f for f in data_dict if f not in load_errors
+                    and data_dict[f]['sample'] == file_dict['sample']
+                    and data_dict[f]['magnet'] == file_dict['magnet']]
+                guesses = self.get_param_guesses(data_dict, fg)
+            except Exception as e:
+                results.at[i, 'error'] = _error_message(e)
+                continue
+            tasks[i] = (file_dict['time_data'], file_dict['lux_data'], guesses,
+                mag['A'], mag['b'])
+
+        n_done = 0
+        for i in runs.index:
+            if i not in tasks:
+                n_done += 1
+                if progress is not None:
+                    progress(n_done, len(runs), i, results.at[i, 'error'])
+        for i, file_results, error in self._run_tasks(tasks, workers):
+            if error is None:
+                for key, value in file_results.items():
+                    results.at[i, key] = value
+            results.at[i, 'error'] = error
+            n_done += 1
+            if progress is not None:
+                progress(n_done, len(runs), i, error)
+        return results
 
-        selected_files = file_manager.get_selected_list()
-        for i in selected_files:
-            file_dict = data_dict[i]
-            mag_id = file_dict['magnet']
-            A = self.magnets[mag_id]['A']
-            b = self.magnets[mag_id]['b']
-
-            guesses = self.get_param_guesses(data_dict, [i])
-
-            file_name = data_dict[i]['file_name']
-            time = data_dict[i]['time_data']
-            lux = data_dict[i]['lux_data']
-            full_results = self.analyze_file(time, lux, guesses, A, b)
-            chi = full_results['chi']
-
-            test_info = [self.magnets[mag_id]['name'], self.start_time]
+    def load_runs(self, runs, store=None):
+        """Read the files of runs without time_data (from store by key, if
+        given).
 
-            file_manager.add_analysis_results(i, file_name, full_results, test_info)
+        Returns: the data dict of the runs, as FileManager.load_data()
+        returns it, and a dict of the error message of each run that could
+        not be loaded (these have no time_data and lux_data)
+        """
+        data_dict = {}
+        errors = {}
+        for i, row in runs.iterrows():
+            file_dict = row.to_dict()
+            if not isinstance(file_dict.get('file_name'), str):
+                file_dict['file_name'] = str(file_dict['key']) if store is not None \
+                    else os.path.basename(str(file_dict.get('file_path', i)))
+            data_dict[i] = file_dict
+
+        # read the missing files at once
+        to_read = [i for i, d in data_dict.items()
+            if not isinstance(d.get('time_data'), np.ndarray)]
+        if store is not None:
+            # read-only views of the store's memory-mapped columns
+            loaded = [_load_stored(store, data_dict[i].get('key')) for i in to_read]
+        else:
+            loaded = [data if isinstance(data, Exception) else (data[:, 0], data[:, 1])
+                for data in runfile.load_many([str(data_dict[i].get('file_path'))
+                    for i in to_read], keep_errors=True)]
+        for i, data in zip(to_read, loaded):
+            if isinstance(data, Exception):
+                errors[i] = "could not load data: " + _error_message(data)
+            else:
+                data_dict[i]['time_data'], data_dict[i]['lux_data'] = data
+        return data_dict, errors
+
+    def _run_tasks(self, tasks, workers):
+        """Yield (index, results, error) of analyze_file on each task, as they
+        finish; forked worker processes are used if workers > 1."""
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print('fork is not available, analyzing in a single process')
+            workers = 1
+        if workers <= 1:
+            for i, task in tasks.items():
+                yield (i,) + _analyze_task(self, task)
+            return
+
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(_analyze_task, self, task): i
+                for i, task in tasks.items()}
+            for future in as_completed(futures):
+                yield (futures[future],) + future.result()
 
     # deprecated now
     def analyze(self, file_manager):
@@ -274,6 +410,12 @@ class Analyzer:
         return time, lux
 
     def get_param_guesses(self, data_dict, fg):
+        """Initial (eps, s1, s2) for the files of a group, from a scan of
+        (s1, s2) starting values fitted to a representative file.
+
+        The guesses are kept for each (sample, magnet, start time), so the scan
+        is only run the first time a sample and magnet are analyzed.
+        """
         warnings.filterwarnings("ignore")
 
         # set initial parameter scans
@@ -281,8 +423,14 @@ class Analyzer:
         s2_iter = np.linspace(-0.01, -1e-6, 40)
         total_iters = len(s1_iter) * len(s2_iter)
 
-        # pick one file at random to test the parameter guesses
-        test_file = fg[random.randint(0, len(fg) - 1)]
+        # test the parameter guesses on the median length trial of the group
+        test_file = self.representative_file(data_dict, fg)
+        key = (data_dict[test_file]['sample'], data_dict[test_file]['magnet'],
+            self.start_time)
+        if key in self.param_guesses:
+            print("parameters from an earlier scan of sample {}, magnet {}, "
+                "start time {}".format(*key))
+            return list(self.param_guesses[key])
         print("parameters picked based on: " + str(data_dict[test_file]['file_name']))
 
         # load the actual data
@@ -291,63 +439,45 @@ class Analyzer:
 
         time, lux = self.preprocess_data(time_raw, lux_raw)
 
-        # dimensionality reduction function to help with fitting
-        def transmOmega(t, eps, S1, S2):
-            # set omega as avg of last 100 data points to account for noise
-            Omega = np.mean(lux[-100:])
-            return lf.transm(t, eps, S1, S2, Omega)
-
         # define omega as the final lux value
+        # (avg of last 100 data points to account for noise)
         omega = np.mean(lux[-100:])
         print("omega: " + str(omega))
 
-        # keep track of the mean values
-        mean_matrix = np.zeros((total_iters, 3))
-
         print("\n")
         print("Scanning parameters...")
-        j = 0
-        count = 0
-        for s1 in s1_iter:
-            k = 0
-            for s2 in s2_iter:
-                # define epsilon
-                eps = s2 * omega / (s1 - s2)
-
-                # set initial guesses
-                guesses = eps, s1, s2
-
-                # fit the curve
-                (poptG, pcovG) = curve_fit(transmOmega, time, lux,
-                    p0=guesses, maxfev=10000, bounds=(-np.inf, np.inf))
-
-                # save the values
-                mean_var = np.mean(np.diag(pcovG))
-                mean_matrix[count] = [j, k, abs(mean_var)]
-
-                # increment counting variables
-                k += 1
-                count += 1
-            print(".", end="", flush=True)
-            j += 1
-
-        print("\niterated " + str(count) + " times")
-
-        # extract just the means from the saved data
-        mean_var_array = lf.column(mean_matrix, 2)
+        # fit from every (s1, s2) at once (eps is solved for, only s1, s2 are
+        # searched); results are in s1-major order
+        poptG, pcovG, sse = varpro.transm_scan(time, lux, omega, s1_iter, s2_iter)
+        print("iterated " + str(total_iters) + " times")
+
+        # the mean variances, only of the fits that reached the best residual
+        # (some starts end in a degenerate fit with one rate running off,
+        # which has a tiny variance)
+        mean_var_array = np.abs(np.mean(np.diagonal(pcovG, axis1=1, axis2=2), axis=1))
+        best_fits = sse <= np.min(sse) * 1.001
+        mean_var_array = np.where(best_fits, mean_var_array, np.inf)
 
         # find the index of the minimum mean
         index_min = np.argmin(mean_var_array)
 
         # extract the paramater guesses used in that run
-        s1g_index, s2g_index, m = mean_matrix[index_min]
-        s1g = s1_iter[int(s1g_index)] # find s1, s2 from initial array of params
-        s2g = s2_iter[int(s2g_index)]
+        s1g = s1_iter[index_min // len(s2_iter)] # find s1, s2 from initial array of params
+        s2g = s2_iter[index_min % len(s2_iter)]
         epsg = s2g * omega / (s1g - s2g) # calculate epsilon
 
         guess_array = [epsg, s1g, s2g] # compile guesses
         print(guess_array)
-        return guess_array
+        self.param_guesses[key] = guess_array
+        return list(guess_array)
+
+    def representative_file(self, data_dict, fg):
+        """The median length trial of a group of files (the shorter one of the
+        two middle trials of an even group), ties broken by file key, so the
+        same group always gives the same file.
+        """
+        by_length = sorted(fg, key=lambda f: (len(data_dict[f]['time_data']), str(f)))
+        return by_length[(len(by_length) - 1) // 2]
 
     def analyze_file(self, time_raw, lux_raw, guesses, A, b):
         # get processed data
@@ -358,12 +488,15 @@ class Analyzer:
             Omega = np.mean(lux[-100:])
             return lf.transm(t, eps, S1, S2, Omega)
 
+        def transmOmega_jac(t, eps, S1, S2):
+            return lf.transm_jac(t, eps, S1, S2, np.mean(lux[-100:]))[:, :3]
+
         # define omega as the final lux value
         omega = np.mean(lux[-100:])
 
         # fit the curve
         (popt, pcov) = curve_fit(transmOmega, time, lux, p0=guesses,
-            maxfev=10000, bounds=(-np.inf,np.inf))
+            maxfev=10000, bounds=(-np.inf,np.inf), jac=transmOmega_jac)
 
         # extract fit parameters
         eps, s1, s2 = popt
@@ -386,6 +519,23 @@ class Analyzer:
         return results
 
 
+def _analyze_task(analyzer, task):
+    """analyze_file on one task; returns (results, error message or None)."""
+    try:
+        return analyzer.analyze_file(*task), None
+    except Exception as e:
+        return None, _error_message(e)
+
+def _error_message(e):
+    return type(e).__name__ + ": " + str(e)
+
+def _load_stored(store, key):
+    # time and lux of a run of the store, or the exception if it can't be read
+    try:
+        return store.columns(key)
+    except Exception as e:
+        return e
+
 # B_r in T
 # dims - (length, width, thickness) in [m]
 class Magnet:
@@ -417,3 +567,48 @@ class Magnet:
     # TODO: write this
     def plot_mag_field(self, z):
         pass
+
+
+def main(argv):
+    argv, opts = flags.pop_flags(argv, {'workers': 1, 'start': 0.0, 'density': 5150.0,
+        'store': None})
+    if len(argv) < 3:
+        sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python '
+            'MAPAnalyzer.py <runs file> <results file> [-workers N] [-start T] '
+            '[-density D] [-store file]')
+    runs_file, results_file = argv[1], argv[2]
+    try:
+        if runs_file[-5:] == '.xlsx':
+            runs = pd.read_excel(runs_file, dtype={'sample': str, 'magnet': str})
+        else:
+            runs = pd.read_csv(runs_file, dtype={'sample': str, 'magnet': str})
+    except Exception as e:
+        sys.exit('ERROR: Invalid runs file: {}'.format(e))
+    store = None
+    if opts['store'] is not None:
+        if not os.path.isfile(opts['store']):
+            sys.exit('ERROR: no run store at ' + opts['store'])
+        store = runstore.open_store(opts['store'])
+    run_column = 'file_path' if store is None else 'key'
+    missing = [c for c in [run_column, 'sample', 'magnet'] if c not in runs.columns]
+    if missing:
+        sys.exit('ERROR: runs file is missing column(s): ' + ', '.join(missing))
+
+    analyzer = Analyzer(start_time=opts['start'])
+    analyzer.density = opts['density']
+
+    def progress(n_done, n_runs, i, error):
+        print('[{}/{}] {}: {}'.format(n_done, n_runs, runs.loc[i, run_column],
+            'done' if error is None else 'FAILED (' + error + ')'))
+
+    results = analyzer.analyze_runs(runs, workers=opts['workers'], progress=progress,
+        store=store)
+    results.to_csv(results_file)
+    n_failed = results['error'].notna().sum()
+    print('{} of {} runs analyzed, {} failed; results saved to {}'.format(
+        len(results) - n_failed, len(results), n_failed, results_file))
+    if n_failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -18,6 +18,10 @@ import sys
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy import stats
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # # check for correct number of arguments
 # if len(sys.argv) < 3:
@@ -112,7 +116,7 @@ for file in file_list:
     fig, axes = plt.subplots(1, 2, figsize=(24, 6))
 
     # get points from file
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0]
     lux = data[:, 1]
 
@@ -18,6 +18,10 @@ import sys
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy import stats
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 grey = "#555555"
 
@@ -119,7 +123,7 @@ file_path = path + file
 print("\nAnalyzing file: " + file_path)
 
 # get points from file
-data = np.genfromtxt(file_path)
+data = runfile.load(file_path)
 time = data[:, 0]
 lux = data[:, 1]
 
@@ -17,6 +17,10 @@
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # # check for correct number of arguments
 # if len(sys.argv) < 3:
@@ -54,7 +58,7 @@ for file in file_list:
     print("\nAnalyzing file: " + file_path)
 
     # get points from file
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     times = data[:, 0]
     lux = data[:, 1]
 
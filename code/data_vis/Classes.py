@@ -8,6 +8,10 @@ import os
 import random
 import codecs
 from tqdm import tqdm
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 
 class MagFieldFit:
@@ -79,7 +83,7 @@ class ParamGuesser:
         #Determine fit params for light curves#########
         filecp = codecs.open(self.path+"/{}".format(testFile), encoding = 'cp1252')
         #t_raw, T_raw = np.loadtxt(filecp, skiprows=3, delimiter=None,unpack=True)
-        data = np.genfromtxt(self.path+"/{}".format(testFile))
+        data = runfile.load(self.path+"/{}".format(testFile))
         t_raw = data[:, 0]
         T_raw = data[:, 1]
 
@@ -92,12 +96,8 @@ class ParamGuesser:
         T_RAWlog = lf.matchEXP(T_T)
         t_F, T_logF = lf.set_data_origin(t_T, T_RAWlog)
 
-        def transmOmega(t, eps, S1, S2):
-            Omega = T_logF[-1]
-            return lf.transm(t, eps, S1, S2, Omega)
-
         # meanVarArray = np.zeros(total_iters)
-        meanMatrix = np.zeros((total_iters, 3))
+        meanMatrix = np.zeros((total_iters, 4))
         omega = T_logF[-1]
         print("omega: " + str(omega))
 
@@ -110,18 +110,24 @@ class ParamGuesser:
                 eps = s2*omega/(s1-s2)
                 guesses = eps, s1, s2
 
-                (poptG, pcovG) = curve_fit(transmOmega, t_F, T_logF, p0=guesses, maxfev=10000, bounds=(-np.inf,np.inf))
+                # eps is solved for, only s1 and s2 are searched
+                (poptG, pcovG) = lf.fit_transm_omega(t_F, T_logF, *guesses, omega)
 
                 meanVar = np.mean(np.diag(pcovG))
-                meanMatrix[count] = [j, k, abs(meanVar)]
+                sse = np.sum((lf.transm(t_F, *poptG, omega) - T_logF)**2)
+                meanMatrix[count] = [j, k, abs(meanVar), sse]
 
                 k+=1
                 count+=1
             j+=1
 
+        # only fits that reached the best residual count (a start can end
+        # in a degenerate fit with one rate running off and a tiny variance)
         meanVarArray = lf.column(meanMatrix, 2)
+        bestFits = meanMatrix[:, 3] <= np.nanmin(meanMatrix[:, 3])*1.001
+        meanVarArray = np.where(bestFits, meanVarArray, np.inf)
         indx_min = np.argmin(meanVarArray)
-        S1_gIndx, S2_gIndx, m = meanMatrix[indx_min]
+        S1_gIndx, S2_gIndx, m, sse = meanMatrix[indx_min]
         S1g = s1_iter[int(S1_gIndx)]
         S2g = s2_iter[int(S2_gIndx)]
         epsg = S2g*omega/(S1g-S2g)
@@ -172,7 +178,7 @@ class ParamGuesser:
             filecp = codecs.open(self.path+"/{}".format(name), encoding = 'cp1252')
             print(self.path+"/{}".format(name))
             #t_raw, T_raw = np.loadtxt(filecp, skiprows=3, delimiter=None,unpack=True)
-            data = np.genfromtxt(self.path+"/{}".format(name))
+            data = runfile.load(self.path+"/{}".format(name))
             t_raw = data[:, 0]
             T_raw = data[:, 1]
 
@@ -2,6 +2,10 @@ import pandas as pd
 import numpy as np
 import sys
 from os import path
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import maplog, runfile
 
 DATA_DIR = "../../../../test_data/"
 
@@ -27,8 +31,10 @@ class FileManager:
     # read in the excel data log file, preprocess it,
     def load_data_log(self, file):
         print("loading data...")
-        # read test log in to dataframe
-        df = pd.read_excel(file, dtype='str')
+        # read test log in to dataframe (all sheets are read in one pass, or
+        # from the workbook's snapshot, see map_fit/maplog.py)
+        sheets = maplog.read_workbook(file, {}, default_dtype='str')
+        df = next(iter(sheets.values()))
         print("succesfully read excel file...")
 
         # read sample key
@@ -36,7 +42,7 @@ class FileManager:
         sample_dict = {}
         try:
             # assume that the sample key will be named 'sample-key'
-            df_samples = pd.read_excel(file, sheet_name='sample-key', dtype='str')
+            df_samples = sheets['sample-key']
             # set index to sample label (will be keys in sample_dict)
             df_samples.set_index('Label', inplace=True)
             sample_dict = df_samples.to_dict(orient='index') # make the dict
@@ -80,6 +86,9 @@ class FileManager:
 
     def load_data(self):
         data_dict = {} # the dict with all file data that will be returned
+        # read all selected data files at once
+        loaded = dict(zip(self.selected_list, runfile.load_many(
+            [self.file_path(i) for i in self.selected_list])))
         #DEBUG
         for i in self.selected_list:
             #print("i: " + str(i))
@@ -90,19 +99,9 @@ class FileManager:
             #print(row)
             #print("")
 
-            # get directory and file name info
-            directory = row['File-location']
             file_name = row['File-name']
-
-            # create file path
-            file_path = path.join(DATA_DIR, directory, file_name)
-
-            # add .txt if not already at end of file path
-            if file_path[:-4] != '.txt':
-                file_path += '.txt'
-
-            # read data file
-            data = np.genfromtxt(file_path)
+            file_path = self.file_path(i)
+            data = loaded[i]
 
             # create dictionary for this file
             file_dict['file_name'] = file_name
@@ -132,6 +131,21 @@ class FileManager:
 
         return data_dict
 
+    def file_path(self, i):
+        row = self.df.loc[i]
+
+        # get directory and file name info
+        directory = row['File-location']
+        file_name = row['File-name']
+
+        # create file path
+        file_path = path.join(DATA_DIR, directory, file_name)
+
+        # add .txt if not already at end of file path
+        if file_path[:-4] != '.txt':
+            file_path += '.txt'
+        return file_path
+
     # arguments:
     #  [int] file_index - the index of a file to be added to the selected_list
     def add_to_selected_list(self, file_index):
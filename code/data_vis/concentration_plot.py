@@ -15,6 +15,10 @@
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # check for correct number of arguments
 if len(sys.argv) < 3:
@@ -45,7 +49,7 @@ for f in file_list:
 
         file_path = path + file
 
-        data = np.genfromtxt(file_path)
+        data = runfile.load(file_path)
 
         # take baseline data from seconds 5-10
         total_l = 0
@@ -11,6 +11,10 @@ from matplotlib.patches import Rectangle
 import pandas as pd
 import math
 from statistics import mean
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import maplog, runfile
 
 
 # IMPORTANT VARIABLES
@@ -242,15 +246,17 @@ def apply_filter(df, indices, filter_num):
         return True, entries, filter_id
 
 def load_data_log(file):
-    # read test log in to dataframe
-    df = pd.read_excel(file, dtype='str')
+    # read test log in to dataframe (all sheets are read in one pass, or
+    # from the workbook's snapshot, see map_fit/maplog.py)
+    sheets = maplog.read_workbook(file, {}, default_dtype='str')
+    df = next(iter(sheets.values()))
 
     # read sample key
     # dictionary will contain sample info where the key is a sample label/name
     sample_dict = {}
     try:
         # assume that the sample key will be named 'sample-key'
-        df_samples = pd.read_excel(file, sheet_name='sample-key', dtype='str')
+        df_samples = sheets['sample-key']
         # set index to sample label (will be keys in sample_dict)
         df_samples.set_index('ID', inplace=True)
         sample_dict = df_samples.to_dict(orient='index') # make the dict
@@ -285,7 +291,7 @@ def plot_reproducible(df, extra_stats=False):
 
         # read text file
         print("processing file: " + file_name)
-        data = np.genfromtxt(file_path)
+        data = runfile.load(file_path)
         # read and process data
         delta_lux, start_lux, end_lux = calculate_concentration(data)
 
@@ -457,7 +463,7 @@ def load_data(df, sample_dict, selection):
             file_path += '.txt'
 
         # read data file
-        data = np.genfromtxt(file_path)
+        data = runfile.load(file_path)
 
         # create dictionary for this file
         file_dict['file-path'] = file_path
@@ -563,12 +563,19 @@ class MapDAP:
         # add to grid and fill space in frame
         tree.grid(row=0, column=0, sticky=tk.NSEW)
 
+    def show_analysis_progress(self, n_done, n_runs, index, error):
+        if error is not None:
+            print("analysis of file {} failed: {}".format(index, error))
+        self.analyze_button.configure(text="Analyzed {}/{}".format(n_done, n_runs))
+        self.root.update_idletasks()
+
     def start_analysis(self):
         print("Starting analysis...")
 
         self.analyzer.update_start_time(self.start_time_var.get())
         self.analyzer.update_density(self.density_var.get())
-        self.analyzer.analyze_v2(self.fm)
+        self.analyzer.analyze_v2(self.fm, progress=self.show_analysis_progress)
+        self.analyze_button.configure(text="Analyze!")
 
         print("finished updating mag page")
         self.update_results_tree()
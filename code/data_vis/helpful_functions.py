@@ -1,9 +1,14 @@
 # additional functions that may be useful
 import numpy as np
 from matplotlib import pyplot as plt
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 def find_stats(file):
-    data = np.genfromtxt(file)
+    data = runfile.load(file)
     avg = np.mean(data[:, 1])
     stddev = np.std(data[:, 1])
 
@@ -15,6 +15,10 @@
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # check for correct number of arguments
 if len(sys.argv) < 3:
@@ -45,7 +49,7 @@ for file in file_list:
     file_path = path + file
 
     # get points from file
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     raw_time = data[:, 0]
     raw_lux = data[:, 1]
 
@@ -3,6 +3,9 @@ import os
 import numpy as np
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
+
 # check for correct number of arguments
 if len(sys.argv) < 3:
     print("ERROR: Not enough arguments.")
@@ -49,7 +52,7 @@ def plot_light_curve(file_list, baseline_correction=False, no_legend=False):
         file_path = path + file
         print("plotting " + file_path)
 
-        data = np.genfromtxt(file_path)
+        data = runfile.load(file_path)
 
         x = data[:, 0]
         y = data[:, 1]
@@ -3,6 +3,10 @@ import numpy as np
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # parse arguments
 path = input("Enter path of file(s): ")
@@ -24,7 +28,7 @@ for file in file_list:
     file_path = path + file
 
     # get points from file
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     scaled_data = data[:, 1] * float(scale_factor)
 
     new_file_name = file_name + "_scaled_" + scale_factor + ".txt"
@@ -0,0 +1,11 @@
+# map_fit
+#
+# Shared fitting code for the MAP model fit scripts (model-4.0, model-5.0).
+#
+# The fit scripts are run from their own folders, so they add the parent
+# code/ folder to sys.path before importing this package:
+#
+#   sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+#   from map_fit import models, multistart
+#
+# Created: 2026.10.18
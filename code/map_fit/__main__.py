@@ -0,0 +1,20 @@
+# __main__.py
+#
+# Command line entry point of the map_fit package:
+# >>> python -m map_fit batch <log_file> <list file | pattern> [suffix] [options]
+# >>> python -m map_fit store <log_file> <store file> [list file | pattern] [options]
+# See batch.py and runstore.py for the options.
+#
+# Created: 2026.10.18
+
+import sys
+
+from . import batch, runstore
+
+COMMANDS = {'batch': batch.main, 'store': runstore.main}
+
+if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+    sys.exit('ERROR: expected usage:\n>>> python -m map_fit batch <log_file> '
+        '<list file | pattern> [suffix] [options]\n>>> python -m map_fit store '
+        '<log_file> <store file> [list file | pattern] [options]')
+COMMANDS[sys.argv[1]](sys.argv[1:])
@@ -0,0 +1,254 @@
+# batch.py
+#
+# Batch runner: fits many data files with a fit script in one process.
+#
+# Each data file is fitted by running the fit script on a one-file list, in
+# this process or in a pool of worker processes, so the interpreter, the
+# imports and the parsed log workbook (see maplog.py) are set up once for the
+# whole batch instead of once per file. The fit script writes its outputs as
+# each file finishes, and a summary of every file is printed at the end.
+#
+# A fit script can keep state across the files of a batch in task_state(),
+# e.g. the warm starts of model_fits.py -warm, which start each file from the
+# last fit of its (sample, magnet, concentration) group. With -- -warm the
+# files of a group are run in list order on the same worker, so each file
+# sees the fits of the files before it.
+#
+# Usage (from the folder the fit scripts are run in, with code/ on PYTHONPATH):
+# >>> python -m map_fit batch <log_file> <list file | pattern> [suffix] [-script path] [-where query] [-workers N] [-- script flags]
+#
+#   <list file>   file with one data file (line of the fit script's list file)
+#                 per line; blank lines and lines starting with # are skipped
+#   <pattern>     glob matched against the File column of the log, e.g. '829_*'
+#   -script path  fit script to run (default model-4.0/single_var_model_fits.py)
+#   -where query  only fit files whose log entry matches a pandas query over
+#                 the log columns, e.g. "Sample == 'dm81' and Magnet == '2'"
+#   -workers N    number of worker processes (default 1). With more than one
+#                 worker the script output is only shown for failed files.
+#   -- flags      everything after -- is passed on to the fit script
+#
+# Created: 2026.10.18
+
+import contextlib
+import fnmatch
+import io
+import multiprocessing
+import os
+import runpy
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import flags, maplog
+
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'model-4.0', 'single_var_model_fits.py')
+
+# lines of script output kept with a failed file in the summary
+ERROR_TAIL = 5
+
+# state kept by the fit scripts across the files of the running batch (each
+# worker process has its own); None outside of a batch
+_task_state = None
+
+def task_state():
+    """Dict a fit script can keep state in across the files of a batch, or
+    None if the script is not run by the batch runner."""
+    return _task_state
+
+def select_files(log_df, selection, where=None):
+    """Lines of a fit script list file to run, one per batch task.
+
+    Keyword arguments:
+    log_df - log sheet of the log workbook
+    selection - list file (with or without .txt) or glob over the File column
+    where - optional pandas query over the log columns; a line is kept if
+            every data file on it matches
+    """
+    list_file = selection if selection[-4:] == '.txt' else selection + '.txt'
+    if os.path.isfile(list_file):
+        with open(list_file, 'r') as f:
+            lines = [l.strip() for l in f.readlines()]
+        lines = [l for l in lines if l and l[0] != '#']
+    elif any(c in selection for c in '*?['):
+        lines = [f for f in log_df['File'].astype(str) if fnmatch.fnmatch(f, selection)]
+    else:
+        sys.exit('ERROR: no list file {} and {} is not a pattern.'.format(list_file,
+            selection))
+
+    if where is not None:
+        try:
+            matches = set(log_df.query(where)['File'].astype(str))
+        except Exception as e:
+            sys.exit('ERROR: invalid -where query: {}'.format(e))
+        lines = [l for l in lines if all(_file_key(f) in matches for f in l.split())]
+    return lines
+
+def run_file(script, log_name, line, suffix='', script_args=(), echo=True):
+    """Run a fit script on a single line of a list file.
+
+    Returns: (line, error message or None, run time in seconds)
+    """
+    # the list is named after the line, so the script's checkpoint of this
+    # file has the same name in every batch (for -- -resume)
+    list_dir = tempfile.mkdtemp(prefix='map_batch_')
+    list_path = os.path.join(list_dir, '_'.join(_file_key(f) for f in line.split()) + '.txt')
+    with open(list_path, 'w') as f:
+        f.write(line + '\n')
+    argv = [script, log_name, list_path] + ([suffix] if suffix else []) + list(script_args)
+
+    output = _Tee(sys.stdout if echo else None)
+    saved_argv, saved_path = sys.argv, list(sys.path)
+    sys.argv = argv
+    error = None
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(
+                sys.stderr if echo else io.StringIO()):
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        # the fit scripts print their error before a bare sys.exit()
+        error = str(e.code) if e.code not in (None, 0) else _last_error(output)
+    except Exception:
+        error = traceback.format_exc().strip().split('\n')[-1]
+    finally:
+        sys.argv, sys.path[:] = saved_argv, saved_path
+        os.remove(list_path)
+        os.rmdir(list_dir)
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    if error is not None and not echo:
+        tail = output.getvalue().strip().split('\n')[-ERROR_TAIL:]
+        error += ''.join('\n\t| ' + l for l in tail)
+    return line, error, time.time() - start
+
+def run_batch(script, log_name, lines, suffix='', script_args=(), workers=1,
+        groups=None):
+    """Run a fit script on each line, printing progress and a summary.
+
+    groups is the group key of each line: the lines of a group are run in list
+    order on the same worker, so the state the script keeps in task_state()
+    carries from one to the next (default: every line on its own).
+    Returns: list of (line, error message or None, run time) in list order
+    """
+    global _task_state
+    _task_state = {}
+    results = {}
+    start = time.time()
+    if workers <= 1:
+        for i, line in enumerate(lines):
+            print('\n=== [{}/{}] {}'.format(i + 1, len(lines), line))
+            results[line] = run_file(script, log_name, line, suffix, script_args)
+    else:
+        tasks = {}
+        for i, line in enumerate(lines):
+            tasks.setdefault(i if groups is None else groups[i], []).append(line)
+        # forked workers share the imports and parsed log of this process
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            futures = [pool.submit(_run_lines, script, log_name, task, suffix,
+                script_args) for task in tasks.values()]
+            for future in as_completed(futures):
+                for line, error, seconds in future.result():
+                    results[line] = (line, error, seconds)
+                    print('[{}/{}] {}: {} ({:0.1f} s)'.format(len(results), len(lines),
+                        line, 'done' if error is None else 'FAILED', seconds))
+    _task_state = None
+
+    results = [results[line] for line in lines]
+    print_summary(results, time.time() - start)
+    return results
+
+def warm_groups(sheets, lines):
+    """(sample, magnet, concentration) group of each line, as model_fits.py
+    -warm groups its files (a line whose file is not in the log is a group of
+    its own)."""
+    index = maplog.LogIndex(sheets)
+    groups = []
+    for line in lines:
+        try:
+            run = index[line.split()[0]]
+            groups.append((run.sample, run.magnet, run.c0))
+        except (KeyError, ValueError, IndexError):
+            groups.append(('line', line))
+    return groups
+
+def print_summary(results, seconds):
+    failed = [r for r in results if r[1] is not None]
+    print('\n=== Batch summary')
+    for line, error, t in results:
+        print('{:>8.1f} s  {:<6s}  {}'.format(t, 'ok' if error is None else 'FAILED', line))
+    for line, error, _ in failed:
+        print('\n{}: {}'.format(line, error))
+    print('\n{} of {} files fitted, {} failed, in {:0.1f} s.'.format(
+        len(results) - len(failed), len(results), len(failed), seconds))
+
+def main(argv):
+    if '--' in argv:
+        split = argv.index('--')
+        argv, script_args = argv[:split], argv[split + 1:]
+    else:
+        script_args = []
+    argv, opts = flags.pop_flags(argv, {'script': None, 'where': None, 'workers': 1})
+    if len(argv) < 3:
+        sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python -m map_fit '
+            'batch <log_file> <list file | pattern> [suffix] [-script path] '
+            '[-where query] [-workers N] [-- script flags]')
+    log_name, selection = argv[1], argv[2]
+    suffix = argv[3] if len(argv) > 3 else ''
+    script = os.path.abspath(opts['script'] or DEFAULT_SCRIPT)
+    if not os.path.isfile(script):
+        sys.exit('ERROR: no fit script at ' + script)
+
+    # parse the log once, before any workers are started
+    try:
+        sheets = maplog.read_log(maplog.log_path(log_name))
+    except Exception as e:
+        sys.exit('ERROR: Invalid log file: {}'.format(e))
+    lines = select_files(sheets['log'], selection, opts['where'])
+    if not lines:
+        sys.exit('ERROR: no files selected.')
+    # warm starts carry from file to file within a group
+    groups = warm_groups(sheets, lines) if '-warm' in script_args else None
+
+    # figures are only saved, never shown
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+
+    print('Fitting {} files with {} ({} worker{}).'.format(len(lines),
+        os.path.basename(script), opts['workers'], '' if opts['workers'] == 1 else 's'))
+    results = run_batch(script, log_name, lines, suffix, script_args, opts['workers'],
+        groups)
+    if any(error is not None for _, error, _ in results):
+        sys.exit(1)
+
+def _run_lines(script, log_name, lines, suffix, script_args):
+    # the lines of one group, in order, in one worker
+    return [run_file(script, log_name, line, suffix, script_args, echo=False)
+        for line in lines]
+
+def _file_key(name):
+    return name[:-4] if name[-4:] == '.txt' else name
+
+def _last_error(output):
+    errors = [l for l in output.getvalue().split('\n') if l.startswith('ERROR')]
+    return errors[-1] if errors else 'script exited early'
+
+class _Tee(io.StringIO):
+    """Keeps a copy of everything written, optionally passing it through."""
+    def __init__(self, stream=None):
+        super().__init__()
+        self.stream = stream
+
+    def write(self, s):
+        if self.stream is not None:
+            self.stream.write(s)
+        return super().write(s)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
@@ -0,0 +1,119 @@
+# checkpoint.py
+#
+# Checkpoints of long fit runs, so an interrupted run can be resumed.
+#
+# A Checkpoint holds a dict of run state (e.g. the files already processed,
+# the results folder and the fits of the file being fitted) that the script
+# updates as it goes. The state is pickled to a binary file at most every
+# `every` seconds, always between two completed starts, so the saved state
+# is consistent. A run started with -resume loads that state and skips the
+# work already done.
+#
+# fits() wraps a multistart engine (see multistart.py): it records the fits
+# the engine yields, and on resume yields the saved fits first and restarts
+# the engine at the first guess not yet completed. The engines fit every
+# start independently of the others, bit for bit whatever batch it falls in
+# (see models.step_exp), so the resumed fits, and everything the script
+# computes from them, are identical to those of an uninterrupted run even
+# though the restarted engine splits the guesses into different batches.
+#
+# Created: 2026.10.18
+
+import os
+import pickle
+import sys
+import time
+
+from . import fitcache
+
+# minimum time between checkpoint saves (s)
+DEFAULT_EVERY = 60
+
+class Checkpoint:
+    """Run state saved to path for resuming.
+
+    Keyword arguments:
+    path - checkpoint file
+    config - everything that determines the run's results (hashed with
+             fitcache.fit_key); a checkpoint saved with a different config
+             is not resumed
+    resume - load the state saved by an earlier run, if there is one
+    every - minimum time between saves (s)
+    """
+    def __init__(self, path, config, resume=False, every=DEFAULT_EVERY):
+        self.path = path
+        self.key = fitcache.fit_key(config)
+        self.every = every
+        self.state = {}
+        self.resumed = False
+        self.last_save = time.time()
+
+        if resume:
+            try:
+                with open(path, 'rb') as f:
+                    saved = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                print('No checkpoint at {}, starting from the beginning.'.format(path))
+                return
+            if saved['key'] != self.key:
+                sys.exit('ERROR: checkpoint {} was saved by a run with different '
+                    'inputs or options.'.format(path))
+            self.state = saved['state']
+            self.resumed = True
+            print('Resuming from checkpoint {}.'.format(path))
+
+    def save(self, force=False):
+        """Save the state if `every` seconds have passed since the last save."""
+        if not force and time.time() - self.last_save < self.every:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(dict(key=self.key, state=self.state), f,
+                protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
+
+    def remove(self):
+        """Delete the checkpoint file, e.g. once the run has finished."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def fits(self, key, run_fits, guesses):
+        """Fits of guesses from an engine, saved to the checkpoint as they come.
+
+        Keyword arguments:
+        key - identifies this fit (e.g. the file's fit cache key); only the
+              fits of the latest key are kept in the state
+        run_fits - run_fits(guesses) runs the engine, yielding
+              (init_guess, popt, pcov) in guess order
+        guesses - the full guess list
+        """
+        n_done, fits = 0, []
+        saved = self.state.get('fits')
+        if saved is not None and saved[0] == key:
+            _, n_done, fits = saved
+            fits = list(fits)
+            if n_done > 0:
+                print('Resuming fits at guess {}/{} ({} fits saved).'.format(n_done,
+                    len(guesses), len(fits)))
+        self.state['fits'] = (key, n_done, fits)
+        yield from list(fits)
+
+        engine = run_fits(guesses[n_done:])
+        i = n_done
+        try:
+            for fit in engine:
+                # the engine skips guesses that gave no fit
+                while list(guesses[i]) != list(fit[0]):
+                    i += 1
+                i += 1
+                fits.append(fit)
+                self.state['fits'] = (key, i, fits)
+                self.save()
+                yield fit
+        finally:
+            engine.close()
+        self.state['fits'] = (key, len(guesses), fits)
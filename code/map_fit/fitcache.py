@@ -0,0 +1,199 @@
+# fitcache.py
+#
+# Content-addressed on-disk cache of fit results.
+#
+# Each entry is stored under the SHA-256 hash of everything that determines
+# the fit: the time and lux data of the run, the resolved sample/magnet
+# metadata, the preprocessing parameters and the model and guess grid, and
+# code_version(), a hash of the sources of the map_fit modules that do the
+# fitting (FIT_MODULES). A rerun with the same inputs and fitting code finds
+# the entry and skips fitting; any change to the inputs or to those modules
+# (e.g. a solver fix) gives a new key, so their stale entries are never used
+# (they just age out). Changes to the fit scripts themselves are covered by
+# their ver, or by clearing the cache with invalidate.
+#
+# The cache is kept under a size limit by evicting the least recently used
+# entries (loading an entry refreshes its modification time).
+#
+# Usage:
+# >>> python fitcache.py <cache dir> info
+# >>> python fitcache.py <cache dir> invalidate [data file ...]
+# invalidate removes the entries for the given data files (e.g. run01 or
+# run01.txt), or every entry if no files are given.
+#
+# Created: 2026.10.18
+
+import hashlib
+import os
+import pickle
+import sys
+
+import numpy as np
+
+# default size limit of a cache directory
+DEFAULT_MAX_BYTES = 1024 * 1024**2
+
+# map_fit modules whose code determines the fit results, for code_version()
+FIT_MODULES = ('models.py', 'multistart.py', 'globalopt.py')
+
+def fit_key(*parts):
+    """Hash any mix of bytes, strings, numbers, arrays, lists and dicts.
+
+    Numbers are hashed by repr(), so keys are exact: 0.1 and 0.1000001 give
+    different keys.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        _update(h, part)
+    return h.hexdigest()
+
+def code_version(directory=None, modules=FIT_MODULES):
+    """SHA-256 of the sources of the fitting modules, for the fit keys.
+
+    directory defaults to the map_fit folder.
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for name in modules:
+        with open(os.path.join(directory, name), 'rb') as f:
+            _update(h, name)
+            _update(h, f.read())
+    return h.hexdigest()
+
+class FitCache:
+    """Directory of pickled fit results named by their fit_key()."""
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # batch workers may create the directory at the same time
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, key):
+        """Cached value for key, or None if there is no entry."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass # evicted by another process since it was read
+        return entry['value']
+
+    def store(self, key, value, label=''):
+        """Save value under key, then evict old entries over the size limit.
+
+        label names the data file, for invalidate().
+        """
+        path = self._path(key)
+        # one temporary file per process, as workers may store the same key
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(dict(label=label, value=value), f)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until under max_bytes.
+
+        Returns the number of entries removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue # evicted by another process
+            removed += 1
+        return removed
+
+    def invalidate(self, labels=None):
+        """Remove the entries for the given data files (all if None).
+
+        Returns the number of entries removed.
+        """
+        if labels is not None:
+            labels = set(_strip_txt(l) for l in labels)
+        removed = 0
+        for path, _, _ in self.entries():
+            if labels is not None:
+                try:
+                    with open(path, 'rb') as f:
+                        label = pickle.load(f)['label']
+                except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+                    label = None
+                if label is not None and _strip_txt(label) not in labels:
+                    continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+    def entries(self):
+        """(path, size in bytes, last use time) of every entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue # removed by another process since listdir()
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+def _strip_txt(name):
+    name = os.path.basename(str(name))
+    return name[:-4] if name.endswith('.txt') else name
+
+def _update(h, obj):
+    if isinstance(obj, bytes):
+        h.update(b'b' + str(len(obj)).encode() + b':' + obj)
+    elif isinstance(obj, str):
+        _update(h, obj.encode('utf-8'))
+    elif isinstance(obj, np.ndarray):
+        h.update(b'a' + obj.dtype.str.encode() + str(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'd' + str(len(obj)).encode())
+        for k in sorted(obj, key=str):
+            _update(h, str(k))
+            _update(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l' + str(len(obj)).encode())
+        for item in obj:
+            _update(h, item)
+    elif obj is None or isinstance(obj, (bool, int, float, np.number, np.bool_)):
+        h.update(b'n' + repr(obj.item() if isinstance(obj, np.generic) else obj).encode())
+    else:
+        raise TypeError('cannot hash {} in a fit key'.format(type(obj).__name__))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[2] not in ('info', 'invalidate'):
+        sys.exit('ERROR: expected usage:\n>>> python fitcache.py <cache dir> info'
+            '\n>>> python fitcache.py <cache dir> invalidate [data file ...]')
+    if not os.path.isdir(sys.argv[1]):
+        sys.exit('ERROR: no cache directory at ' + sys.argv[1])
+    cache = FitCache(sys.argv[1])
+    if sys.argv[2] == 'info':
+        entries = cache.entries()
+        print('{}: {} entries, {:0.1f} MB'.format(sys.argv[1], len(entries),
+            sum(size for _, size, _ in entries) / 1024**2))
+    else:
+        removed = cache.invalidate(sys.argv[3:] or None)
+        print('Removed {} cache entries.'.format(removed))
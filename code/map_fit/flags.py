@@ -0,0 +1,47 @@
+# flags.py
+#
+# Command line flag handling shared by the fit scripts.
+#
+# The fit scripts take positional arguments (<log_file> <list file> [suffix]).
+# Optional flags of the form -name or -name <value> may be given anywhere on
+# the command line; pop_flags() removes them and returns what is left so the
+# positional arguments can be read as before.
+#
+# Created: 2026.10.18
+
+import sys
+
+def pop_flags(argv, defaults):
+    """Split command line arguments into positional arguments and flags.
+
+    Keyword arguments:
+    argv - the argument list, usually sys.argv
+    defaults - dict of flag name (without the leading '-') to default value.
+               Flags with a bool default are switches and take no value; any
+               other flag reads the next argument and converts it to the type
+               of its default (None defaults are kept as strings).
+    Returns: (positional argument list, dict of flag values)
+    """
+    args = []
+    opts = dict(defaults)
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        name = arg[1:]
+        if i > 0 and arg[:1] == '-' and name in defaults:
+            default = defaults[name]
+            if isinstance(default, bool):
+                opts[name] = True
+            else:
+                if i + 1 >= len(argv):
+                    sys.exit('ERROR: missing value for flag ' + arg)
+                value = argv[i + 1]
+                try:
+                    opts[name] = value if default is None else type(default)(value)
+                except ValueError:
+                    sys.exit('ERROR: invalid value for flag {}: {}'.format(arg, value))
+                i += 1
+        else:
+            args.append(arg)
+        i += 1
+    return args, opts
@@ -0,0 +1,146 @@
+# globalopt.py
+#
+# Global optimizer backend for the multistart fit scripts.
+#
+# Instead of fitting from every cell of a guess grid (e.g. 500 chi values x 25
+# radii), global_fits() runs differential evolution (scipy) over the box the
+# grid spans. The whole population is evaluated in one batched model call per
+# generation. The best distinct members of the final population are then
+# refined, together with the corners of the box, by the batched
+# Levenberg-Marquardt solver of multistart.py, so the result has the same
+# (init_guess, popt, pcov) form as the other engines and the fit scripts keep
+# their own best-fit bookkeeping.
+#
+# Parameters whose guesses are log spaced (chi, r, the deltas) are searched
+# on a log scale. The summary reports the number of objective evaluations
+# (parameter sets the model was evaluated at) next to the size of the grid.
+#
+# Created: 2026.10.18
+
+import itertools
+
+import numpy as np
+from scipy.optimize import differential_evolution
+
+from . import multistart
+
+# available global optimizers (the -global flag of the fit scripts)
+METHODS = ['de']
+
+def search_box(guesses, bounds):
+    """Box spanned by a guess grid, inside the fit bounds.
+
+    Keyword arguments:
+    guesses - the guess list of the grid
+    bounds - (lower, upper) bounds, as passed to curve_fit
+    Returns: (box, log_scale), box is a list of (low, high) per parameter and
+    log_scale marks the parameters searched on a log scale: those whose
+    guesses all have one sign and span more than two decades
+    """
+    guesses = np.asarray(guesses, dtype=float)
+    lb = np.broadcast_to(np.asarray(bounds[0], dtype=float), guesses.shape[1:])
+    ub = np.broadcast_to(np.asarray(bounds[1], dtype=float), guesses.shape[1:])
+    low = np.maximum(np.min(guesses, axis=0), lb)
+    high = np.minimum(np.max(guesses, axis=0), ub)
+    with np.errstate(all='ignore'):
+        span = np.maximum(np.abs(low), np.abs(high)) / np.minimum(np.abs(low), np.abs(high))
+    return list(zip(low, high)), (low * high > 0) & (span > 100)
+
+def global_fits(model, time, conc, box, bounds, jac=None, log_scale=None,
+        method='de', popsize=15, maxiter=200, tol=1e-6, seed=0, keep=5,
+        n_grid=None, refine=None):
+    """Global search of the SSE over a box, refined by batched least squares.
+
+    Keyword arguments:
+    model - batched model, model(time, params) -> (n_sets, n_points)
+    time, conc - data to fit
+    box - list of (low, high) search limits per parameter
+    bounds - (lower, upper) bounds of the refining fits, as passed to curve_fit
+    jac - batched Jacobian, or None for finite differences
+    log_scale - per parameter, search log10(|p|) instead of p (default none)
+    method - global optimizer, one of METHODS
+    popsize, maxiter, tol, seed - passed on to differential_evolution
+    keep - number of distinct final population members refined, besides the
+           corners of the box
+    n_grid - number of grid guesses this replaces, for the summary
+    refine - refine(starts) giving the (init_guess, popt, pcov) of the refined
+             starts (default batched least squares of model, e.g. a
+             joint.joint_fits of a JointModel instead)
+    Returns: (fits, summary), fits is a list of (init_guess, popt, pcov) of
+    the refined starts, best DE member first
+    """
+    if method not in METHODS:
+        raise ValueError('unknown global optimizer ' + str(method))
+    n_params = len(box)
+    log_scale = np.zeros(n_params, dtype=bool) if log_scale is None else np.asarray(log_scale)
+    sign = np.array([np.sign(low) if low != 0 else np.sign(high) for low, high in box])
+    search = [(np.log10(abs(low)), np.log10(abs(high))) if log else (low, high)
+        for (low, high), log in zip(box, log_scale)]
+    search = [(min(s), max(s)) for s in search]
+
+    def to_params(x):
+        # x has shape (n_params, n_sets), as differential_evolution passes it
+        x = np.array(x, dtype=float).reshape(n_params, -1)
+        x[log_scale] = sign[log_scale, None] * 10**x[log_scale]
+        return x.T
+
+    counted = _Counted(model)
+    def cost(x):
+        _, sse = multistart._residuals(counted, time, conc, to_params(x))
+        return np.where(np.isfinite(sse), sse, np.finfo(float).max)
+
+    result = differential_evolution(cost, search, popsize=popsize, maxiter=maxiter,
+        tol=tol, seed=seed, polish=False, vectorized=True, updating='deferred')
+    n_global = counted.n
+
+    # best distinct members of the final population
+    order = np.argsort(result.population_energies)
+    members = to_params(result.population[order].T)
+    starts = []
+    for p in members:
+        key = tuple(np.round(np.where(log_scale, np.log10(np.abs(p)), p), 3))
+        if key not in [k for k, _ in starts]:
+            starts.append((key, p))
+        if len(starts) >= keep:
+            break
+    starts = np.array([p for _, p in starts])
+    # and the corners of the box: minima on the fit bounds (e.g. the largest
+    # radius) lie along flat valleys the population does not reach
+    corners = np.array(list(itertools.product(*box)))
+    starts = np.vstack([starts, corners])
+
+    counted_jac = None if jac is None else _Counted(jac)
+    if refine is None:
+        popts, pcovs, ok = multistart.batched_curve_fit(counted, time, conc, starts,
+            bounds, jac=counted_jac)
+        fits = [(list(starts[i]), popts[i], pcovs[i]) for i in range(len(starts)) if ok[i]]
+    else:
+        fits = list(refine([list(p) for p in starts]))
+
+    summary = ('Global search: differential evolution, {} generations of {} sets, '
+        '{} objective evaluations').format(result.nit, len(result.population), n_global)
+    if refine is None:
+        summary += ' + {} refining {} starts{}'.format(counted.n - n_global,
+            len(starts), '' if counted_jac is None else
+            ' (+ {} Jacobians)'.format(counted_jac.n))
+    else:
+        summary += ', {} starts refined'.format(len(starts))
+    if n_grid is not None:
+        summary += ' (the grid: {} guesses)'.format(n_grid)
+    if fits:
+        # the model of the searched parameters (popt may carry more)
+        n = len(box)
+        mse = np.nanmin(multistart._residuals(model, time, conc,
+            np.array([popt[:n] for _, popt, _ in fits]))[1]) / len(conc)
+        summary += '; best refined MSE {:0.12e}'.format(mse)
+    return fits, summary
+
+class _Counted:
+    """Batched function that counts the parameter sets it is evaluated at."""
+    def __init__(self, batched):
+        self.batched = batched
+        self.n = 0
+
+    def __call__(self, t, params):
+        self.n += len(params)
+        return self.batched(t, params)
@@ -0,0 +1,249 @@
+# joint.py
+#
+# Joint fits of a group of MAP trials that share chi_p and r.
+#
+# The trials are stacked into one residual vector. Each trial f keeps its own
+# amplitude and offset, which enter linearly:
+#
+#   y_f(t) = c0_f g(t; chi_p, r) + offset_f,  g = working_model with c0 = 1
+#
+# so the Jacobian has two dense columns (chi_p, r) and a two-column block per
+# trial. JointModel.fit() runs Levenberg-Marquardt on many starts at once and
+# solves the normal equations by eliminating the per-trial blocks (a Schur
+# complement), so an iteration costs O(total number of points): linear in the
+# number of trials instead of cubic in the number of parameters.
+#
+# joint_fits() is the multistart driver, with the same (init_guess, popt, pcov)
+# output and process pool as multistart.parallel_fits().
+#
+# Created: 2026.10.18
+
+import functools
+
+import numpy as np
+from tqdm import tqdm
+
+from . import models, multistart
+
+class JointModel:
+    """Stacked trials of one (sample, magnet) group.
+
+    Keyword arguments:
+    times, concs - lists with the (shifted) time and concentration of each trial
+    eta, rho_p, a, chi_s - solvent, sample and magnet constants shared by the group
+
+    Calling the object, model(t, params), gives the stacked model curves of the
+    (chi_p, r) sets in params with each trial's c0 and offset set to their least
+    squares values, so it can be used as a batched model of chi_p and r (e.g.
+    with multistart.screen_guesses) on the stacked data model.t, model.y.
+    """
+    def __init__(self, times, concs, eta, rho_p, a, chi_s, mu0=models.MU0):
+        self.consts = dict(eta=eta, rho_p=rho_p, a=a, chi_s=chi_s, c0=1, mu0=mu0)
+        self.counts = np.array([len(t) for t in times])
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.index = np.repeat(np.arange(len(times)), self.counts)
+        self.t = np.concatenate(times)
+        self.y = np.concatenate(concs)
+        self.n_trials = len(times)
+
+    def __call__(self, t, params):
+        with np.errstate(all='ignore'):
+            g = self.shape(params)
+            return self.curves(g, self.project(g))
+
+    def shape(self, params):
+        """g(t; chi_p, r) on the stacked time points, shape (n_sets, n_points)."""
+        return models.working_model(self.t, params, **self.consts)
+
+    def project(self, g):
+        """Least squares (c0, offset) of each trial for fixed shapes g.
+
+        Returns: shape (n_sets, n_trials, 2)
+        """
+        rhs = np.stack([self._sum(g * self.y), self._sum(np.broadcast_to(self.y,
+            g.shape))], axis=2)
+        return _solve_blocks(self._local_normal(g), rhs[..., None])[..., 0]
+
+    def curves(self, g, local):
+        """Model curves for shapes g and per-trial (c0, offset) local."""
+        return local[:, self.index, 0] * g + local[:, self.index, 1]
+
+    def fit(self, p0, bounds, max_iter=200, ftol=1e-8, xtol=1e-8):
+        """Levenberg-Marquardt fit of many (chi_p, r) starts at once.
+
+        bounds apply to chi_p and r; c0 and the offsets are unbounded and start
+        from their least squares values.
+        Returns: shared parameters (n_starts x 2), per-trial (c0, offset)
+        (n_starts x n_trials x 2), covariance of the shared parameters
+        (n_starts x 2 x 2) and a boolean array marking converged starts.
+        """
+        p = np.array(p0, dtype=float)
+        n_starts = len(p)
+        lb = np.broadcast_to(np.asarray(bounds[0], dtype=float), (2,))
+        ub = np.broadcast_to(np.asarray(bounds[1], dtype=float), (2,))
+        in_bounds = np.all((p >= lb) & (p <= ub), axis=1)
+        p = np.clip(p, lb, ub)
+
+        with np.errstate(all='ignore'):
+            g = self.shape(p)
+            local = self.project(g)
+            res, cost = self._residuals(g, local)
+        active = in_bounds & np.isfinite(cost)
+        converged = np.zeros(n_starts, dtype=bool)
+        lam = np.full(n_starts, 1e-3)
+
+        for _ in range(max_iter):
+            idx = np.flatnonzero(active)
+            if len(idx) == 0:
+                break
+
+            with np.errstate(all='ignore'):
+                A, B, D, g_s, g_l = self._blocks(p[idx], g[idx], local[idx], res[idx])
+
+            # hold parameters that sit on a bound the descent direction points past
+            held = ((p[idx] <= lb) & (g_s > 0)) | ((p[idx] >= ub) & (g_s < 0))
+            free = ~held
+            A = A * (free[:, :, None] & free[:, None, :]) + held[:, :, None] * np.eye(2)
+            B = B * free[:, None, :, None]
+            g_s = np.where(held, 0, g_s)
+
+            # raise the damping of each start until its step lowers the cost
+            pending = np.ones(len(idx), dtype=bool)
+            while np.any(pending):
+                sub = np.flatnonzero(pending)
+                ids = idx[sub]
+                step_s, step_l = self._step(A[sub], B[sub], D[sub], g_s[sub],
+                    g_l[sub], lam[ids])
+                p_new = np.clip(p[ids] + step_s, lb, ub)
+                local_new = local[ids] + step_l
+                with np.errstate(all='ignore'):
+                    g_new = self.shape(p_new)
+                    res_new, cost_new = self._residuals(g_new, local_new)
+
+                accept = np.isfinite(cost_new) & (cost_new < cost[ids])
+                acc = ids[accept]
+                old = np.concatenate([p[acc], local[acc].reshape(len(acc), 2 * self.n_trials)], axis=1)
+                new = np.concatenate([p_new[accept],
+                    local_new[accept].reshape(len(acc), 2 * self.n_trials)], axis=1)
+                small_step = np.all(np.abs(new - old) <= xtol * (np.abs(old) + xtol), axis=1)
+                small_drop = (cost[acc] - cost_new[accept]) <= ftol * cost[acc]
+                p[acc] = p_new[accept]
+                local[acc] = local_new[accept]
+                g[acc] = g_new[accept]
+                res[acc] = res_new[accept]
+                cost[acc] = cost_new[accept]
+                lam[acc] = np.maximum(lam[acc] / 10, 1e-12)
+                done = acc[small_step | small_drop]
+                converged[done] = True
+                active[done] = False
+
+                # no step lowers the cost: the start sits at a minimum
+                rej = ids[~accept]
+                lam[rej] *= 10
+                stuck = rej[lam[rej] > 1e12]
+                converged[stuck] = np.isfinite(cost[stuck])
+                active[stuck] = False
+
+                pending[sub[accept]] = False
+                pending[sub[~accept][lam[rej] > 1e12]] = False
+
+        pcov = np.full((n_starts, 2, 2), np.inf)
+        idx = np.flatnonzero(converged)
+        n_free = len(self.t) - 2 - 2 * self.n_trials
+        if len(idx) > 0 and n_free > 0:
+            with np.errstate(all='ignore'):
+                A, B, D, _, _ = self._blocks(p[idx], g[idx], local[idx], res[idx])
+                schur = A - np.einsum('sfjk,sfkl->sjl', B,
+                    _solve_blocks(D, B.transpose(0, 1, 3, 2)))
+                # normalize before inverting: chi_p and r differ by ~10 orders
+                norms = np.sqrt(np.abs(np.diagonal(schur, axis1=1, axis2=2)))
+                norms = np.where(norms > 0, norms, 1)
+                scaled = schur / (norms[:, :, None] * norms[:, None, :])
+                # a start whose blocks overflowed keeps an infinite covariance
+                ok = np.all(np.isfinite(scaled), axis=(1, 2))
+                inv = np.linalg.pinv(scaled[ok])
+                pcov[idx[ok]] = (inv / (norms[ok, :, None] * norms[ok, None, :])
+                    * (cost[idx[ok]] / n_free)[:, None, None])
+
+        return p, local, pcov, converged
+
+    def _sum(self, values):
+        """Sum over the points of each trial, shape (n_sets, n_trials, ...)."""
+        return np.add.reduceat(values, self.starts, axis=1)
+
+    def _local_normal(self, g):
+        D = np.empty(g.shape[:1] + (self.n_trials, 2, 2))
+        D[:, :, 0, 0] = self._sum(g**2)
+        D[:, :, 0, 1] = D[:, :, 1, 0] = self._sum(g)
+        D[:, :, 1, 1] = self.counts
+        return D
+
+    def _residuals(self, g, local):
+        res = self.curves(g, local) - self.y
+        cost = np.sum(res**2, axis=1)
+        cost[~np.isfinite(cost)] = np.nan
+        return res, cost
+
+    def _blocks(self, p, g, local, res):
+        """Normal equation blocks: shared A (2x2), coupling B and local D per
+        trial (2x2 each), and the shared and local gradients."""
+        J = local[:, self.index, 0, None] * models.working_jacobian(self.t, p, **self.consts)
+        A = np.einsum('snj,snk->sjk', J, J)
+        g_s = np.einsum('snj,sn->sj', J, res)
+        B = np.stack([self._sum(J * g[:, :, None]), self._sum(J)], axis=3)
+        D = self._local_normal(g)
+        g_l = np.stack([self._sum(g * res), self._sum(res)], axis=2)
+        return A, B, D, g_s, g_l
+
+    def _step(self, A, B, D, g_s, g_l, lam):
+        """Damped Gauss-Newton step, eliminating the per-trial blocks."""
+        A = A + lam[:, None, None] * np.maximum(A * np.eye(2), 1e-300 * np.eye(2))
+        D = D + lam[:, None, None, None] * np.maximum(D * np.eye(2), 1e-300 * np.eye(2))
+        with np.errstate(all='ignore'):
+            X = _solve_blocks(D, B.transpose(0, 1, 3, 2))
+            D_g = _solve_blocks(D, g_l[..., None])[..., 0]
+            schur = A - np.einsum('sfjk,sfkl->sjl', B, X)
+            rhs = -g_s + np.einsum('sfjk,sfk->sj', B, D_g)
+            step_s = multistart._solve(schur, rhs)
+            step_l = -D_g - np.einsum('sfkj,sj->sfk', X, step_s)
+        return step_s, step_l
+
+def joint_fits(model, guesses, bounds, workers=1, batch_size=None, progress=True):
+    """Joint multistart fit of a JointModel from (chi_p, r) guesses.
+
+    Keyword arguments:
+    model - JointModel of the group
+    guesses - (chi_p, r) starting guesses
+    bounds - ([chi_p, r lower], [chi_p, r upper])
+    workers - number of worker processes, as for multistart.parallel_fits()
+    Yields (init_guess, popt, pcov) for the converged starts in guess order,
+    where popt is (chi_p, r, c0_1, offset_1, c0_2, offset_2, ...) and pcov is
+    the covariance of chi_p and r.
+    """
+    guesses = [list(g) for g in guesses]
+    if batch_size is None:
+        # the Jacobian holds two values per point and start
+        batch_size = max(1, int(multistart.MAX_BATCH_VALUES // (2 * len(model.t))))
+    fit_chunk = functools.partial(_fit_chunk, model, bounds=bounds,
+        batch_size=batch_size)
+    if workers <= 1:
+        for start in tqdm(range(0, len(guesses), batch_size), disable=not progress):
+            yield from fit_chunk(guesses[start:start + batch_size])
+        return
+    yield from multistart.pool_fits(fit_chunk, guesses, workers)
+
+def _fit_chunk(model, guesses, bounds, batch_size):
+    fits = []
+    for start in range(0, len(guesses), batch_size):
+        batch = guesses[start:start + batch_size]
+        p, local, pcov, ok = model.fit(batch, bounds)
+        for i in np.flatnonzero(ok):
+            fits.append((batch[i], np.concatenate([p[i], local[i].ravel()]), pcov[i]))
+    return fits
+
+def _solve_blocks(M, b):
+    """Solve the 2x2 systems M[s, f] x = b[s, f], b of shape (..., 2, n_columns)."""
+    det = M[..., 0, 0] * M[..., 1, 1] - M[..., 0, 1] * M[..., 1, 0]
+    inv = np.stack([np.stack([M[..., 1, 1], -M[..., 0, 1]], axis=-1),
+        np.stack([-M[..., 1, 0], M[..., 0, 0]], axis=-1)], axis=-2)
+    return np.matmul(inv, b) / det[..., None, None]
@@ -0,0 +1,376 @@
+# maplog.py
+#
+# Cached reading of the MAP log workbook (log, samples and magnets sheets).
+#
+# Every fit script reads the same three sheets of the same workbook, and
+# parsing Excel is the slowest part of starting an analysis. read_workbook()
+# opens the workbook once and parses all of its sheets in one pass. The parsed
+# sheets are kept in memory, so a process that runs several scripts or files
+# (e.g. the batch runner in batch.py) parses the workbook once, and in a
+# snapshot file next to the workbook (<workbook>.snapshot.pkl, a pickle of the
+# typed DataFrames), so later runs load the snapshot instead of parsing the
+# workbook again. Both are keyed on the workbook's modification time and size:
+# editing the workbook makes the next read parse it again.
+#
+# LogIndex joins the three sheets for the fit scripts: it indexes the log by
+# file key and the samples and magnets sheets by ID once, so each data file's
+# log, sample and magnet entries are found by hash lookup instead of a scan of
+# every sheet. index[file] gives the joined and converted entries of a file as
+# a RunInfo (with the solvent's viscosity and susceptibility from SOLVENTS and
+# the magnet's remanence from MAGNET_GRADES). index.resolve(files) checks a
+# whole list of files before anything is fitted, so a bad entry is reported
+# when the run starts, together with every other bad entry, and not when the
+# run reaches its file.
+#
+# Created: 2026.10.18
+
+import math
+import os
+import pickle
+from typing import NamedTuple
+
+import pandas as pd
+
+# folder of the log workbook, relative to the folder the fit scripts are run in
+LOG_DIR = '../../../../test_data/paper_data/'
+
+# column types the fit scripts read each sheet with
+SHEET_DTYPES = {
+    'log': {'Magnet': str},
+    'samples': None,
+    'magnets': {'ID': str, 'Grade': float},
+}
+
+# solvents of the samples sheet: name, dynamic viscosity eta [Pa·s] and
+# magnetic susceptibility chi_s
+SOLVENTS = {
+    'water': ('Water', 8.9e-4, -9.04e-6),
+    'dpbs': ('DPBS', 0.89e-3, -9.05e-6),
+}
+
+# remanence B_r [T] of the magnet grades of the magnets sheet
+MAGNET_GRADES = {42: 1.32, 52: 1.48}
+
+# file next to the workbook the parsed sheets are kept in
+SNAPSHOT_SUFFIX = '.snapshot.pkl'
+SNAPSHOT_VERSION = 1
+
+_workbooks = {}
+
+def read_workbook(path, dtypes=None, default_dtype=None, snapshot=True):
+    """Read every sheet of an Excel workbook in one pass.
+
+    Keyword arguments:
+    path - workbook file
+    dtypes - dict of sheet name to the dtype it is parsed with, as for
+             pd.read_excel() (default SHEET_DTYPES)
+    default_dtype - dtype of the sheets not in dtypes
+    snapshot - use and update the snapshot file next to the workbook
+    Returns: dict of sheet name to DataFrame, in workbook order. The
+    DataFrames are copies of the cached sheets, so callers may modify them.
+    """
+    dtypes = SHEET_DTYPES if dtypes is None else dtypes
+    stat = os.stat(path)
+    variant = _variant_key(dtypes, default_dtype)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size, variant)
+    if key not in _workbooks:
+        sheets = _read_snapshot(path, stat, variant) if snapshot else None
+        if sheets is None:
+            with pd.ExcelFile(path) as xl:
+                sheets = {name: xl.parse(name, dtype=dtypes.get(name, default_dtype))
+                    for name in xl.sheet_names}
+            if snapshot:
+                _write_snapshot(path, stat, variant, sheets)
+        _workbooks[key] = sheets
+    return {name: df.copy() for name, df in _workbooks[key].items()}
+
+def read_sheet(path, sheet_name, dtype=None):
+    """Read one sheet of an Excel workbook, as pd.read_excel().
+
+    sheet_name is a sheet name or its position. The sheets of SHEET_DTYPES
+    read with their usual dtype share one parse of the whole workbook.
+    Returns a copy of the cached sheet, so callers may modify it.
+    """
+    if isinstance(sheet_name, str) and sheet_name in SHEET_DTYPES \
+            and dtype == SHEET_DTYPES[sheet_name]:
+        sheets = read_workbook(path)
+    else:
+        sheets = read_workbook(path, {}, default_dtype=dtype)
+    names = list(sheets)
+    if not isinstance(sheet_name, str):
+        if not 0 <= sheet_name < len(names):
+            raise ValueError('Worksheet index {} is invalid, {} worksheets found'.format(
+                sheet_name, len(names)))
+        sheet_name = names[sheet_name]
+    if sheet_name not in sheets:
+        raise ValueError("Worksheet named '{}' not found".format(sheet_name))
+    return sheets[sheet_name]
+
+def log_path(log_name, log_dir=LOG_DIR):
+    """Path of a log workbook given as on the fit script command line."""
+    if log_name[-5:] != '.xlsx':
+        log_name += '.xlsx'
+    return log_dir + log_name
+
+def read_log(path):
+    """Read the log, samples and magnets sheets of a log workbook.
+
+    Returns: dict of sheet name to DataFrame
+    """
+    sheets = read_workbook(path)
+    missing = [s for s in SHEET_DTYPES if s not in sheets]
+    if missing:
+        raise ValueError("Worksheet named '{}' not found".format(missing[0]))
+    return {sheet: sheets[sheet] for sheet in SHEET_DTYPES}
+
+def file_key(name):
+    """File key of a data file name, the File column of the log."""
+    name = str(name).strip()
+    return name[:-4] if name[-4:] == '.txt' else name
+
+def run_dir(directory):
+    """Folder of a run relative to the data folder, from the Directory column
+    of the log."""
+    dir = str(directory)
+    if dir[-1] != '/':
+        dir += '/'
+    if 'paper_data/' in dir:
+        dir = dir.replace('paper_data/', '') # fix duplicate
+    return dir
+
+class RunInfo(NamedTuple):
+    """Log, sample and magnet entries of a data file, joined and converted.
+
+    radius is 'Unknown' (and optimize_radius False) if the samples sheet has
+    no radius for the sample (or one that is not a finite number), or a
+    radius of 0; radius_std is None if it has no finite radius std dev. The
+    magnet size is in inches, its distance to the optical path in mm.
+    """
+    key: str
+    file: str
+    dir: str
+    sample: str
+    magnet: str
+    material: str
+    rho_p: float
+    solvent_type: str
+    eta: float
+    chi_s: float
+    radius: object
+    radius_std: object
+    optimize_radius: bool
+    batch: str
+    c0: float
+    mag_name: str
+    l_in: float
+    w_in: float
+    t_in: float
+    grade: int
+    b_r: float
+    dist: float
+    window: list
+
+    def describe(self):
+        """The entries, as printed by the fit scripts when a file starts."""
+        lines = ['Entry for {} successfully found.'.format(self.key),
+            'Directory: ' + self.dir,
+            '\nSample: ' + self.sample,
+            'Density: {} kg/m^3'.format(self.rho_p),
+            'Solvent: ' + self.solvent_type]
+        if self.optimize_radius:
+            lines.append('Radius: {} m'.format(self.radius))
+        else:
+            lines.append('Radius: unknown')
+        if self.radius_std is not None:
+            lines.append('Radius std dev: {} m'.format(self.radius_std))
+        lines += ['\nMagnet: ' + self.magnet,
+            'K&J Magnet: ' + self.mag_name,
+            'Length: {}"'.format(self.l_in),
+            'Width: {}"'.format(self.w_in),
+            'Thickness: {}"'.format(self.t_in),
+            'Grade: N{:d}'.format(self.grade)]
+        return '\n'.join(lines)
+
+class LogIndex:
+    """Log, samples and magnets sheets of a log workbook, indexed for lookup.
+
+    Keyword arguments:
+    sheets - dict of the log, samples and magnets sheets, as from read_log()
+
+    index[file] gives the RunInfo of a data file (file key or file name),
+    raising KeyError if the file, its sample or its magnet is not in the log
+    and ValueError if an entry is invalid. index.resolve(files) gives the
+    RunInfo of many files and the errors of the bad ones.
+    """
+    def __init__(self, sheets):
+        self.log_df = sheets['log']
+        self.sample_df = sheets['samples']
+        self.mag_df = sheets['magnets']
+        # row of the first entry of each file key, sample and magnet ID
+        self._files = _first_rows(file_key(f) for f in self.log_df['File'])
+        self._samples = _first_rows(self.sample_df['ID'])
+        self._magnets = _first_rows(self.mag_df['ID'])
+        self._runs = {}
+
+    def __contains__(self, name):
+        return file_key(name) in self._files
+
+    def __getitem__(self, name):
+        key = file_key(name)
+        if key not in self._runs:
+            self._runs[key] = self._join(key)
+        return self._runs[key]
+
+    def resolve(self, files, require_radius=False, require_radius_std=False):
+        """RunInfo of every file of files.
+
+        Keyword arguments:
+        files - data file names or keys
+        require_radius - count a file whose sample has no radius as bad
+        require_radius_std - count a file whose sample has no radius std dev
+                             as bad
+        Returns: (runs, errors), dicts of file key to RunInfo for the good
+        files and to an error message for the bad ones, in the order of files
+        """
+        runs, errors = {}, {}
+        for name in files:
+            key = file_key(name)
+            if key in runs or key in errors:
+                continue
+            try:
+                run = self[key]
+            except (KeyError, ValueError) as e:
+                errors[key] = e.args[0]
+                continue
+            if require_radius and not run.optimize_radius:
+                errors[key] = 'Cannot proceed with unknown radius of sample {}.'.format(run.sample)
+            elif require_radius_std and run.radius_std is None:
+                errors[key] = 'Invalid radius std dev of sample {}.'.format(run.sample)
+            else:
+                runs[key] = run
+        return runs, errors
+
+    def _join(self, key):
+        if key not in self._files:
+            raise KeyError('Could not find file {}.txt in log.'.format(key))
+        entry = self.log_df.iloc[self._files[key]]
+        dir = _field(entry, 'Directory', run_dir,
+            'Invalid directory: {}.'.format(entry.get('Directory')))
+
+        sample = str(entry['Sample'])
+        if sample not in self._samples:
+            raise KeyError('Could not find sample {} in sample log.'.format(sample))
+        sample_entry = self.sample_df.iloc[self._samples[sample]]
+        material = _field(sample_entry, 'Material', str, 'Invalid sample material.')
+        rho_p = _field(sample_entry, 'Density', _finite,
+            'Invalid density - should be a numerical value with units kg/m^3.')
+        solvent = _field(sample_entry, 'Solvent', lambda s: s.lower(),
+            'Solvent could not be found.')
+        if solvent not in SOLVENTS:
+            raise ValueError('Unknown solvent: {}.'.format(sample_entry['Solvent']))
+        solvent_type, eta, chi_s = SOLVENTS[solvent]
+        try:
+            radius = _finite(sample_entry['Radius'])
+            optimize_radius = radius != 0
+        except Exception:
+            radius, optimize_radius = 0, False
+        try:
+            radius_std = _finite(sample_entry['Radius-std'])
+        except Exception:
+            radius_std = None
+        if not optimize_radius:
+            radius = 'Unknown'
+        batch = _field(sample_entry, 'Batch-date/Lot', str, 'Could not find Batch date/Lot.')
+        c0 = _field(sample_entry, 'Conc.\n[mg/mL]', _finite, 'Invalid initial concentration.')
+
+        magnet = str(entry['Magnet'])
+        if magnet not in self._magnets:
+            raise KeyError('Could not find magnet {} in magnet log.'.format(magnet))
+        mag_entry = self.mag_df.iloc[self._magnets[magnet]]
+        mag_name = _field(mag_entry, 'K&J magnet', str, 'Could not find name of magnet.')
+        l_in = _field(mag_entry, 'Length', _finite, 'Invalid length.') # inches
+        w_in = _field(mag_entry, 'Width', _finite, 'Invalid width.') # inches
+        t_in = _field(mag_entry, 'Height', _finite, 'Invalid height.') # inches
+        grade = _field(mag_entry, 'Grade', int,
+            'Invalid grade: {}.'.format(mag_entry.get('Grade')))
+        if grade not in MAGNET_GRADES:
+            raise ValueError('Unknown magnet grade of {}.'.format(grade))
+        dist = _field(mag_entry, 'Distance', _finite, 'Invalid distance.') # mm
+
+        return RunInfo(key=key, file=key + '.txt', dir=dir, sample=sample,
+            magnet=magnet, material=material, rho_p=rho_p,
+            solvent_type=solvent_type, eta=eta, chi_s=chi_s, radius=radius,
+            radius_std=radius_std, optimize_radius=optimize_radius, batch=batch,
+            c0=c0, mag_name=mag_name, l_in=l_in, w_in=w_in, t_in=t_in,
+            grade=grade, b_r=MAGNET_GRADES[grade], dist=dist,
+            window=[dist - 0.5, dist + 0.5])
+
+def _first_rows(values):
+    # position of the first row of each value
+    rows = {}
+    for i, value in enumerate(values):
+        rows.setdefault(value, i)
+    return rows
+
+def _finite(value):
+    # value as a float, or ValueError if it is not a finite number (an empty
+    # cell of a numeric column is read as NaN)
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError('not a finite number: {}'.format(value))
+    return value
+
+def _field(row, column, convert, error):
+    # a converted entry of a sheet, or ValueError(error) if it can't be read
+    try:
+        return convert(row[column])
+    except Exception:
+        raise ValueError(error) from None
+
+def snapshot_path(path):
+    return path + SNAPSHOT_SUFFIX
+
+def _variant_key(dtypes, default_dtype):
+    # the dtypes a workbook was parsed with, as a hashable key
+    def name(dtype):
+        if isinstance(dtype, dict):
+            return tuple(sorted((str(k), name(v)) for k, v in dtype.items()))
+        return getattr(dtype, '__name__', str(dtype))
+    return (name(dtypes), name(default_dtype))
+
+def _read_snapshot(path, stat, variant):
+    try:
+        with open(snapshot_path(path), 'rb') as f:
+            snap = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if snap.get('version') != SNAPSHOT_VERSION or snap.get('mtime') != stat.st_mtime \
+            or snap.get('size') != stat.st_size:
+        return None
+    return snap['sheets'].get(variant)
+
+def _write_snapshot(path, stat, variant, sheets):
+    # a snapshot of the same workbook keeps the sheets parsed with other dtypes
+    snap = None
+    try:
+        with open(snapshot_path(path), 'rb') as f:
+            snap = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+    if not snap or snap.get('version') != SNAPSHOT_VERSION \
+            or snap.get('mtime') != stat.st_mtime or snap.get('size') != stat.st_size:
+        snap = dict(version=SNAPSHOT_VERSION, mtime=stat.st_mtime,
+            size=stat.st_size, sheets={})
+    snap['sheets'][variant] = sheets
+
+    # the snapshot is only a cache: a read-only data folder just goes without
+    tmp_path = snapshot_path(path) + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path(path))
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
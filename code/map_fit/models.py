@@ -0,0 +1,776 @@
+# models.py
+#
+# Batched versions of the MAP fit models and their Jacobians.
+#
+# Every model here takes the time array and a (n_sets x n_params) array of
+# parameter sets and returns a (n_sets x n_points) array, so that many starts
+# can be evaluated with a single call. Sample and magnet constants are passed
+# explicitly instead of being read from module globals.
+#
+# The Jacobians return (n_sets x n_points x n_params) arrays of closed form
+# derivatives, worked through alpha and beta (or delta1 and delta2):
+#
+#   y = k exp(delta1 t) + (c0 - k) exp(delta2 t),  k = delta2 c0 / (delta2 - delta1)
+#   delta1,2 = (-alpha +/- s) / 2,  s = sqrt(alpha^2 - 4 beta)
+#
+# This form breaks down at critical damping (delta1 = delta2) and is complex
+# when underdamped (alpha^2 < 4 beta), so two_phase() evaluates the same
+# curve as
+#
+#   y = c0 exp(-alpha t / 2) (C(z) + alpha t / 2 S(z)),  z = (alpha^2 / 4 - beta) t^2
+#
+# with C(z) = cosh(sqrt(z)), S(z) = sinh(sqrt(z)) / sqrt(z) (cos and sin for
+# z < 0), which is smooth through all three regimes. Each regime is computed
+# per element with masks, in a form that neither overflows nor cancels
+# (exp(delta1 t) and expm1 when overdamped, a series near z = 0), so the
+# batched models return finite values for any chi_p >= 0 and r > 0.
+#
+# The decaying exponentials exp(delta1 t) and exp(-alpha t / 2) are taken
+# from step_exp(). The MAP time stamps are recorded in whole milliseconds, so
+# a run has only a few dozen distinct time steps; step_exp() builds
+# exp(rate t_k) at the recorded times as a running product of exp(rate dt)
+# looked up from a table of those steps, with an exact exp() every
+# STEP_RESYNC points (see time_steps() for when a series qualifies and the
+# error bound), and calls exp() otherwise.
+#
+# check_jacobian() compares any of them against central finite differences.
+#
+# The model classes below wrap these functions together with their constants,
+# so a fit script builds one object per file instead of reading module
+# globals. Each class has the model (calling the object), its jacobian(),
+# parameter names and default bounds, and the derived quantities (alpha, beta,
+# delta1 and delta2, and chi_p and r back from the deltas). The objects hold
+# no other state and can be pickled, so they can be passed to worker
+# processes. MODELS maps a model name to its class:
+#
+#   model = models.MODELS['working'](eta, rho_p, a, chi_s, c0)
+#   y = model(t, [[chi_p, r]])[0]
+#
+# Created: 2026.10.18
+
+import numpy as np
+
+MU0 = 4 * np.pi * 10**-7
+
+# resolution of the recorded time stamps, in s; time steps are rounded to it
+STEP_QUANTUM = 1e-3
+
+# step_exp() evaluates exp() exactly at every STEP_RESYNC-th point
+STEP_RESYNC = 64
+
+# most distinct time steps for which step_exp() uses step tables
+STEP_MAX_DISTINCT = 256
+
+# largest deviation of the stepped times from the time points, relative to
+# the time span, for which step_exp() uses step tables
+STEP_RTOL = 1e-12
+
+# shortest series for which step_exp() uses step tables (below that, exp()
+# is as fast)
+STEP_MIN_POINTS = 256
+
+# fewest parameter sets for which step_exp() runs the product one point
+# offset at a time over all rows, rather than along each row
+STEP_WIDE_SETS = 16
+
+def working_model(t, params, eta, rho_p, a, chi_s, c0, mu0=MU0):
+    """Two-phase model with chi_p and r as fit parameters.
+
+    Keyword arguments:
+    t - time array, shape (n_points,)
+    params - parameter sets, shape (n_sets, 2), columns are (chi_p, r)
+    eta, rho_p, a, chi_s, c0 - solvent, sample and magnet constants
+    Returns: model concentration, shape (n_sets, n_points)
+    """
+    params = np.atleast_2d(params)
+    chi_p = params[:, 0:1]
+    r = params[:, 1:2]
+
+    alpha = (9 * eta) / (2 * rho_p * r**2)
+    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
+    return two_phase(t, alpha, beta, c0)
+
+def working_jacobian(t, params, eta, rho_p, a, chi_s, c0, mu0=MU0):
+    """Jacobian of working_model, columns are (d/dchi_p, d/dr)."""
+    params = np.atleast_2d(params)
+    chi_p = params[:, 0:1]
+    r = params[:, 1:2]
+
+    alpha = (9 * eta) / (2 * rho_p * r**2)
+    dbeta_dchi = (2 * a**2) / (rho_p * mu0 * (1 + chi_s))
+    dy_dalpha, dy_dbeta = _alpha_beta_partials(t, alpha, dbeta_dchi * chi_p, c0)
+    J = np.empty(dy_dalpha.shape + (2,))
+    np.multiply(dy_dbeta, dbeta_dchi, out=J[:, :, 0])
+    np.multiply(dy_dalpha, -2 * alpha / r, out=J[:, :, 1])
+    return J
+
+def r_chi_model(t, params, eta, rho_p, a, chi_s, c0, mu0=MU0):
+    """working_model with the parameter columns in (r, chi_p) order."""
+    params = np.atleast_2d(params)
+    return working_model(t, params[:, ::-1], eta, rho_p, a, chi_s, c0, mu0)
+
+def r_chi_jacobian(t, params, eta, rho_p, a, chi_s, c0, mu0=MU0):
+    """Jacobian of r_chi_model, columns are (d/dr, d/dchi_p)."""
+    params = np.atleast_2d(params)
+    return working_jacobian(t, params[:, ::-1], eta, rho_p, a, chi_s, c0, mu0)[:, :, ::-1]
+
+def core_shell_model(t, params, eta, rho_p, a, chi_s, c0, r, f=1, mu0=MU0):
+    """Two-phase model with chi_p as the only fit parameter.
+
+    Keyword arguments:
+    params - parameter sets, shape (n_sets, 1), the column is chi_p
+    r - particle radius
+    f - magnetic core volume fraction (1 for solid particles)
+    Other arguments as for working_model.
+    """
+    params = np.atleast_2d(params)
+    chi_p = params[:, 0:1]
+
+    alpha = np.full_like(chi_p, (9 * eta) / (2 * rho_p * r**2))
+    beta = (2 * a**2 * chi_p * f) / (rho_p * mu0 * (1 + chi_s))
+    return two_phase(t, alpha, beta, c0)
+
+def core_shell_jacobian(t, params, eta, rho_p, a, chi_s, c0, r, f=1, mu0=MU0):
+    """Jacobian of core_shell_model, the column is d/dchi_p."""
+    params = np.atleast_2d(params)
+    chi_p = params[:, 0:1]
+
+    alpha = np.full_like(chi_p, (9 * eta) / (2 * rho_p * r**2))
+    dbeta_dchi = (2 * a**2 * f) / (rho_p * mu0 * (1 + chi_s))
+    _, dy_dbeta = _alpha_beta_partials(t, alpha, dbeta_dchi * chi_p, c0)
+    return (dy_dbeta * dbeta_dchi)[:, :, None]
+
+def single_var_model(t, params, eta, rho_p, a, chi_s, c0, r, mu0=MU0):
+    """core_shell_model of a solid particle (f = 1)."""
+    return core_shell_model(t, params, eta, rho_p, a, chi_s, c0, r, 1, mu0)
+
+def single_var_jacobian(t, params, eta, rho_p, a, chi_s, c0, r, mu0=MU0):
+    """Jacobian of single_var_model, the column is d/dchi_p."""
+    return core_shell_jacobian(t, params, eta, rho_p, a, chi_s, c0, r, 1, mu0)
+
+def deltas_model(t, params, c0):
+    """Two-phase model with delta1 and delta2 as fit parameters.
+
+    Keyword arguments:
+    params - parameter sets, shape (n_sets, 2), columns are (delta1, delta2)
+    c0 - initial concentration
+    """
+    params = np.atleast_2d(params)
+    delta1 = params[:, 0:1]
+    delta2 = params[:, 1:2]
+
+    # k exp(delta1 t) + (c0 - k) exp(delta2 t), without the 1 / (delta2 - delta1)
+    u, x = _clip_exponent(delta1 * t), (delta2 - delta1) * t
+    return c0 * (np.exp(u) - u * _exp_phi(u, x))
+
+def deltas_jacobian(t, params, c0):
+    """Jacobian of deltas_model, columns are (d/ddelta1, d/ddelta2)."""
+    params = np.atleast_2d(params)
+    dy_d1, dy_d2 = _deltas_partials(t, params[:, 0:1], params[:, 1:2], c0)
+    return np.stack([dy_d1, dy_d2], axis=2)
+
+def transm(t, params):
+    """Batched lightFunctions.transm (log(1/T) light curve model).
+
+    Keyword arguments:
+    params - parameter sets, shape (n_sets, 4), columns are
+             (eps, S1, S2, omega)
+    """
+    params = np.atleast_2d(params)
+    eps, S1, S2, omega = [params[:, i:i + 1] for i in range(4)]
+    return eps * (-(S1 / S2) * step_exp(t, S2) + step_exp(t, S1)) + omega
+
+def transm_jacobian(t, params):
+    """Jacobian of transm, columns are (d/deps, d/dS1, d/dS2, d/domega)."""
+    params = np.atleast_2d(params)
+    eps, S1, S2, omega = [params[:, i:i + 1] for i in range(4)]
+    E1 = step_exp(t, S1)
+    E2 = step_exp(t, S2)
+    return np.stack([
+        -(S1 / S2) * E2 + E1,
+        eps * (-E2 / S2 + t * E1),
+        eps * (S1 / S2**2 - (S1 / S2) * t) * E2,
+        np.ones_like(E1)], axis=2)
+
+def two_phase(t, alpha, beta, c0):
+    """Two-phase model curve for arrays of alpha and beta, any damping regime.
+
+    Keyword arguments:
+    t - time array, shape (n_points,)
+    alpha, beta - shape (n_sets, 1)
+    c0 - initial concentration
+    Returns: shape (n_sets, n_points)
+    """
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), np.shape(beta))
+    q = 0.25 * alpha**2 - beta
+    over = q[:, 0] > 0
+    if np.all(over):
+        return c0 * _overdamped(t, alpha, beta, q)
+    y = np.empty(np.broadcast(q, t).shape)
+    y[over] = c0 * _overdamped(t, alpha[over], beta[over], q[over])
+    # underdamped and critical: E (cos(w t) + alpha / (2 w) sin(w t)), w = sqrt(-q)
+    under = ~over
+    a_u = alpha[under]
+    w = np.sqrt(-q[under])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(w > 0, np.sin(w * t) / w, t)
+    y[under] = c0 * step_exp(t, -0.5 * a_u) * (np.cos(w * t) + 0.5 * a_u * ratio)
+    return y
+
+def time_steps(t, quantum=STEP_QUANTUM):
+    """Table of the distinct time steps of t, for step_exp().
+
+    Each step t_k - t_(k-1) is rounded to a multiple of quantum, so that the
+    rounding noise of the recorded times does not make equal steps distinct.
+    step_exp() evaluates point k at its resync point t_r (r = k - k % STEP_RESYNC)
+    plus the rounded steps since, which is off from t_k by a few ulps of t.
+
+    Returns (steps, index, deviation): the rounded step before point k is
+    steps[index[k - 1]], and deviation is the largest distance between a time
+    point and the time step_exp() evaluates it at. Returns None if t has fewer
+    than STEP_MIN_POINTS points, is not increasing, has more than
+    STEP_MAX_DISTINCT distinct steps or deviates by more than STEP_RTOL times
+    its span.
+    """
+    t = np.asarray(t, dtype=float)
+    if t.ndim != 1 or len(t) < STEP_MIN_POINTS:
+        return None
+    dt = np.diff(t)
+    if not np.all(dt > 0):
+        return None
+    steps, index = np.unique(np.round(dt / quantum), return_inverse=True)
+    if len(steps) > STEP_MAX_DISTINCT or steps[0] == 0:
+        return None
+    steps *= quantum
+    walked = np.zeros(-(-len(t) // STEP_RESYNC) * STEP_RESYNC)
+    walked[1:len(t)] = steps[index]
+    walked[::STEP_RESYNC] = t[::STEP_RESYNC]
+    walked.shape = (-1, STEP_RESYNC)
+    np.cumsum(walked, axis=1, out=walked)
+    deviation = np.max(np.abs(walked.ravel()[:len(t)] - t))
+    if deviation > STEP_RTOL * (t[-1] - t[0]):
+        return None
+    return steps, index, deviation
+
+def step_exp(t, rates, steps=None):
+    """exp(rates * t) for rates of shape (n_sets, 1), shape (n_sets, n_points).
+
+    With a step table of t (time_steps(t) is not None), the decaying rows are
+    evaluated as exp(rate t_r) times the running product of exp(rate dt_k)
+    since the last resync point t_r: one exp() per STEP_RESYNC points and per
+    distinct step, and one product per point. Relative to exp(rate t), each
+    value is off by at most step_error_bound(t, rate), i.e. about
+    4 STEP_RESYNC eps from the rounding of the product, plus the rounding of
+    rate * t that exp() sees anyway. Growing rows and series without a step
+    table are evaluated with exp() directly.
+
+    Which path a row takes depends only on t and its own rate, and both ways
+    of running the product multiply in the same order, so each row comes out
+    bit-identical whatever rows it is evaluated with (the fits of a start do
+    not depend on its batch, chunk or worker).
+    """
+    rates = np.asarray(rates, dtype=float)
+    if steps is None:
+        steps = _cached_time_steps(t)
+    if steps is None:
+        return np.exp(_clip_exponent(rates * t))
+    decaying = rates[:, 0] <= 0
+    if not np.all(decaying):
+        out = np.empty((len(rates), len(t)))
+        out[~decaying] = np.exp(_clip_exponent(rates[~decaying] * t))
+        out[decaying] = step_exp(t, rates[decaying], steps)
+        return out
+
+    step, index, _ = steps
+    n, K = len(t), STEP_RESYNC
+    n_blocks = -(-n // K)
+    table = np.empty((len(step) + 1, len(rates)))
+    np.exp(np.multiply.outer(step, rates[:, 0]), out=table[:-1])
+    table[-1] = 1 # padding after the last point
+    lookup = np.full(n_blocks * K, len(step))
+    lookup[1:n] = index
+    lookup.shape = (n_blocks, K)
+    anchors = np.exp(_clip_exponent(np.multiply.outer(t[::K], rates[:, 0])))
+    if len(rates) < STEP_WIDE_SETS:
+        # row by row, the product along each block of K points
+        out = np.empty((len(rates), n))
+        for j in range(len(rates)):
+            factors = table[:, j][lookup]
+            factors[:, 0] = anchors[:, j]
+            np.multiply.accumulate(factors, axis=1, out=factors)
+            out[j] = factors.ravel()[:n]
+        return out
+    # factors[j, i] holds the rows of point j K + i, so that each step of the
+    # running product multiplies two contiguous (n_blocks x n_sets) slices
+    factors = table[lookup]
+    factors[:, 0] = anchors
+    for i in range(1, K):
+        np.multiply(factors[:, i], factors[:, i - 1], out=factors[:, i])
+    factors.shape = (n_blocks * K, len(rates))
+    return np.ascontiguousarray(factors[:n].T)
+
+def step_error_bound(t, rates=1.0):
+    """Bound on the relative error of step_exp(t, rates) against exp(rates * t).
+
+    |rate| (deviation + 2 eps max|t|) + 4 STEP_RESYNC eps: the deviation of
+    the stepped times, the rounding of rate t_r and rate dt, and up to
+    STEP_RESYNC rounded exp() and products since the last resync point. Only
+    holds for results above the smallest normal double. None if t has no
+    step table.
+    """
+    steps = time_steps(t)
+    if steps is None:
+        return None
+    eps = np.finfo(float).eps
+    return (np.abs(rates) * (steps[2] + 2 * eps * np.max(np.abs(t)))
+        + 4 * STEP_RESYNC * eps)
+
+def describe_time_steps(t):
+    """Report line on how step_exp() evaluates exponentials on t."""
+    t = np.asarray(t, dtype=float)
+    steps = time_steps(t)
+    if steps is not None:
+        eps = np.finfo(float).eps
+        return ('Time steps: {} distinct (rounded to {:g} s, max deviation {:0.2e} s); '
+            'exponentials from step tables, exact every {} points, relative error '
+            '<= {:0.2e} + {:0.2e} |rate|').format(len(steps[0]), STEP_QUANTUM,
+            steps[2], STEP_RESYNC, 4 * STEP_RESYNC * eps,
+            steps[2] + 2 * eps * np.max(np.abs(t)))
+    if len(t) < 2:
+        return 'Time steps: single point; exact exponentials'
+    dt = np.diff(t)
+    return ('Time steps: {} distinct at {:g} s resolution (steps {:0.6e} to '
+        '{:0.6e} s); exact exponentials').format(
+        len(np.unique(np.round(dt / STEP_QUANTUM))), STEP_QUANTUM, np.min(dt), np.max(dt))
+
+def check_jacobian(model, jac, t, params, rel_step=1e-4):
+    """Compare an analytic Jacobian against central finite differences.
+
+    Keyword arguments:
+    model, jac - batched model and Jacobian, called as model(t, params)
+    t - time array
+    params - parameter sets to check at, shape (n_sets, n_params)
+    rel_step - finite difference step relative to each parameter
+    Returns: relative column error, shape (n_sets, n_params). Each entry is
+    |J - J_fd| / max(|J|, |J_fd|) over the time points, so 0 is a perfect
+    match and 1 means no agreement at all; nan where either is not finite.
+
+    Far from the fit region (e.g. r ~ 1e-10) the model itself loses all
+    precision in delta1 and the finite differences, not the analytic
+    Jacobian, are what fails there.
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    n_sets, n_params = params.shape
+    with np.errstate(all='ignore'):
+        J = jac(t, params)
+        errors = np.empty((n_sets, n_params))
+        for j in range(n_params):
+            h = rel_step * np.where(params[:, j] != 0, np.abs(params[:, j]), 1)
+            up = params.copy()
+            down = params.copy()
+            up[:, j] += h
+            down[:, j] -= h
+            fd = (model(t, up) - model(t, down)) / (2 * h[:, None])
+            norm = np.maximum(np.sqrt(np.sum(fd**2, axis=1)),
+                np.sqrt(np.sum(J[:, :, j]**2, axis=1)))
+            diff = np.sqrt(np.sum((J[:, :, j] - fd)**2, axis=1))
+            errors[:, j] = np.where(norm > 0, diff / norm, 0)
+    errors[~np.isfinite(errors)] = np.nan
+    return errors
+
+def format_jacobian_check(names, errors):
+    """One line summary of check_jacobian() errors for the fit reports."""
+    parts = []
+    with np.errstate(all='ignore'):
+        for name, col in zip(names, np.atleast_2d(errors).T):
+            col = col[~np.isnan(col)]
+            if len(col) == 0:
+                parts.append('{} n/a'.format(name))
+            else:
+                parts.append('{} {:0.2e} / {:0.2e}'.format(name, np.median(col), np.max(col)))
+    return 'Jacobian check (median / max rel. error vs. finite differences): ' + ', '.join(parts)
+
+def _alpha_beta_partials(t, alpha, beta, c0):
+    """dy/dalpha and dy/dbeta of the two-phase model, any damping regime.
+
+    Overdamped rows well away from critical damping use the partials of
+    exp(delta1 t) (1 + delta1 / s expm1(-s t)); the others use the form
+    y = c0 E (C + alpha t / 2 S) with dz/dalpha = alpha t^2 / 2,
+    dz/dbeta = -t^2 and C' = S / 2.
+    """
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), np.shape(beta))
+    q = 0.25 * alpha**2 - beta
+    fast = np.sqrt(np.maximum(4 * q[:, 0], 0)) * np.max(np.abs(t)) > 1e-3
+    if np.all(fast):
+        return _overdamped_partials(t, alpha, beta, q, c0)
+    shape = np.broadcast(q, t).shape
+    dy_dalpha = np.empty(shape)
+    dy_dbeta = np.empty(shape)
+    dy_dalpha[fast], dy_dbeta[fast] = _overdamped_partials(t, alpha[fast],
+        beta[fast], q[fast], c0)
+
+    slow = ~fast
+    a_s = alpha[slow]
+    EC, ES, ESp = _two_phase_terms(t, a_s, beta[slow])
+    dy_dz = c0 * (0.5 * ES + 0.5 * a_s * t * ESp)
+    y = c0 * (EC + 0.5 * a_s * t * ES)
+    dy_dalpha[slow] = -0.5 * t * y + 0.5 * c0 * t * ES + dy_dz * 0.5 * a_s * t**2
+    dy_dbeta[slow] = -dy_dz * t**2
+    return dy_dalpha, dy_dbeta
+
+def _overdamped_partials(t, alpha, beta, q, c0):
+    """dy/dalpha and dy/dbeta of overdamped rows, through delta1 and s.
+
+    With y = c0 e1 (1 + delta1 / s em), e1 = exp(delta1 t), em = expm1(-s t):
+    dy/ddelta1 = t y + c0 e1 em / s and dy/ds = -c0 delta1 / s e1 (em / s + t (1 + em)).
+    """
+    s = np.sqrt(4 * q)
+    delta1 = -2 * beta / (alpha + s)
+    ratio = delta1 / s
+    # in place where possible: each (n_sets x n_points) temporary costs about
+    # as much as an exp() over it
+    e1 = step_exp(t, delta1)
+    P = np.multiply(-s, t)
+    np.expm1(P, out=P)
+    P *= e1
+    dy_dd1 = np.multiply(ratio, P)
+    dy_dd1 += e1
+    dy_dd1 *= c0 * t
+    tmp = np.multiply(c0 / s, P)
+    dy_dd1 += tmp
+    e1 += P
+    e1 *= t
+    dy_ds = np.divide(P, s, out=P)
+    dy_ds += e1
+    dy_ds *= -c0 * ratio
+    # ddelta1/dalpha = 2 beta / (s (alpha + s)), ddelta1/dbeta = -1 / s,
+    # ds/dalpha = alpha / s, ds/dbeta = -2 / s
+    dy_dalpha = np.multiply(dy_dd1, 2 * beta / (s * (alpha + s)), out=tmp)
+    dy_dalpha += np.multiply(dy_ds, alpha / s, out=e1)
+    dy_ds *= 2
+    dy_dbeta = dy_dd1
+    dy_dbeta += dy_ds
+    dy_dbeta *= -1 / s
+    return dy_dalpha, dy_dbeta
+
+def _overdamped(t, alpha, beta, q):
+    """y / c0 of overdamped rows: exp(delta1 t) (1 + delta1 / s expm1(-s t)).
+
+    delta1 = -2 beta / (alpha + s) avoids the cancellation in (-alpha + s) / 2.
+    """
+    s = np.sqrt(4 * q)
+    delta1 = -2 * beta / (alpha + s)
+    y = step_exp(t, delta1)
+    em = np.multiply(-s, t)
+    np.expm1(em, out=em)
+    em *= delta1 / s
+    em += 1
+    y *= em
+    return y
+
+def _two_phase_terms(t, alpha, beta, derivative=True):
+    """E C(z), E S(z) and E S'(z) with E = exp(-alpha t / 2).
+
+    The sign of z only depends on the parameter set, so each row of
+    alpha, beta (shape (n_sets, 1)) is evaluated in its own regime:
+    overdamped rows use exp(delta1 t) and expm1 so that E and C are never
+    formed separately (E underflows where C overflows), underdamped rows use
+    cos and sin. S'(z) = (C - S) / (2 z) is replaced by its series where
+    |z| is small (always at t = 0). Returns None for E S' if not derivative.
+    """
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float), np.shape(beta))
+    q = 0.25 * alpha**2 - beta
+    shape = np.broadcast(q, t).shape
+    EC = np.empty(shape)
+    ES = np.empty(shape)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # overdamped: E C = (e1 + e2) / 2, E S = e1 phi(-s t), e1,2 = exp(delta1,2 t)
+        over = q[:, 0] > 0
+        if np.any(over):
+            a_o = alpha[over]
+            s = np.sqrt(4 * q[over])
+            delta1 = -2 * beta[over] / (a_o + s)
+            e1 = step_exp(t, delta1)
+            x = s * t
+            em = np.expm1(-x)
+            EC[over] = e1 * (1 + 0.5 * em)
+            ES[over] = e1 * np.where(x > 0, -em / x, 1)
+
+        # underdamped and critical: C = cos(w), S = sin(w) / w, w = sqrt(-z)
+        under = ~over
+        if np.any(under):
+            E = step_exp(t, -0.5 * alpha[under])
+            w = np.sqrt(-q[under]) * t
+            EC[under] = E * np.cos(w)
+            ES[under] = E * np.where(w > 0, np.sin(w) / w, 1)
+
+        if not derivative:
+            return EC, ES, None
+        z = q * t**2
+        ESp = (EC - ES) / (2 * z)
+        small = np.abs(z) < 1e-3
+        if np.any(small):
+            # S' = 1/6 + z/60 + z^2/1680 + z^3/90720
+            zs = z[small]
+            E = np.exp(-0.5 * np.broadcast_to(alpha * t, shape)[small])
+            ESp[small] = E * (1 / 6 + zs / 60 + zs**2 / 1680 + zs**3 / 90720)
+    return EC, ES, ESp
+
+def _deltas_partials(t, delta1, delta2, c0):
+    """dy/ddelta1 and dy/ddelta2 of the two-phase model.
+
+    With u = delta1 t, x = (delta2 - delta1) t and y = c0 e^u (1 - u phi(x)),
+    phi(x) = expm1(x) / x, which stays finite as delta2 - delta1 -> 0.
+    """
+    u = _clip_exponent(delta1 * t)
+    x = (delta2 - delta1) * t
+    e_phi = _exp_phi(u, x)
+    e_dphi = _exp_dphi(u, x)
+    dy_d1 = c0 * t * (np.exp(u) - e_phi - u * e_phi + u * e_dphi)
+    dy_d2 = -c0 * t * u * e_dphi
+    return dy_d1, dy_d2
+
+def _cached_time_steps(t):
+    """time_steps(t), reusing the table of the last series seen.
+
+    The fit loops evaluate the models many times on the same time array, so
+    only a comparison of its bytes is paid per call.
+    """
+    global _last_time_steps
+    key = np.asarray(t, dtype=float).tobytes()
+    last = _last_time_steps
+    if last is not None and last[0] == key:
+        return last[1]
+    steps = time_steps(t)
+    _last_time_steps = (key, steps)
+    return steps
+
+_last_time_steps = None
+
+def _clip_exponent(u):
+    """Cap growing exponents so exp() stays finite (the fit then sees a huge residual)."""
+    return np.minimum(u, 600.0)
+
+def _exp_phi(u, x):
+    """exp(u) * expm1(x) / x, with the series near x = 0."""
+    u, x = np.broadcast_arrays(u, x)
+    out = np.empty(x.shape)
+    small = np.abs(x) < 1e-4
+    xs = x[small]
+    out[small] = np.exp(u[small]) * (1 + xs / 2 + xs**2 / 6)
+    xl, ul = x[~small], u[~small]
+    out[~small] = (np.exp(_clip_exponent(ul + xl)) - np.exp(ul)) / xl
+    return out
+
+def _exp_dphi(u, x):
+    """exp(u) * d/dx (expm1(x) / x) = exp(u) (e^x (x - 1) + 1) / x^2, with the series near 0."""
+    u, x = np.broadcast_arrays(u, x)
+    out = np.empty(x.shape)
+    small = np.abs(x) < 1e-3
+    xs = x[small]
+    out[small] = np.exp(u[small]) * (0.5 + xs / 3 + xs**2 / 8 + xs**3 / 30)
+    xl, ul = x[~small], u[~small]
+    out[~small] = (np.exp(_clip_exponent(ul + xl)) * (xl - 1) + np.exp(ul)) / xl**2
+    return out
+
+def alpha(r, eta, rho_p):
+    """Drag term of the two-phase model, 9 eta / (2 rho_p r^2)."""
+    return (9 * eta) / (2 * rho_p * np.asarray(r, dtype=float)**2)
+
+def beta(chi_p, rho_p, a, chi_s, f=1, mu0=MU0):
+    """Magnetic term of the two-phase model, 2 a^2 chi_p f / (rho_p mu0 (1 + chi_s))."""
+    return (2 * a**2 * np.asarray(chi_p, dtype=float) * f) / (rho_p * mu0 * (1 + chi_s))
+
+def deltas(alpha, beta):
+    """delta1 (slow) and delta2 (fast) from alpha and beta.
+
+    delta1 is written as -2 beta / (alpha + s), which avoids the cancellation
+    in (-alpha + s) / 2 when beta << alpha^2.
+    """
+    s = np.sqrt(alpha**2 - 4 * beta)
+    return -2 * beta / (alpha + s), -0.5 * (alpha + s)
+
+def chi_r_from_deltas(delta1, delta2, eta, rho_p, a, chi_s, f=1, mu0=MU0):
+    """chi_p and r of the two-phase model with decay rates delta1, delta2.
+
+    Uses alpha = -(delta1 + delta2) and beta = delta1 delta2.
+    """
+    alpha = -(np.asarray(delta1, dtype=float) + delta2)
+    beta = np.asarray(delta1, dtype=float) * delta2
+    r = np.sqrt((9 * eta) / (2 * rho_p * alpha))
+    chi_p = beta * rho_p * mu0 * (1 + chi_s) / (2 * a**2 * f)
+    return chi_p, r
+
+class Model:
+    """Base class of the model objects.
+
+    Subclasses set names (the fit parameters, in column order) and
+    default_bounds, and store their constants as attributes in __init__.
+    """
+    names = ()
+    default_bounds = ([], [])
+
+    def __call__(self, t, params):
+        raise NotImplementedError
+
+    def jacobian(self, t, params):
+        raise NotImplementedError
+
+    def single(self, t, *params):
+        """Model curve of one parameter set, model.single(t, *params), as curve_fit calls it."""
+        return self(t, [params])[0]
+
+    def single_jacobian(self, t, *params):
+        """Jacobian of one parameter set, shape (n_points, n_params), for curve_fit."""
+        return self.jacobian(t, [params])[0]
+
+    def bounds(self):
+        """Default (lower, upper) bounds of the fit parameters."""
+        return (list(self.default_bounds[0]), list(self.default_bounds[1]))
+
+    def constants(self):
+        """The constants the model was built with, as a dict (e.g. for fit cache keys)."""
+        return dict(vars(self))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(k, v)
+            for k, v in self.constants().items()))
+
+class WorkingModel(Model):
+    """working_model: fit parameters (chi_p, r)."""
+    names = ('chi_p', 'r')
+    default_bounds = ([0, 0], [np.inf, np.inf])
+
+    def __init__(self, eta, rho_p, a, chi_s, c0, mu0=MU0):
+        self.eta = eta
+        self.rho_p = rho_p
+        self.a = a
+        self.chi_s = chi_s
+        self.c0 = c0
+        self.mu0 = mu0
+
+    def __call__(self, t, params):
+        return working_model(t, params, self.eta, self.rho_p, self.a, self.chi_s,
+            self.c0, self.mu0)
+
+    def jacobian(self, t, params):
+        return working_jacobian(t, params, self.eta, self.rho_p, self.a,
+            self.chi_s, self.c0, self.mu0)
+
+    def chi_r(self, params):
+        """(chi_p, r) columns of params."""
+        params = np.atleast_2d(params)
+        return params[:, 0], params[:, 1]
+
+    def alpha(self, params):
+        return alpha(self.chi_r(params)[1], self.eta, self.rho_p)
+
+    def beta(self, params):
+        return beta(self.chi_r(params)[0], self.rho_p, self.a, self.chi_s, mu0=self.mu0)
+
+    def deltas(self, params):
+        """(delta1, delta2) of each parameter set."""
+        return deltas(self.alpha(params), self.beta(params))
+
+class RChiModel(WorkingModel):
+    """r_chi_model: fit parameters (r, chi_p)."""
+    names = ('r', 'chi_p')
+
+    def __call__(self, t, params):
+        return r_chi_model(t, params, self.eta, self.rho_p, self.a, self.chi_s,
+            self.c0, self.mu0)
+
+    def jacobian(self, t, params):
+        return r_chi_jacobian(t, params, self.eta, self.rho_p, self.a,
+            self.chi_s, self.c0, self.mu0)
+
+    def chi_r(self, params):
+        params = np.atleast_2d(params)
+        return params[:, 1], params[:, 0]
+
+class CoreShellModel(Model):
+    """core_shell_model: fit parameter chi_p, with r and f fixed."""
+    names = ('chi_p',)
+    default_bounds = ([0], [np.inf])
+
+    def __init__(self, eta, rho_p, a, chi_s, c0, r, f=1, mu0=MU0):
+        self.eta = eta
+        self.rho_p = rho_p
+        self.a = a
+        self.chi_s = chi_s
+        self.c0 = c0
+        self.r = r
+        self.f = f
+        self.mu0 = mu0
+
+    def __call__(self, t, params):
+        return core_shell_model(t, params, self.eta, self.rho_p, self.a,
+            self.chi_s, self.c0, self.r, self.f, self.mu0)
+
+    def jacobian(self, t, params):
+        return core_shell_jacobian(t, params, self.eta, self.rho_p, self.a,
+            self.chi_s, self.c0, self.r, self.f, self.mu0)
+
+    def alpha(self, params=None):
+        return alpha(self.r, self.eta, self.rho_p)
+
+    def beta(self, params):
+        return beta(np.atleast_2d(params)[:, 0], self.rho_p, self.a, self.chi_s,
+            self.f, self.mu0)
+
+    def deltas(self, params):
+        return deltas(self.alpha(), self.beta(params))
+
+class SingleVarModel(CoreShellModel):
+    """single_var_model: core_shell_model of a solid particle (f = 1)."""
+    def __init__(self, eta, rho_p, a, chi_s, c0, r, mu0=MU0):
+        CoreShellModel.__init__(self, eta, rho_p, a, chi_s, c0, r, 1, mu0)
+
+class DeltasModel(Model):
+    """deltas_model: fit parameters (delta1, delta2).
+
+    The sample and magnet constants are only needed for chi_r().
+    """
+    names = ('delta1', 'delta2')
+    default_bounds = ([-np.inf, -np.inf], [0, 0])
+
+    def __init__(self, c0, eta=None, rho_p=None, a=None, chi_s=None, mu0=MU0):
+        self.c0 = c0
+        self.eta = eta
+        self.rho_p = rho_p
+        self.a = a
+        self.chi_s = chi_s
+        self.mu0 = mu0
+
+    def __call__(self, t, params):
+        return deltas_model(t, params, self.c0)
+
+    def jacobian(self, t, params):
+        return deltas_jacobian(t, params, self.c0)
+
+    def deltas(self, params):
+        params = np.atleast_2d(params)
+        return params[:, 0], params[:, 1]
+
+    def chi_r(self, params):
+        """(chi_p, r) of each parameter set."""
+        if self.eta is None:
+            raise ValueError('DeltasModel needs eta, rho_p, a and chi_s for chi_r()')
+        return chi_r_from_deltas(*self.deltas(params), self.eta, self.rho_p,
+            self.a, self.chi_s, mu0=self.mu0)
+
+class TransmModel(Model):
+    """transm: fit parameters (eps, S1, S2, omega) of the light curve."""
+    names = ('eps', 'S1', 'S2', 'omega')
+    default_bounds = ([-np.inf] * 4, [np.inf] * 4)
+
+    def __call__(self, t, params):
+        return transm(t, params)
+
+    def jacobian(self, t, params):
+        return transm_jacobian(t, params)
+
+MODELS = {'working': WorkingModel, 'r_chi': RChiModel,
+    'core_shell': CoreShellModel, 'single_var': SingleVarModel,
+    'deltas': DeltasModel, 'transm': TransmModel}
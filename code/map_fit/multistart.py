@@ -0,0 +1,778 @@
+# multistart.py
+#
+# Multistart fitting engines for the MAP model fit scripts.
+#
+# serial_fits() is the original one-curve_fit-per-guess loop.
+# batched_fits() advances all starts together with a vectorized
+# Levenberg-Marquardt iteration over a (n_starts x n_points) array.
+#
+# parallel_fits() splits the guess list over a process pool and runs either
+# engine in the workers.
+#
+# basin_fits() runs curve_fit one guess at a time like serial_fits(), but
+# first takes a few probe iterations and drops the guess if it is already
+# heading into a basin (converged solution) found by an earlier guess.
+#
+# scalar_fits() is the one-parameter engine: it evaluates the SSE on the
+# whole guess grid at once, brackets every local minimum of the grid and
+# refines each bracket with Brent's method on the analytic derivative.
+#
+# local_guesses() builds a small grid around a known solution, e.g. the fit of
+# an earlier trial in the same series, to warm start the engines.
+#
+# screen_guesses() ranks a guess grid by its sum of squared residuals, without
+# fitting, so the engines only need to run from the most promising cells.
+#
+# decimated_fits() runs the engines from every guess on a bin-averaged copy of
+# the series and refits only the best coarse optima on the full series, so the
+# cost of the multistart grows with the number of bins instead of points.
+#
+# EarlyStop watches the fits coming out of any engine and stops the loop once
+# the best MSE has stopped improving or is very likely the global minimum.
+#
+# All engines yield (init_guess, popt, pcov) for every start that produced a
+# fit, in the same order as the guess list, so the fit scripts can keep their
+# own best-fit bookkeeping unchanged and get the same results (best fits, ^/*
+# markers and print_list order) however many workers are used.
+#
+# Created: 2026.10.18
+
+import functools
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import brentq, curve_fit, least_squares, minimize_scalar
+from tqdm import tqdm
+
+# largest number of model values held in memory per batch
+MAX_BATCH_VALUES = 2000000
+
+# number of guess chunks handed to each worker by parallel_fits()
+CHUNKS_PER_WORKER = 4
+
+def serial_fits(model, time, conc, guesses, bounds, jac=None, progress=True):
+    """Fit from each guess with scipy's curve_fit, one guess at a time.
+
+    jac is passed on to curve_fit (jac(t, *params) -> (n_points, n_params)).
+    Guesses that raise ValueError, RuntimeError or ZeroDivisionError are
+    skipped, as in the original fit scripts.
+    """
+    for init_guess in tqdm(guesses, disable=not progress):
+        try:
+            (popt, pcov) = curve_fit(model, time, conc, p0=init_guess, bounds=bounds,
+                jac=jac)
+        except ValueError:
+            continue
+        except RuntimeError:
+            continue
+        except ZeroDivisionError:
+            continue
+        yield init_guess, popt, pcov
+
+def batched_fits(model, time, conc, guesses, bounds, jac=None, batch_size=None,
+        max_iter=200, progress=True):
+    """Fit from every guess at once with a batched Levenberg-Marquardt solver.
+
+    Keyword arguments:
+    model - batched model, model(time, params) -> (n_sets, n_points)
+    time, conc - data to fit
+    guesses - list of initial guesses, one per start
+    bounds - (lower, upper) bounds, as passed to curve_fit
+    jac - batched Jacobian, jac(time, params) -> (n_sets, n_points, n_params).
+          Finite differences are used if None.
+    batch_size - number of starts advanced together (default: sized so that
+          a batch holds about MAX_BATCH_VALUES model values)
+    max_iter - iterations before a start is dropped as not converged, like a
+          RuntimeError from curve_fit
+
+    Starts whose model is not finite at the initial guess or that do not
+    converge are skipped, like the exceptions in serial_fits().
+    """
+    guesses = np.array(guesses, dtype=float)
+    if guesses.ndim == 1:
+        guesses = guesses[:, None]
+    if batch_size is None:
+        batch_size = max(1, int(MAX_BATCH_VALUES // max(len(time), 1)))
+
+    for start in tqdm(range(0, len(guesses), batch_size), disable=not progress):
+        batch = guesses[start:start + batch_size]
+        popts, pcovs, ok = batched_curve_fit(model, time, conc, batch, bounds,
+            jac=jac, max_iter=max_iter)
+        for i in range(len(batch)):
+            if ok[i]:
+                yield list(batch[i]), popts[i], pcovs[i]
+
+def basin_fits(model, time, conc, guesses, bounds, jac=None, cache=None,
+        probe_nfev=5, progress=True):
+    """Fit from each guess, skipping guesses that head into a known basin.
+
+    Every guess first gets probe_nfev model evaluations of the same trust
+    region solver curve_fit uses. If the probe lands within the cache
+    tolerance of a converged fit, or of the probe point of an earlier guess
+    that went on to converge, the guess is counted as skipped for that basin
+    and not fitted. Otherwise curve_fit continues from the probe and the fit
+    is added to the cache.
+
+    Keyword arguments:
+    model, jac - batched model and Jacobian, as for parallel_fits()
+    cache - BasinCache to use (a new one if None); keep a reference to
+            report the basins afterwards
+    probe_nfev - model evaluations before checking the cache
+    Yields (init_guess, popt, pcov) for the guesses that were fitted.
+    """
+    if cache is None:
+        cache = BasinCache()
+    single_model = _SingleStart(model)
+    single_jac = None if jac is None else _SingleStart(jac)
+
+    def residuals(params):
+        return single_model(time, *params) - conc
+
+    def residual_jac(params):
+        return single_jac(time, *params)
+
+    for init_guess in tqdm(guesses, disable=not progress):
+        try:
+            probe = least_squares(residuals, init_guess,
+                jac='2-point' if jac is None else residual_jac, bounds=bounds,
+                method='trf', max_nfev=probe_nfev)
+            basin = cache.find(probe.x)
+            if basin is not None:
+                cache.basins[basin]['skipped'] += 1
+                continue
+            (popt, pcov) = curve_fit(single_model, time, conc, p0=probe.x,
+                bounds=bounds, jac=single_jac)
+        except ValueError:
+            continue
+        except RuntimeError:
+            continue
+        except ZeroDivisionError:
+            continue
+        cache.add(popt, probe.x)
+        yield init_guess, popt, pcov
+
+class BasinCache:
+    """Spatial index of converged fits and the guesses that reached them.
+
+    Points (converged fits and the probe points of the guesses that led to
+    them) are hashed on a grid in log10(|p|) with cells as wide as the
+    tolerance, so a lookup only checks the points in its own and the
+    neighboring cells. Two parameter sets match when every parameter agrees
+    to within tol (relative).
+    """
+    def __init__(self, tol=5e-2):
+        self.tol = tol
+        self.width = np.log10(1 + tol)
+        self.basins = []
+        self.index = {}
+
+    def find(self, params):
+        """Number of the basin of the first point matching params, or None."""
+        params = np.asarray(params, dtype=float)
+        signs, cells = self._cell(params)
+        for offset in np.ndindex(*([3] * len(cells))):
+            key = signs + tuple(c + o - 1 for c, o in zip(cells, offset))
+            for point, i in self.index.get(key, []):
+                if np.all(np.abs(params - point)
+                        <= self.tol * np.maximum(np.abs(params), np.abs(point))):
+                    return i
+        return None
+
+    def add(self, popt, probe=None):
+        """Record a converged fit and the probe point that led to it.
+
+        The fit joins the basin of a matching point or starts a new one.
+        Returns the basin number.
+        """
+        popt = np.array(popt, dtype=float)
+        i = self.find(popt)
+        if i is None:
+            i = len(self.basins)
+            self.basins.append(dict(popt=popt, fitted=0, skipped=0))
+            self._insert(popt, i)
+        self.basins[i]['fitted'] += 1
+        if probe is not None and self.find(probe) is None:
+            self._insert(np.array(probe, dtype=float), i)
+        return i
+
+    def summary_lines(self, names, max_basins=20):
+        """Report lines: one summary line and one line per basin.
+
+        Only the max_basins basins with the most guesses are listed.
+        """
+        skipped = sum(b['skipped'] for b in self.basins)
+        fitted = sum(b['fitted'] for b in self.basins)
+        lines = ['Basin cache (tolerance {:0.1e}): {} basins, {} guesses fitted, '
+            '{} skipped'.format(self.tol, len(self.basins), fitted, skipped)]
+        order = sorted(range(len(self.basins)),
+            key=lambda i: -(self.basins[i]['fitted'] + self.basins[i]['skipped']))
+        for i in order[:max_basins]:
+            b = self.basins[i]
+            params = ', '.join('{} {:0.6e}'.format(n, p) for n, p in zip(names, b['popt']))
+            lines.append('\tbasin {}: {}: fitted {}, skipped {}'.format(i + 1,
+                params, b['fitted'], b['skipped']))
+        if len(order) > max_basins:
+            lines.append('\t... {} more basins'.format(len(order) - max_basins))
+        return lines
+
+    def _insert(self, point, basin):
+        signs, cells = self._cell(point)
+        self.index.setdefault(signs + cells, []).append((point, basin))
+
+    def _cell(self, params):
+        params = np.asarray(params, dtype=float)
+        with np.errstate(divide='ignore'):
+            logs = np.log10(np.maximum(np.abs(params), 1e-300))
+        signs = tuple(int(np.sign(p)) for p in params)
+        cells = tuple(int(np.floor(l / self.width)) for l in logs)
+        return signs, cells
+
+def scalar_fits(model, time, conc, grid, bounds, jac=None, batch_size=None,
+        ftol=1e-8, rtol=1e-12):
+    """Find every local minimum of a one-parameter fit along a grid.
+
+    The SSE is evaluated at every grid point (in batches, no fitting). Each
+    grid point lower than its left neighbor and no higher than its right
+    neighbor brackets a minimum between the grid points on either side.
+    Neighboring brackets separated by a barrier of less than ftol (relative
+    SSE) are merged, keeping the lower one: rounding in the model makes the
+    SSE step like a staircase where it is flat, and those steps are not
+    minima. With
+    jac, the bracket is refined with brentq on the analytic derivative of the
+    SSE when the derivative changes sign across it; otherwise (and at the
+    ends of the grid) with a bounded Brent minimization of the SSE.
+
+    Keyword arguments:
+    model, jac - batched model and Jacobian of a single parameter
+    grid - increasing parameter values, e.g. a log-spaced guess list
+    bounds - ([lower], [upper]) as for curve_fit
+    ftol - smallest relative SSE barrier between two distinct minima
+    rtol - relative tolerance of the refined parameter; minima closer than
+           1e3 * rtol are reported once
+    Yields (grid guess, popt, pcov) for each distinct minimum, in grid order.
+    """
+    grid = np.ravel(np.array(grid, dtype=float))
+    lower, upper = np.ravel(bounds[0])[0], np.ravel(bounds[1])[0]
+    sse = _grid_sse(model, time, conc, grid[:, None], batch_size)
+    left = np.concatenate([[np.inf], sse[:-1]])
+    right = np.concatenate([sse[1:], [np.inf]])
+    candidates = []
+    for j in np.flatnonzero(np.isfinite(sse) & (sse < left) & (sse <= right)):
+        if candidates:
+            i = candidates[-1]
+            barrier = np.max(sse[i:j + 1])
+            if barrier - max(sse[i], sse[j]) <= ftol * barrier:
+                if sse[j] < sse[i]:
+                    candidates[-1] = j
+                continue
+        candidates.append(j)
+
+    def cost(x):
+        _, c = _residuals(model, time, conc, [[x]])
+        return c[0] if np.isfinite(c[0]) else np.inf
+
+    def gradient(x):
+        res, _ = _residuals(model, time, conc, [[x]])
+        return 2 * np.sum(res[0] * jac(time, [[x]])[0, :, 0])
+
+    found = []
+    for i in candidates:
+        lo = max(grid[max(i - 1, 0)], lower)
+        hi = min(grid[min(i + 1, len(grid) - 1)], upper)
+        x = grid[i]
+        with np.errstate(all='ignore'):
+            g_lo = gradient(lo) if jac is not None else np.nan
+            g_hi = gradient(hi) if jac is not None else np.nan
+            if g_lo < 0 < g_hi:
+                x = brentq(gradient, lo, hi, xtol=rtol * abs(lo), rtol=rtol)
+            elif hi > lo:
+                result = minimize_scalar(cost, bounds=(lo, hi), method='bounded',
+                    options=dict(xatol=rtol * max(abs(lo), abs(hi))))
+                x = result.x if result.fun <= cost(x) else x
+            res, c = _residuals(model, time, conc, [[x]])
+        if not np.isfinite(c[0]):
+            continue
+        if found and abs(x - found[-1][1]) <= 1e3 * rtol * abs(x):
+            if c[0] < found[-1][2]:
+                found[-1] = (grid[i], x, c[0])
+            continue
+        found.append((grid[i], x, c[0]))
+
+    for guess, x, c in found:
+        if jac is not None:
+            J = jac(time, [[x]])
+        else:
+            J = _fd_jacobian(model, time, np.array([[x]]), np.array([upper]))
+        pcov = _covariance(J, np.array([c]), len(time))[0]
+        yield [guess], np.array([x]), pcov
+
+def parallel_fits(model, time, conc, guesses, bounds, jac=None, workers=None,
+        engine='batched'):
+    """Run serial_fits() or batched_fits() over a process pool.
+
+    Keyword arguments:
+    model - batched model, model(time, params) -> (n_sets, n_points). Sample
+            constants must be bound in (e.g. with functools.partial) rather
+            than read from script globals.
+    jac - batched Jacobian with the same signature, or None
+    workers - number of worker processes (default: all cores). With 1 the
+              engine runs in this process.
+    engine - 'serial' (curve_fit per guess) or 'batched'
+
+    The guess list is cut into contiguous chunks and the chunk results are
+    yielded back in guess order, so the output is identical for any number
+    of workers. Processes are forked; where fork is not available the engine
+    runs in this process instead, since the fit scripts cannot be re-imported
+    by spawned workers.
+    """
+    guesses = [list(g) for g in guesses]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('fork is not available, fitting in a single process')
+        workers = 1
+
+    if workers <= 1:
+        yield from _fit_chunk(engine, model, time, conc, guesses, bounds, jac,
+            progress=True)
+        return
+
+    yield from pool_fits(functools.partial(_fit_chunk, engine, model, time, conc,
+        bounds=bounds, jac=jac), guesses, workers)
+
+def pool_fits(fit_chunk, guesses, workers):
+    """Run fit_chunk on contiguous chunks of guesses in a forked process pool.
+
+    fit_chunk(guesses) must return a list of fits and be picklable (e.g. a
+    functools.partial of a module level function). The fits are yielded in
+    guess order.
+    """
+    n_chunks = max(1, min(len(guesses), workers * CHUNKS_PER_WORKER))
+    edges = np.linspace(0, len(guesses), n_chunks + 1).astype(int)
+    chunks = [guesses[edges[i]:edges[i + 1]] for i in range(n_chunks)]
+
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(fit_chunk, chunk) for chunk in chunks]
+        try:
+            for future in tqdm(futures):
+                yield from future.result()
+        finally:
+            # stopped early: don't wait for chunks that have not started
+            for future in futures:
+                future.cancel()
+
+class EarlyStop:
+    """Stopping rules for a multistart loop.
+
+    Two rules, either or both of which can be used:
+    patience - stop after this many consecutive fits without a new best MSE
+    confidence - stop once the Bayesian probability that the best MSE is the
+            global minimum reaches this value. With n fits of which r reached
+            the best MSE (to within rtol), that probability is at least
+                1 - (n + 1)! (2n - r)! / ((2n + 1)! (n - r)!)
+            (Snyman & Fatti, J. Optim. Theory Appl. 54, 1987).
+
+    Both rules assume the starts are drawn in random order; use shuffled()
+    on a structured guess grid.
+    """
+    def __init__(self, patience=0, confidence=0, rtol=1e-6):
+        self.patience = patience
+        self.confidence = confidence
+        self.rtol = rtol
+        self.mses = []
+        self.best = np.inf
+        self.since_best = 0
+        self.reason = None
+
+    def update(self, mse):
+        """Record the MSE of one more fit; True if the loop should stop."""
+        if not np.isfinite(mse):
+            mse = np.inf
+        self.mses.append(mse)
+        if mse < self.best * (1 - self.rtol):
+            self.since_best = 0
+        else:
+            self.since_best += 1
+        self.best = min(self.best, mse)
+        if self.patience > 0 and self.since_best >= self.patience:
+            self.reason = 'no new best MSE in {} fits'.format(self.patience)
+        elif self.confidence > 0 and self.probability() >= self.confidence:
+            self.reason = 'confidence {} reached'.format(self.confidence)
+        return self.reason is not None
+
+    def hits(self):
+        """Number of fits that reached the best MSE."""
+        return int(np.sum(np.array(self.mses) <= self.best * (1 + self.rtol)))
+
+    def probability(self):
+        """Lower bound on the probability that the best MSE is the global one."""
+        n = len(self.mses)
+        r = self.hits()
+        if n == 0 or not np.isfinite(self.best):
+            return 0.0
+        log_miss = (math.lgamma(n + 2) + math.lgamma(2 * n - r + 1)
+            - math.lgamma(2 * n + 2) - math.lgamma(n - r + 1))
+        return 1 - math.exp(log_miss)
+
+    def watch(self, fits, model, time, conc):
+        """Pass fits through, stopping the engine when a rule triggers.
+
+        model is the batched model, used to get the MSE of each fit. fits is an
+        engine generator, closed when the loop stops, or a list of fits (e.g.
+        from decimated_fits()).
+        """
+        fits = iter(fits)
+        try:
+            for fit in fits:
+                _, cost = _residuals(model, time, conc, [fit[1]])
+                yield fit
+                if self.update(cost[0] / len(time)):
+                    break
+        finally:
+            if hasattr(fits, 'close'):
+                fits.close()
+
+    def summary(self, n_guesses):
+        """Report line: starts used, why the loop stopped and the confidence."""
+        return ('Early stopping: {}: {} fits from {} guesses; best MSE reached by {} '
+            'fits, P(global minimum found) >= {:0.6f}').format(
+            self.reason or 'not triggered', len(self.mses), n_guesses,
+            self.hits(), self.probability())
+
+def shuffled(guesses, seed=0):
+    """Guesses in a reproducible random order, for EarlyStop."""
+    order = np.random.default_rng(seed).permutation(len(guesses))
+    return [guesses[i] for i in order]
+
+def local_guesses(center, bounds, decades, num):
+    """Log-spaced guess grid around a known solution, clipped to the bounds.
+
+    Keyword arguments:
+    center - parameter set to search around (all values nonzero)
+    bounds - ([lower], [upper]) as for curve_fit
+    decades - half width of the grid in each parameter, in decades, e.g.
+              [0.5, 0.05] for +/-0.5 decades of chi_p and +/-12% of r
+    num - number of values for each parameter
+    Returns: (guesses in C order, grid shape)
+    """
+    axes = []
+    for c, lo, hi, d, k in zip(center, bounds[0], bounds[1], decades, num):
+        values = c * np.logspace(-d, d, num=k)
+        axes.append(np.unique(np.clip(values, lo, hi)))
+    grid = np.meshgrid(*axes, indexing='ij')
+    guesses = np.stack([g.ravel() for g in grid], axis=1)
+    return [list(g) for g in guesses], tuple(len(a) for a in axes)
+
+def screen_guesses(model, time, conc, guesses, grid_shape=None, top_k=50,
+        rule='both', batch_size=None):
+    """Pick starting guesses from a guess grid by their sum of squared residuals.
+
+    No fitting happens here: the model is evaluated once per guess, in batches.
+
+    Keyword arguments:
+    model - batched model, model(time, params) -> (n_sets, n_points)
+    guesses - list of guesses, in C order over grid_shape
+    grid_shape - shape of the guess grid, e.g. (num_chi_guesses, num_r_guesses),
+          used to find local minima (default: treat the guesses as a 1-D grid)
+    top_k - number of lowest SSE guesses kept by the 'topk' rule
+    rule - 'topk' keeps the top_k guesses, 'minima' keeps the guesses whose SSE
+           is no larger than any of their grid neighbors, 'both' keeps both
+    Returns: (selected guesses in their original order, summary line for the
+    fit report)
+    """
+    if rule not in ('topk', 'minima', 'both'):
+        raise ValueError('unknown screening rule: ' + str(rule))
+    params = np.array(guesses, dtype=float)
+    if params.ndim == 1:
+        params = params[:, None]
+    if grid_shape is None:
+        grid_shape = (len(params),)
+    sse = _grid_sse(model, time, conc, params, batch_size)
+
+    keep = np.zeros(len(params), dtype=bool)
+    n_top = 0
+    n_minima = 0
+    if rule in ('topk', 'both'):
+        top = np.argsort(sse, kind='stable')[:top_k]
+        top = top[np.isfinite(sse[top])]
+        keep[top] = True
+        n_top = len(top)
+    if rule in ('minima', 'both'):
+        minima = _grid_minima(sse.reshape(grid_shape)).ravel()
+        keep |= minima
+        n_minima = int(np.sum(minima))
+
+    summary = ('Screening: rule {}, K={}: {} lowest SSE guesses + {} grid minima '
+        '-> {} of {} guesses fitted').format(rule, top_k, n_top, n_minima,
+        int(np.sum(keep)), len(params))
+    return [guesses[i] for i in np.flatnonzero(keep)], summary
+
+def decimate(time, conc, factor):
+    """Average a series over bins of factor consecutive points.
+
+    Returns: (bin mean times, bin mean concentrations, number of points in
+    each bin); the last bin holds the remainder.
+    """
+    starts = np.arange(0, len(time), factor)
+    counts = np.diff(np.append(starts, len(time)))
+    return (np.add.reduceat(time, starts) / counts,
+        np.add.reduceat(conc, starts) / counts, counts)
+
+def decimated_fits(model, time, conc, guesses, bounds, jac=None, factor=10,
+        keep=20, workers=1, engine='batched'):
+    """Multistart fit that screens on a decimated series and refines at full
+    resolution.
+
+    Every guess is fitted to the bin-averaged series (see decimate()), with
+    each bin weighted by its point count, at about 1/factor of the cost of a
+    full-resolution fit. The coarse fits are ranked by their weighted SSE and
+    the best `keep` distinct ones are refitted on the full series, starting
+    from their coarse parameters.
+
+    Keyword arguments are as for parallel_fits().
+    Returns: (list of full-resolution (init_guess, popt, pcov) in guess order,
+    where init_guess is the guess of the coarse fit, summary line for the fit
+    report)
+    """
+    guesses = [list(g) for g in guesses]
+    t_bin, c_bin, counts = decimate(time, conc, factor)
+    weights = np.sqrt(counts)
+    coarse = list(parallel_fits(_Weighted(model, weights), t_bin, c_bin * weights,
+        guesses, bounds, jac=None if jac is None else _Weighted(jac, weights),
+        workers=workers, engine=engine))
+    if len(coarse) == 0:
+        return [], 'Decimated screening: factor {}, no coarse fits'.format(factor)
+
+    # rank the coarse fits and keep the best distinct optima
+    _, coarse_sse = _residuals(_Weighted(model, weights), t_bin, c_bin * weights,
+        [popt for _, popt, _ in coarse])
+    order = np.argsort(np.where(np.isfinite(coarse_sse), coarse_sse, np.inf), kind='stable')
+    survivors = {}
+    for i in order:
+        optimum = tuple(np.round(np.log10(np.abs(coarse[i][1]) + 1e-300), 4))
+        if np.isfinite(coarse_sse[i]) and optimum not in survivors:
+            survivors[optimum] = i
+        if len(survivors) == keep:
+            break
+    survivors = sorted(survivors.values())
+
+    starts = [list(coarse[i][1]) for i in survivors]
+    origin = {tuple(start): coarse[i][0] for start, i in zip(starts, survivors)}
+    fits = [(origin[tuple(start)], popt, pcov) for start, popt, pcov in parallel_fits(
+        model, time, conc, starts, bounds, jac=jac, workers=workers, engine=engine)]
+
+    # how far full resolution moved the best coarse fit
+    summary = ('Decimated screening: factor {} ({} -> {} points), {} coarse fits from {} '
+        'guesses, best {} refined at full resolution').format(factor, len(time),
+        len(t_bin), len(coarse), len(guesses), len(starts))
+    if len(fits) > 0:
+        best_coarse = coarse[order[0]][1]
+        _, sse = _residuals(model, time, conc, [best_coarse] + [popt for _, popt, _ in fits])
+        best = np.nanargmin(sse[1:])
+        change = (fits[best][1] - best_coarse) / np.abs(fits[best][1])
+        summary += ('; best fit change from coarse to full resolution: {} (relative), '
+            'MSE {:0.6e} -> {:0.6e}').format(', '.join('{:+0.2e}'.format(c) for c in change),
+            sse[0] / len(time), sse[1 + best] / len(time))
+    return fits, summary
+
+def batched_curve_fit(model, time, conc, p0, bounds, jac=None, max_iter=200,
+        ftol=1e-8, xtol=1e-8):
+    """Least squares fit of many starts at once.
+
+    Returns popt (n_starts x n_params), pcov (n_starts x n_params x n_params)
+    and a boolean array marking the starts that converged.
+    """
+    p = np.array(p0, dtype=float)
+    n_starts, n_params = p.shape
+    lb = np.broadcast_to(np.asarray(bounds[0], dtype=float), (n_params,))
+    ub = np.broadcast_to(np.asarray(bounds[1], dtype=float), (n_params,))
+    if jac is None:
+        jac = lambda t, params, y0=None: _fd_jacobian(model, t, params, ub, y0)
+    else:
+        jac_fn = jac
+        jac = lambda t, params, y0=None: jac_fn(t, params)
+
+    # curve_fit refuses guesses outside of the bounds
+    in_bounds = np.all((p >= lb) & (p <= ub), axis=1)
+    p = np.clip(p, lb, ub)
+
+    res, cost = _residuals(model, time, conc, p)
+    active = in_bounds & np.isfinite(cost)
+    converged = np.zeros(n_starts, dtype=bool)
+    lam = np.full(n_starts, 1e-3)
+    eye = np.eye(n_params)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        J = jac(time, p[idx], res[idx] + conc)
+        A = np.matmul(J.transpose(0, 2, 1), J)
+        g = np.matmul(J.transpose(0, 2, 1), res[idx][:, :, None])[:, :, 0]
+        scale = np.maximum(np.diagonal(A, axis1=1, axis2=2), 1e-300)
+
+        # hold parameters that sit on a bound the descent direction points past
+        held = ((p[idx] <= lb) & (g > 0)) | ((p[idx] >= ub) & (g < 0))
+        free = ~held
+        A = A * (free[:, :, None] & free[:, None, :]) + held[:, :, None] * eye
+        g = np.where(held, 0, g)
+
+        # raise the damping of each start until its step lowers the cost
+        pending = np.ones(len(idx), dtype=bool)
+        while np.any(pending):
+            sub = np.flatnonzero(pending)
+            ids = idx[sub]
+            M = A[sub] + lam[ids, None, None] * scale[sub, :, None] * eye
+            step = _solve(M, -g[sub])
+            p_new = np.clip(p[ids] + step, lb, ub)
+            res_new, cost_new = _residuals(model, time, conc, p_new)
+
+            accept = np.isfinite(cost_new) & (cost_new < cost[ids])
+            acc = ids[accept]
+            dp = np.abs(p_new[accept] - p[acc])
+            small_step = np.all(dp <= xtol * (np.abs(p[acc]) + xtol), axis=1)
+            small_drop = (cost[acc] - cost_new[accept]) <= ftol * cost[acc]
+            p[acc] = p_new[accept]
+            res[acc] = res_new[accept]
+            cost[acc] = cost_new[accept]
+            lam[acc] = np.maximum(lam[acc] / 10, 1e-12)
+            done = acc[small_step | small_drop]
+            converged[done] = True
+            active[done] = False
+
+            # no step lowers the cost: the start sits at a minimum
+            rej = ids[~accept]
+            lam[rej] *= 10
+            stuck = rej[lam[rej] > 1e12]
+            converged[stuck] = np.isfinite(cost[stuck])
+            active[stuck] = False
+
+            pending[sub[accept]] = False
+            pending[sub[~accept][lam[rej] > 1e12]] = False
+
+    pcov = np.full((n_starts, n_params, n_params), np.inf)
+    idx = np.flatnonzero(converged)
+    if len(idx) > 0:
+        pcov[idx] = _covariance(jac(time, p[idx]), cost[idx], len(time))
+
+    return p, pcov, converged
+
+def _grid_sse(model, time, conc, params, batch_size=None):
+    """SSE of every parameter set, in batches; inf where the model fails."""
+    if batch_size is None:
+        batch_size = max(1, int(MAX_BATCH_VALUES // max(len(time), 1)))
+    sse = np.empty(len(params))
+    for start in range(0, len(params), batch_size):
+        _, sse[start:start + batch_size] = _residuals(model, time, conc,
+            params[start:start + batch_size])
+    sse[np.isnan(sse)] = np.inf
+    return sse
+
+def _grid_minima(sse):
+    """Mark finite cells whose value is <= that of every neighboring cell."""
+    padded = np.pad(sse, 1, constant_values=np.inf)
+    minima = np.isfinite(sse)
+    for offset in np.ndindex(*([3] * sse.ndim)):
+        if all(o == 1 for o in offset):
+            continue
+        window = tuple(slice(o, o + n) for o, n in zip(offset, sse.shape))
+        minima &= sse <= padded[window]
+    return minima
+
+def _fit_chunk(engine, model, time, conc, guesses, bounds, jac, progress=False):
+    if engine == 'serial':
+        single_jac = None if jac is None else _SingleStart(jac)
+        fits = serial_fits(_SingleStart(model), time, conc, guesses, bounds,
+            jac=single_jac, progress=progress)
+    else:
+        fits = batched_fits(model, time, conc, guesses, bounds, jac=jac,
+            progress=progress)
+    return fits if progress else list(fits)
+
+class _SingleStart:
+    """curve_fit style wrapper, f(t, *params), around a batched function."""
+    def __init__(self, batched):
+        self.batched = batched
+
+    def __call__(self, t, *params):
+        return self.batched(t, [params])[0]
+
+class _Weighted:
+    """Batched model or Jacobian with each point scaled by a weight."""
+    def __init__(self, batched, weights):
+        self.batched = batched
+        self.weights = weights
+
+    def __call__(self, t, params):
+        values = self.batched(t, params)
+        if values.ndim == 3:
+            return values * self.weights[:, None]
+        return values * self.weights
+
+def _residuals(model, time, conc, params):
+    with np.errstate(all='ignore'):
+        res = model(time, params) - conc
+        cost = np.sum(res**2, axis=1)
+    cost[~np.isfinite(cost)] = np.nan
+    return res, cost
+
+def _fd_jacobian(model, time, params, ub, y0=None):
+    """Forward difference Jacobian of a batched model, one column per call.
+
+    Uses the same step as curve_fit (sqrt(eps) * max(1, |x|)), stepping
+    backwards when a forward step would leave the upper bound.
+    """
+    n_sets, n_params = params.shape
+    with np.errstate(all='ignore'):
+        if y0 is None:
+            y0 = model(time, params)
+        J = np.empty((n_sets, len(time), n_params))
+        for j in range(n_params):
+            h = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(params[:, j]), 1)
+            h = np.where(params[:, j] + h > ub[j], -h, h)
+            stepped = params.copy()
+            stepped[:, j] += h
+            J[:, :, j] = (model(time, stepped) - y0) / h[:, None]
+    J[~np.isfinite(J)] = 0
+    return J
+
+def _solve(M, b):
+    with np.errstate(all='ignore'):
+        try:
+            return np.linalg.solve(M, b[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            pass
+        # only the singular systems fall back to the pseudo-inverse, so a
+        # start's steps do not depend on the other starts of the batch
+        step = np.empty_like(b)
+        for i in range(len(M)):
+            try:
+                step[i] = np.linalg.solve(M[i], b[i])
+            except np.linalg.LinAlgError:
+                step[i] = np.linalg.pinv(M[i]) @ b[i]
+        return step
+
+def _covariance(J, cost, n_points):
+    """Parameter covariance as computed by curve_fit (absolute_sigma=False).
+
+    The Jacobian columns are normalized first: chi_p and r differ by ~10
+    orders of magnitude, which would otherwise push the chi_p singular value
+    below the pseudo-inverse cutoff.
+    """
+    n_params = J.shape[2]
+    norms = np.sqrt(np.sum(J**2, axis=1))
+    norms = np.where(norms > 0, norms, 1)
+    _, s, VT = np.linalg.svd(J / norms[:, None, :], full_matrices=False)
+    threshold = np.finfo(float).eps * max(J.shape[1:]) * s[:, :1]
+    s_inv_sq = np.where(s > threshold, 1 / np.where(s > 0, s, 1)**2, 0)
+    pcov = np.einsum('sji,sj,sjk->sik', VT, s_inv_sq, VT)
+    pcov /= norms[:, :, None] * norms[:, None, :]
+    if n_points > n_params:
+        pcov *= (cost / (n_points - n_params))[:, None, None]
+    else:
+        pcov[:] = np.inf
+    return pcov
@@ -0,0 +1,258 @@
+# runstore.py
+#
+# Campaign store: the raw runs of a campaign packed into a single file.
+#
+# A campaign's runs are thousands of small text files found through the
+# Directory and File columns of the log. pack() reads them once and writes one
+# uncompressed .npz file with the time and lux columns of all runs stored
+# end to end, the offset of each run, and an index of the runs: file key,
+# sample, magnet and date from the log, plus the run file header. RunStore
+# reads the store back and serves runs by file key (or selects them by sample,
+# magnet and date) without touching the data folder tree.
+#
+# The time and lux columns are memory mapped from the store file, read only:
+# RunStore.columns() gives views into the mapping, so only the pages of the
+# runs actually used are read into memory, and slicing a run (e.g. truncating
+# it at its global minimum) copies nothing.
+#
+# Pack a campaign (from the folder the fit scripts are run in, with code/ on
+# PYTHONPATH):
+# >>> python -m map_fit store <log_file> <store file> [list file | pattern] [-where query] [-workers N]
+#
+#   <store file>  store to write, e.g. revision.npz
+#   <list file>   file with data files to pack, as for the fit scripts
+#   <pattern>     glob matched against the File column of the log, e.g. '829_*'
+#                 (default: every file of the log)
+#   -where query  only pack files whose log entry matches a pandas query
+#   -workers N    number of threads reading the run files (default 8)
+#
+# The fit scripts read their runs from a store with -store <store file>.
+#
+# Created: 2026.10.18
+
+import os
+import struct
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from . import batch, flags, maplog, runfile
+
+# columns of the run index, besides the header of each run
+INDEX_COLUMNS = ['key', 'sample', 'magnet', 'date']
+
+# columns the runs can be selected by
+SELECT_COLUMNS = ['sample', 'magnet', 'date']
+
+_stores = {}
+
+file_key = maplog.file_key
+
+def run_path(entry, data_dir=maplog.LOG_DIR):
+    """Path of the run file of a log entry, as the fit scripts build it."""
+    return data_dir + maplog.run_dir(entry['Directory']) + file_key(entry['File']) + '.txt'
+
+def pack(log_df, store_path, keys=None, data_dir=maplog.LOG_DIR,
+        workers=runfile.DEFAULT_WORKERS):
+    """Pack the runs of a log into a store.
+
+    Keyword arguments:
+    log_df - log sheet of the log workbook
+    store_path - store file to write (.npz)
+    keys - file keys to pack (default every file of the log)
+    data_dir - folder the Directory column of the log is relative to
+    workers - number of threads reading the run files
+    Returns: the written RunStore
+    """
+    log_df = log_df.drop_duplicates('File')
+    entries = {file_key(e['File']): e for _, e in log_df.iterrows()}
+    keys = list(entries) if keys is None else [file_key(k) for k in keys]
+    missing = [k for k in keys if k not in entries]
+    if missing:
+        raise KeyError('not in the log: ' + ', '.join(missing))
+
+    paths = [run_path(entries[k], data_dir) for k in keys]
+    data = runfile.load_many(paths, workers=workers)
+    headers = [runfile.read_header(p) for p in paths]
+
+    offsets = np.concatenate([[0], np.cumsum([len(d) for d in data])]).astype(np.int64)
+    arrays = dict(
+        time=np.concatenate([d[:, 0] for d in data]) if data else np.zeros(0),
+        lux=np.concatenate([d[:, 1] for d in data]) if data else np.zeros(0),
+        offsets=offsets,
+        key=np.array(keys, dtype=str),
+        sample=np.array([_text(entries[k].get('Sample')) for k in keys], dtype=str),
+        magnet=np.array([_text(entries[k].get('Magnet')) for k in keys], dtype=str),
+        date=np.array([_date(entries[k].get('Date')) for k in keys], dtype=str),
+        name=np.array([_text(h['name']) for h in headers], dtype=str),
+        run_time=np.array([_text(h['run_time']) for h in headers], dtype=str),
+        source=np.array(paths, dtype=str),
+    )
+    # uncompressed, so the arrays can be mapped straight from the file; written
+    # to a new file first, as a store that is open in memory maps stays valid
+    tmp_path = store_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, store_path)
+    return RunStore(store_path)
+
+class RunStore:
+    """Runs of a campaign store.
+
+    Keyword arguments:
+    path - store file written by pack()
+
+    mmap - memory map the time and lux columns (default), instead of reading
+           them into memory
+
+    store.columns(key) gives the time and lux of a run as read-only views,
+    store.load(key) gives a run as runfile.load() does, store.index is a
+    DataFrame of the runs indexed by file key, and store.select() finds runs
+    by sample, magnet and date.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with np.load(path) as z:
+            if mmap:
+                self.time = _memmap_member(path, 'time')
+                self.lux = _memmap_member(path, 'lux')
+            else:
+                self.time = z['time']
+                self.lux = z['lux']
+                self.time.flags.writeable = False
+                self.lux.flags.writeable = False
+            self.offsets = z['offsets']
+            self.index = pd.DataFrame({c: z[c] for c in
+                INDEX_COLUMNS + ['name', 'run_time', 'source']})
+        self.index['n_points'] = np.diff(self.offsets)
+        self.index = self.index.set_index('key', drop=False)
+
+        # hash indexes of the runs
+        self._rows = {k: i for i, k in enumerate(self.index['key'])}
+        self._by = {c: {} for c in SELECT_COLUMNS}
+        for c in SELECT_COLUMNS:
+            for i, value in enumerate(self.index[c]):
+                self._by[c].setdefault(value, []).append(i)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return file_key(key) in self._rows
+
+    def keys(self):
+        return list(self._rows)
+
+    def columns(self, key):
+        """Time and lux of a run, as two read-only views into the store."""
+        start, end = self._span(key)
+        return self.time[start:end], self.lux[start:end]
+
+    def load(self, key):
+        """Time and lux columns of a run, shape (n_points, 2), as runfile.load()
+        (a copy; columns() gives the run without copying)."""
+        return np.column_stack(self.columns(key))
+
+    def header(self, key):
+        """Header of a run, as runfile.read_header()."""
+        row = self.index.iloc[self._row(key)]
+        run_time = row['run_time'] or None
+        return dict(name=row['name'] or None, run_time=run_time,
+            run_seconds=None if run_time is None else runfile._seconds(run_time))
+
+    def select(self, sample=None, magnet=None, date=None):
+        """File keys of the runs matching every given sample, magnet and date."""
+        rows = None
+        for column, value in zip(SELECT_COLUMNS, [sample, magnet, date]):
+            if value is not None:
+                match = set(self._by[column].get(str(value), []))
+                rows = match if rows is None else rows & match
+        rows = range(len(self)) if rows is None else sorted(rows)
+        return [self.index['key'].iat[i] for i in rows]
+
+    def _row(self, key):
+        try:
+            return self._rows[file_key(key)]
+        except KeyError:
+            raise KeyError('run {} is not in the store {}'.format(file_key(key),
+                self.path)) from None
+
+    def _span(self, key):
+        i = self._row(key)
+        return self.offsets[i], self.offsets[i + 1]
+
+def open_store(path):
+    """RunStore of a store file, kept open for later calls in this process
+    (until the file changes)."""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _stores:
+        _stores[key] = RunStore(path)
+    return _stores[key]
+
+def _memmap_member(path, name):
+    """Read-only memory map of an array stored uncompressed in a .npz file."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError('{} is compressed in {}; pack the store again'.format(name, path))
+    with open(path, 'rb') as f:
+        # the member's data follows its local file header
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+        order='F' if fortran_order else 'C')
+
+def _missing(value):
+    return value is None or (np.isscalar(value) and pd.isna(value)) or value is pd.NaT
+
+def _text(value):
+    return '' if _missing(value) else str(value)
+
+def _date(value):
+    if _missing(value):
+        return ''
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y.%m.%d')
+    return str(value)
+
+def main(argv):
+    argv, opts = flags.pop_flags(argv, {'where': None,
+        'workers': runfile.DEFAULT_WORKERS})
+    if len(argv) < 3:
+        sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python -m map_fit '
+            'store <log_file> <store file> [list file | pattern] [-where query] '
+            '[-workers N]')
+    log_name, store_path = argv[1], argv[2]
+    try:
+        log_df = maplog.read_log(maplog.log_path(log_name))['log']
+    except Exception as e:
+        sys.exit('ERROR: Invalid log file: {}'.format(e))
+
+    selection = argv[3] if len(argv) > 3 else '*'
+    lines = batch.select_files(log_df, selection, opts['where'])
+    keys = [file_key(f) for line in lines for f in line.split()]
+    if not keys:
+        sys.exit('ERROR: no files selected.')
+
+    start = time.time()
+    try:
+        store = pack(log_df, store_path, list(dict.fromkeys(keys)),
+            workers=opts['workers'])
+    except (KeyError, OSError, ValueError) as e:
+        sys.exit('ERROR: could not pack the runs: {}'.format(e))
+    print('Packed {} runs ({} points) into {} ({:0.1f} MB) in {:0.1f} s.'.format(
+        len(store), len(store.time), store_path,
+        os.path.getsize(store_path) / 1e6, time.time() - start))
@@ -0,0 +1,153 @@
+# Tests for the batch runner and the cached log reader
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import os
+import pandas as pd
+
+from map_fit import batch, maplog
+
+def test_select_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_df = pd.DataFrame({'File': ['829_01', '829_02', '830_01'],
+        'Sample': ['dm81', 'dm82', 'dm81']})
+    with open('runs.txt', 'w') as f:
+        f.write('829_01\n\n# 829_02\n830_01.txt\n')
+    assert batch.select_files(log_df, 'runs') == ['829_01', '830_01.txt']
+    assert batch.select_files(log_df, '829_*') == ['829_01', '829_02']
+    assert batch.select_files(log_df, 'runs.txt', "Sample == 'dm81'") == ['829_01', '830_01.txt']
+    assert batch.select_files(log_df, '*', "Sample == 'dm82'") == ['829_02']
+
+def test_read_sheet_cached_until_modified(tmp_path):
+    path = str(tmp_path / 'log.xlsx')
+    pd.DataFrame({'File': ['run01'], 'Magnet': ['01']}).to_excel(path,
+        sheet_name='log', index=False)
+    log_df = maplog.read_sheet(path, 'log', dtype={'Magnet': str})
+    assert log_df['Magnet'][0] == '01'
+    log_df.loc[0, 'File'] = 'changed'
+    assert maplog.read_sheet(path, 'log', dtype={'Magnet': str})['File'][0] == 'run01'
+
+    pd.DataFrame({'File': ['run02'], 'Magnet': ['02']}).to_excel(path,
+        sheet_name='log', index=False)
+    os.utime(path, (0, 0))
+    assert maplog.read_sheet(path, 'log', dtype={'Magnet': str})['File'][0] == 'run02'
+
+def test_read_workbook_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'log.xlsx')
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'File': ['run01'], 'Magnet': ['01']}).to_excel(writer,
+            sheet_name='log', index=False)
+        pd.DataFrame({'ID': ['S1'], 'Radius': [0.5]}).to_excel(writer,
+            sheet_name='samples', index=False)
+        pd.DataFrame({'ID': ['01'], 'Grade': [42]}).to_excel(writer,
+            sheet_name='magnets', index=False)
+    sheets = maplog.read_log(path)
+    assert os.path.exists(maplog.snapshot_path(path))
+    str_sheets = maplog.read_workbook(path, {}, default_dtype='str')
+    assert list(str_sheets) == ['log', 'samples', 'magnets']
+
+    # a new process loads both parses from the snapshot, without reading Excel
+    maplog._workbooks.clear()
+    def no_excel(*args, **kwargs):
+        raise AssertionError('workbook parsed again')
+    monkeypatch.setattr(pd, 'ExcelFile', no_excel)
+    snap_sheets = maplog.read_log(path)
+    for sheet in maplog.SHEET_DTYPES:
+        pd.testing.assert_frame_equal(snap_sheets[sheet], sheets[sheet])
+    assert snap_sheets['magnets']['ID'][0] == '01'
+    assert snap_sheets['magnets']['Grade'].dtype == float
+    assert maplog.read_workbook(path, {}, default_dtype='str')['samples']['Radius'][0] == '0.5'
+    assert maplog.read_sheet(path, 0, dtype='str')['Magnet'][0] == '01'
+
+    # editing the workbook makes the snapshot stale
+    monkeypatch.undo()
+    pd.DataFrame({'File': ['run02'], 'Magnet': ['02']}).to_excel(path,
+        sheet_name='log', index=False)
+    os.utime(path, (0, 0))
+    assert maplog.read_sheet(path, 'log', dtype={'Magnet': str})['File'][0] == 'run02'
+
+def test_log_index():
+    sheets = {
+        'log': pd.DataFrame({'File': ['run01', 'run02', 'run03', 'run04', 'run01', 'run06'],
+            'Directory': ['paper_data/runs', 'runs/', 'runs', 'runs', 'other', 'runs'],
+            'Sample': ['S1', 'S2', 'S9', 'S1', 'S1', 'S3'],
+            'Magnet': ['01', '01', '01', '03', '01', '01']}),
+        'samples': pd.DataFrame({'ID': ['S1', 'S2', 'S3'], 'Material': ['Fe3O4'] * 3,
+            'Density': [5170] * 3, 'Solvent': ['Water', 'DPBS', 'Water'],
+            'Radius': [4.4e-7, 0, 5e-7], 'Radius-std': [1e-8, 0, 'n/a'],
+            'Batch-date/Lot': ['lot1', 'lot2', 'lot3'], 'Conc.\n[mg/mL]': [0.5, 1.0, 0.5]}),
+        'magnets': pd.DataFrame({'ID': ['01', '03'], 'K&J magnet': ['BX8X8X8', 'BX0X0'],
+            'Length': [0.5, 0.5], 'Width': [0.5, 0.5], 'Height': [0.5, 0.5],
+            'Grade': [52.0, 48.0], 'Distance': [5.0, 5.0]}),
+    }
+    index = maplog.LogIndex(sheets)
+    run = index['run01.txt']
+    assert run.key == 'run01' and run.dir == 'runs/' # first entry of the file
+    assert (run.solvent_type, run.eta, run.chi_s) == ('Water', 8.9e-4, -9.04e-6)
+    assert run.b_r == 1.48 and run.window == [4.5, 5.5] and run.optimize_radius
+    assert index['run02'].radius == 'Unknown' and index['run02'].eta == 0.89e-3
+
+    runs, errors = index.resolve(['run01', 'run02\n', 'run03', 'run04', 'run05.txt'])
+    assert list(runs) == ['run01', 'run02']
+    assert errors == {'run03': 'Could not find sample S9 in sample log.',
+        'run04': 'Unknown magnet grade of 48.',
+        'run05': 'Could not find file run05.txt in log.'}
+    runs, errors = index.resolve(['run01', 'run02'], require_radius=True)
+    assert list(runs) == ['run01'] and list(errors) == ['run02']
+
+    # a bad radius std dev only matters where it is required
+    run = index['run06']
+    assert run.radius == 5e-7 and run.optimize_radius and run.radius_std is None
+    runs, errors = index.resolve(['run01', 'run06'], require_radius=True)
+    assert list(runs) == ['run01', 'run06']
+    runs, errors = index.resolve(['run01', 'run06'], require_radius=True,
+        require_radius_std=True)
+    assert errors == {'run06': 'Invalid radius std dev of sample S3.'}
+
+def test_log_index_rejects_non_finite_entries():
+    # empty cells of numeric columns are read as NaN
+    nan = float('nan')
+    sheets = {
+        'log': pd.DataFrame({'File': ['run01', 'run02', 'run03', 'run04', 'run05'],
+            'Directory': ['runs'] * 5, 'Sample': ['S1', 'S2', 'S3', 'S4', 'S5'],
+            'Magnet': ['01', '01', '01', '01', '02']}),
+        'samples': pd.DataFrame({'ID': ['S1', 'S2', 'S3', 'S4', 'S5'],
+            'Material': ['Fe3O4'] * 5, 'Density': [5170, nan, 5170, 5170, 5170],
+            'Solvent': ['Water'] * 5, 'Radius': [4.4e-7, 4.4e-7, nan, float('inf'), 4.4e-7],
+            'Radius-std': [nan, 1e-8, 1e-8, 1e-8, 1e-8],
+            'Batch-date/Lot': ['lot1'] * 5, 'Conc.\n[mg/mL]': [0.5, 0.5, 0.5, 0.5, nan]}),
+        'magnets': pd.DataFrame({'ID': ['01', '02'], 'K&J magnet': ['BX8X8X8'] * 2,
+            'Length': [0.5, 0.5], 'Width': [0.5, 0.5], 'Height': [0.5, 0.5],
+            'Grade': [52.0, 52.0], 'Distance': [5.0, nan]}),
+    }
+    index = maplog.LogIndex(sheets)
+    assert index['run01'].radius_std is None
+    assert index['run03'].radius == 'Unknown' and not index['run04'].optimize_radius
+    runs, errors = index.resolve(['run01', 'run02', 'run03', 'run04', 'run05'],
+        require_radius=True, require_radius_std=True)
+    assert runs == {}
+    assert errors == {'run01': 'Invalid radius std dev of sample S1.',
+        'run02': 'Invalid density - should be a numerical value with units kg/m^3.',
+        'run03': 'Cannot proceed with unknown radius of sample S3.',
+        'run04': 'Cannot proceed with unknown radius of sample S4.',
+        'run05': 'Invalid initial concentration.'}
+
+def test_run_batch_carries_group_state(tmp_path):
+    # a script counting the files of its group (first letter) before it
+    script = str(tmp_path / 'count.py')
+    with open(script, 'w') as f:
+        f.write('import sys\nfrom map_fit.batch import task_state\n'
+            'line = open(sys.argv[2]).read().strip()\n'
+            'seen = task_state().setdefault(line[0], [])\n'
+            'with open(sys.argv[3], "a") as f:\n'
+            '    f.write("{} {}\\n".format(line, len(seen)))\n'
+            'seen.append(line)\n')
+    out = str(tmp_path / 'out.txt')
+    lines = ['a1', 'b1', 'a2', 'c1', 'a3', 'b2']
+    results = batch.run_batch(script, 'log', lines, script_args=[out], workers=3,
+        groups=[line[0] for line in lines])
+    assert [error for _, error, _ in results] == [None] * len(lines)
+    counts = dict(l.split() for l in open(out).read().split('\n') if l)
+    assert counts == {'a1': '0', 'a2': '1', 'a3': '2', 'b1': '0', 'b2': '1', 'c1': '0'}
+    assert batch.task_state() is None
@@ -0,0 +1,83 @@
+# Tests for run checkpoints
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import functools
+import warnings
+import numpy as np
+import pytest
+
+from map_fit import checkpoint, models, multistart
+
+def fake_engine(guesses):
+    # skips every third guess, like an engine dropping failed starts
+    for g in guesses:
+        if int(g[0]) % 3 != 0:
+            yield g, np.array(g) * 2.0, np.eye(1)
+
+def test_resumed_fits_match_uninterrupted(tmp_path):
+    path = str(tmp_path / 'run.pkl')
+    guesses = [[float(i)] for i in range(20)]
+    full = list(fake_engine(guesses))
+
+    first = checkpoint.Checkpoint(path, dict(n=20), every=0)
+    fits = first.fits('run01', fake_engine, guesses)
+    partial = [next(fits) for _ in range(7)]
+    fits.close()
+
+    second = checkpoint.Checkpoint(path, dict(n=20), resume=True)
+    assert second.resumed
+    assert second.state['fits'][1] == 11 # guesses up to the 7th fit are done
+    resumed = list(second.fits('run01', fake_engine, guesses))
+    assert [f[0] for f in resumed] == [f[0] for f in full]
+    assert all(np.array_equal(a[1], b[1]) for a, b in zip(resumed, full))
+    assert [f[0] for f in partial] == [f[0] for f in full[:7]]
+
+    # fits of another key start over
+    assert len(list(second.fits('run02', fake_engine, guesses[:5]))) == 3
+
+def test_resumed_batched_fits_are_bit_identical(tmp_path):
+    # millisecond time stamps, so the models run on the step tables, and a
+    # resume that splits the batches differently from the first run
+    rng = np.random.default_rng(0)
+    time = np.round(np.cumsum(rng.choice([0.132, 0.133, 0.134, 0.21], 800)), 3)
+    time -= time[0]
+    assert models.time_steps(time) is not None
+    model = models.WorkingModel(8.9e-4, 5170, -13.66, -9.04e-6, 0.1)
+    conc = model(time, [[0.5, 5e-7]])[0] + rng.normal(0, 1e-3, len(time))
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-3, 1, 8) for r in np.linspace(4e-7, 6e-7, 5)]
+    engine = functools.partial(multistart.batched_fits, model, time, conc,
+        bounds=bounds, jac=model.jacobian, batch_size=18, progress=False)
+
+    path = str(tmp_path / 'run.pkl')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        full = list(engine(guesses))
+        first = checkpoint.Checkpoint(path, dict(n=40), every=0)
+        fits = first.fits('run01', engine, guesses)
+        partial = [next(fits) for _ in range(len(full) // 2)]
+        fits.close()
+        second = checkpoint.Checkpoint(path, dict(n=40), resume=True)
+        assert second.state['fits'][1] % 18 != 0
+        resumed = list(second.fits('run01', engine, guesses))
+
+    assert len(full) >= 16
+    assert [f[0] for f in partial] == [f[0] for f in full[:len(partial)]]
+    assert [f[0] for f in resumed] == [f[0] for f in full]
+    for (_, popt, pcov), (_, popt_full, pcov_full) in zip(resumed, full):
+        assert np.array_equal(popt, popt_full)
+        assert np.array_equal(pcov, pcov_full)
+
+def test_checkpoint_of_other_run_is_not_resumed(tmp_path):
+    path = str(tmp_path / 'run.pkl')
+    run = checkpoint.Checkpoint(path, dict(n=20))
+    run.state['done'] = ['run01']
+    run.save(force=True)
+    assert checkpoint.Checkpoint(path, dict(n=20), resume=True).state['done'] == ['run01']
+    assert checkpoint.Checkpoint(path, dict(n=20)).state == {}
+    with pytest.raises(SystemExit):
+        checkpoint.Checkpoint(path, dict(n=21), resume=True)
+    run.remove()
+    assert not checkpoint.Checkpoint(path, dict(n=20), resume=True).resumed
@@ -0,0 +1,84 @@
+# Tests for the fit result cache
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import os
+import numpy as np
+
+from map_fit import fitcache
+
+def test_fit_key():
+    chis = np.logspace(-6, 2, 10)
+    key = fitcache.fit_key(b'data', dict(rho_p=5170.0, c0=0.1), dict(n=20), chis)
+    assert key == fitcache.fit_key(b'data', dict(c0=0.1, rho_p=5170.0), dict(n=20), chis.copy())
+    assert key != fitcache.fit_key(b'datb', dict(rho_p=5170.0, c0=0.1), dict(n=20), chis)
+    assert key != fitcache.fit_key(b'data', dict(rho_p=5170.0, c0=0.1000001), dict(n=20), chis)
+    assert key != fitcache.fit_key(b'data', dict(rho_p=5170.0, c0=0.1), dict(n=21), chis)
+    assert key != fitcache.fit_key(b'data', dict(rho_p=5170.0, c0=0.1), dict(n=20), chis[:-1])
+
+def test_code_version(tmp_path):
+    # the shipped fitting modules are all found
+    assert fitcache.code_version() == fitcache.code_version()
+    for name in fitcache.FIT_MODULES:
+        (tmp_path / name).write_text('# {}\n'.format(name))
+    version = fitcache.code_version(str(tmp_path))
+    assert version == fitcache.code_version(str(tmp_path))
+    # a solver change gives a new version, and so new fit keys
+    (tmp_path / 'multistart.py').write_text('# multistart.py, fixed\n')
+    fixed = fitcache.code_version(str(tmp_path))
+    assert fixed != version
+    assert fitcache.fit_key(fixed, b'data') != fitcache.fit_key(version, b'data')
+
+def test_store_load_and_invalidate(tmp_path):
+    cache = fitcache.FitCache(str(tmp_path))
+    fits = [([1e-3, 5e-7], np.array([0.5, 5e-7]), np.eye(2))]
+    assert cache.load('abc') is None
+    cache.store('abc', fits, label='run01.txt')
+    cache.store('def', fits, label='run02.txt')
+    loaded = cache.load('abc')
+    assert loaded[0][0] == fits[0][0]
+    assert np.array_equal(loaded[0][2], fits[0][2])
+
+    assert cache.invalidate(['run01']) == 1
+    assert cache.load('abc') is None
+    assert cache.load('def') is not None
+    assert cache.invalidate() == 1
+    assert cache.entries() == []
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = fitcache.FitCache(str(tmp_path))
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.store(key, np.zeros(1000))
+        os.utime(os.path.join(str(tmp_path), key + '.pkl'), (i, i))
+    cache.load('a') # most recently used now
+    entry_size = cache.entries()[0][1]
+    cache.max_bytes = 2.5 * entry_size
+    assert cache.evict() == 1
+    assert cache.load('b') is None
+    assert cache.load('a') is not None
+    assert cache.load('c') is not None
+
+def test_concurrent_workers(tmp_path, monkeypatch):
+    # a second worker on the same directory, removing entries under the first
+    cache = fitcache.FitCache(str(tmp_path / 'cache'), max_bytes=0)
+    fitcache.FitCache(str(tmp_path / 'cache'))
+    cache.store('a', [1.0])
+    stale = cache.entries() + [(str(tmp_path / 'cache' / 'gone.pkl'), 10, 0.0)]
+    monkeypatch.setattr(cache, 'entries', lambda: stale)
+    assert cache.evict() == 1
+    monkeypatch.undo()
+
+    cache.max_bytes = fitcache.DEFAULT_MAX_BYTES
+    cache.store('b', [2.0])
+    real_stat = os.stat
+    def stat(path, *args, **kwargs):
+        if path.endswith('b.pkl'):
+            raise FileNotFoundError(path)
+        return real_stat(path, *args, **kwargs)
+    monkeypatch.setattr(fitcache.os, 'stat', stat)
+    assert cache.entries() == []
+    def utime(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(fitcache.os, 'utime', utime)
+    assert cache.load('b') == [2.0]
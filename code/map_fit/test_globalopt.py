@@ -0,0 +1,49 @@
+# Tests for the global optimizer backend
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import functools
+import numpy as np
+
+from map_fit import globalopt, models, multistart
+
+CONSTS = dict(eta=8.9e-4, rho_p=5170.0, a=-13.66, chi_s=-9.04e-6, c0=0.1)
+
+def make_data(chi=0.5, r=5e-7, num=500, noise=1e-3):
+    time = np.linspace(0, 900, num)
+    rng = np.random.default_rng(0)
+    conc = models.working_model(time, [[chi, r]], **CONSTS)[0] + rng.normal(0, noise, num)
+    return time, conc
+
+def test_search_box():
+    guesses = [[c, r] for c in np.logspace(-6, 2, 9) for r in [4e-7, 5e-7, 6e-7]]
+    box, log_scale = globalopt.search_box(guesses, ([1e-5, 0], [np.inf, 5.5e-7]))
+    assert np.allclose(box, [(1e-5, 1e2), (4e-7, 5.5e-7)])
+    assert list(log_scale) == [True, False]
+
+    box, log_scale = globalopt.search_box([[-1e-6, -1e3], [-1e-1, -1e9]],
+        ([-np.inf, -np.inf], [0, 0]))
+    assert np.allclose(box, [(-1e-1, -1e-6), (-1e9, -1e3)])
+    assert list(log_scale) == [True, True]
+
+def test_global_fits_match_grid():
+    time, conc = make_data()
+    model = functools.partial(models.working_model, **CONSTS)
+    jac = functools.partial(models.working_jacobian, **CONSTS)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-6, 2, 40)
+        for r in np.linspace(4e-7, 6e-7, 5)]
+
+    def mse(fits):
+        return min(np.mean((conc - model(time, [popt])[0])**2) for _, popt, _ in fits)
+
+    grid = list(multistart.batched_fits(model, time, conc, guesses, bounds, jac=jac))
+    box, log_scale = globalopt.search_box(guesses, bounds)
+    fits, summary = globalopt.global_fits(model, time, conc, box, bounds, jac=jac,
+        log_scale=log_scale, n_grid=len(guesses))
+
+    assert np.isclose(mse(fits), mse(grid), rtol=1e-6)
+    assert all(len(g) == 2 and len(popt) == 2 and pcov.shape == (2, 2)
+        for g, popt, pcov in fits)
+    assert 'the grid: 200 guesses' in summary
@@ -0,0 +1,74 @@
+# Tests for the joint fits of grouped trials
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from map_fit import joint, models
+
+CONSTS = dict(eta=8.9e-4, rho_p=5170.0, a=-10.0, chi_s=-9.04e-6)
+BOUNDS = ([0, 1e-9], [10, 1e-4])
+
+def make_group():
+    rng = np.random.default_rng(0)
+    times, concs = [], []
+    for n, c0, offset in [(300, 0.1, 0.002), (400, 0.2, -0.001), (350, 0.15, 0.0)]:
+        t = np.linspace(0, 300, n)
+        y = models.working_model(t, [[0.2, 3e-7]], c0=c0, **CONSTS)[0] + offset
+        times.append(t)
+        concs.append(y + rng.normal(0, 1e-4, n))
+    return joint.JointModel(times, concs, **CONSTS)
+
+def stacked_cost(model, popt):
+    g = model.shape([popt[:2]])
+    return np.sum((model.curves(g, popt[2:].reshape(1, -1, 2))[0] - model.y)**2)
+
+def test_schur_step_matches_dense_solve():
+    model = make_group()
+    p = np.array([[0.1, 5e-7]])
+    g = model.shape(p)
+    local = model.project(g)
+    res, _ = model._residuals(g, local)
+    A, B, D, g_s, g_l = model._blocks(p, g, local, res)
+    step_s, step_l = model._step(A, B, D, g_s, g_l, np.full(1, 1e-3))
+
+    # dense normal equations of the stacked problem
+    J = np.zeros((len(model.t), 2 + 2 * model.n_trials))
+    J[:, :2] = local[0, model.index, 0, None] * models.working_jacobian(model.t, p,
+        **model.consts)[0]
+    J[np.arange(len(model.t)), 2 + 2 * model.index] = g[0]
+    J[np.arange(len(model.t)), 3 + 2 * model.index] = 1
+    scale = np.linalg.norm(J, axis=0)
+    N = (J / scale).T @ (J / scale)
+    dense = np.linalg.solve(N + 1e-3 * np.diag(np.diag(N)),
+        -(J / scale).T @ res[0]) / scale
+    assert np.allclose(step_s[0], dense[:2], rtol=1e-5)
+    assert np.allclose(step_l[0].ravel(), dense[2:], rtol=1e-5, atol=1e-12)
+
+def test_joint_fits_reach_least_squares_minimum():
+    model = make_group()
+    guesses = [[chi, r] for chi in np.logspace(-3, 1, 5) for r in np.logspace(-8, -5, 5)]
+    fits = list(joint.joint_fits(model, guesses, BOUNDS, progress=False))
+    assert len(fits) > 0
+    assert all(len(popt) == 2 + 2 * model.n_trials for _, popt, _ in fits)
+    best = min(fits, key=lambda fit: stacked_cost(model, fit[1]))
+
+    # scipy on the stacked problem from the best joint fit cannot improve on it
+    scale = np.abs(best[1][:2])
+    ref = least_squares(lambda x: model(None, [x * scale])[0] - model.y,
+        np.ones(2), x_scale='jac')
+    assert stacked_cost(model, best[1]) <= 2 * ref.cost * (1 + 1e-6)
+    assert np.allclose(best[1][2::2], [0.1, 0.2, 0.15], rtol=0.05)
+
+def test_joint_fits_independent_of_workers():
+    model = make_group()
+    # the stacked times restart at every trial, so the joint model never runs
+    # on step tables (see test_multistart for the engines on step tables)
+    assert models.time_steps(model.t) is None
+    guesses = [[chi, r] for chi in np.logspace(-3, 1, 8) for r in [2e-7, 3e-7]]
+    serial = list(joint.joint_fits(model, guesses, BOUNDS, progress=False))
+    pooled = list(joint.joint_fits(model, guesses, BOUNDS, workers=2))
+    assert [fit[0] for fit in serial] == [fit[0] for fit in pooled]
+    assert all(np.array_equal(a[1], b[1]) for a, b in zip(serial, pooled))
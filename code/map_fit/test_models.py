@@ -0,0 +1,170 @@
+# Tests for the batched models and their analytic Jacobians
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import functools
+import pickle
+import numpy as np
+
+from map_fit import models
+
+consts = dict(eta=8.9e-4, rho_p=5170, a=-84.5, chi_s=-9.04e-6, c0=0.1)
+time = np.linspace(0, 900, 2000)
+
+def max_error(model, jac, params):
+    return np.max(models.check_jacobian(model, jac, time, params))
+
+def test_working_jacobian():
+    params = [[1e-2, 5e-7], [3.0, 4.5e-7], [100, 1e-6]]
+    model = functools.partial(models.working_model, **consts)
+    jac = functools.partial(models.working_jacobian, **consts)
+    assert max_error(model, jac, params) < 1e-3
+
+def test_r_chi_jacobian_matches_working():
+    params = np.array([[1e-2, 5e-7], [3.0, 4.5e-7]])
+    J = models.working_jacobian(time, params, **consts)
+    J_swapped = models.r_chi_jacobian(time, params[:, ::-1], **consts)
+    assert np.allclose(J, J_swapped[:, :, ::-1])
+
+def test_single_var_and_core_shell_jacobians():
+    params = [[1e-2], [3.0], [100]]
+    for f in [1, 0.3]:
+        model = functools.partial(models.core_shell_model, r=5e-7, f=f, **consts)
+        jac = functools.partial(models.core_shell_jacobian, r=5e-7, f=f, **consts)
+        assert max_error(model, jac, params) < 1e-3
+    J = models.single_var_jacobian(time, params, r=5e-7, **consts)
+    J_full = models.working_jacobian(time, [[p[0], 5e-7] for p in params], **consts)
+    assert np.allclose(J[:, :, 0], J_full[:, :, 0])
+
+def test_deltas_jacobian():
+    params = [[-1e-3, -50.0], [-0.02, -3.0]]
+    model = functools.partial(models.deltas_model, c0=0.1)
+    jac = functools.partial(models.deltas_jacobian, c0=0.1)
+    assert max_error(model, jac, params) < 1e-6
+
+def test_transm_jacobian():
+    params = [[0.5, -1e-3, -1e3, 0.2], [0.1, -0.01, -0.3, 1.0]]
+    assert max_error(models.transm, models.transm_jacobian, params) < 1e-6
+
+def test_model_classes_match_functions():
+    params = np.array([[1e-2, 5e-7], [3.0, 4.5e-7]])
+    model = models.MODELS['working'](**consts)
+    assert np.array_equal(model(time, params), models.working_model(time, params, **consts))
+    assert np.array_equal(model.jacobian(time, params),
+        models.working_jacobian(time, params, **consts))
+    assert np.array_equal(model.single(time, *params[0]), model(time, params)[0])
+    r_chi = models.MODELS['r_chi'](**consts)
+    assert np.array_equal(r_chi(time, params[:, ::-1]), model(time, params))
+    shell = models.MODELS['core_shell'](r=5e-7, f=0.3, **consts)
+    assert np.array_equal(shell(time, params[:, :1]),
+        models.core_shell_model(time, params[:, :1], r=5e-7, f=0.3, **consts))
+    assert model.names == ('chi_p', 'r') and len(model.bounds()[0]) == 2
+
+def test_chi_r_from_deltas_round_trip():
+    params = np.array([[1e-2, 5e-7], [3.0, 4.5e-7]])
+    model = models.WorkingModel(**consts)
+    delta1, delta2 = model.deltas(params)
+    deltas = models.DeltasModel(**consts)
+    assert np.allclose(deltas(time, np.stack([delta1, delta2], axis=1)),
+        model(time, params), rtol=1e-6)
+    chi_p, r = deltas.chi_r(np.stack([delta1, delta2], axis=1))
+    assert np.allclose(chi_p, params[:, 0], rtol=1e-6)
+    assert np.allclose(r, params[:, 1], rtol=1e-6)
+
+def test_models_pickle():
+    model = models.SingleVarModel(r=5e-7, **consts)
+    copy = pickle.loads(pickle.dumps(model))
+    assert np.array_equal(copy(time, [[1e-2]]), model(time, [[1e-2]]))
+    assert copy.constants() == model.constants()
+
+def closed_form(t, alpha, beta, c0):
+    # the textbook form, in complex arithmetic so it also covers underdamping
+    s = np.sqrt(complex(alpha**2 - 4 * beta))
+    delta1, delta2 = 0.5 * (-alpha + s), 0.5 * (-alpha - s)
+    k = delta2 * c0 / (delta2 - delta1)
+    return np.real(k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t))
+
+def test_two_phase_regimes():
+    t = np.linspace(0, 60, 500)
+    for alpha, beta in [(2.0, 0.1), (2.0, 0.9), (2.0, 1.5), (2.0, 40.0)]:
+        y = models.two_phase(t, np.array([[alpha]]), np.array([[beta]]), 0.1)[0]
+        assert np.allclose(y, closed_form(t, alpha, beta, 0.1), rtol=1e-9, atol=1e-13)
+    # critically damped, and continuous on either side of it
+    y = models.two_phase(t, np.array([[2.0], [2.0], [2.0]]),
+        np.array([[1 - 1e-9], [1.0], [1 + 1e-9]]), 0.1)
+    assert np.allclose(y[1], 0.1 * np.exp(-t) * (1 + t), rtol=1e-12)
+    assert np.allclose(y[0], y[1], rtol=1e-8) and np.allclose(y[2], y[1], rtol=1e-8)
+
+def test_two_phase_stays_finite():
+    # chi_p over 16 decades and r from 1 nm to 1 mm cover all three regimes
+    params = [[chi, r] for chi in np.logspace(-8, 8, 30) for r in np.logspace(-9, -3, 30)]
+    y = models.working_model(time, params, **consts)
+    J = models.working_jacobian(time, params, **consts)
+    assert np.all(np.isfinite(y)) and np.all(np.isfinite(J))
+    # under-, near critically and overdamped at r = 0.1 mm (critical chi_p ~ 6.9e-7)
+    params = [[3e-6, 1e-4], [1e-6, 1e-4], [6.9e-7, 1e-4], [3e-7, 1e-4]]
+    model = functools.partial(models.working_model, **consts)
+    jac = functools.partial(models.working_jacobian, **consts)
+    t = np.linspace(0, 0.5, 2000)
+    assert np.max(models.check_jacobian(model, jac, t, params)) < 1e-3
+
+def test_deltas_model_near_equal_deltas():
+    t = np.linspace(0, 900, 2000)
+    y = models.deltas_model(t, [[-0.02, -3.0]], 0.1)[0]
+    k = -3.0 * 0.1 / (-3.0 + 0.02)
+    assert np.allclose(y, k * np.exp(-0.02 * t) + (0.1 - k) * np.exp(-3.0 * t), rtol=1e-10)
+    y = models.deltas_model(t, [[-0.02, -0.02 - 1e-12], [-0.02, -0.02]], 0.1)
+    assert np.allclose(y[0], y[1]) and np.allclose(y[1], 0.1 * np.exp(-0.02 * t) * (1 + 0.02 * t))
+    J = models.deltas_jacobian(t, [[-0.02, -0.02]], 0.1)
+    assert np.all(np.isfinite(J))
+
+def test_step_exp():
+    # millisecond time stamps with a few distinct steps, as recorded by the MAP
+    rng = np.random.default_rng(0)
+    t = np.round(np.cumsum(rng.choice([0.132, 0.133, 0.134, 0.21], 5000)), 3)
+    t -= t[0]
+    steps = models.time_steps(t)
+    assert steps is not None and len(steps[0]) == 4
+    rates = -np.logspace(-4, 1, 40)[:, None]
+    exact = np.exp(rates * t)
+    fast = models.step_exp(t, rates)
+    assert fast.flags['C_CONTIGUOUS']
+    normal = exact > np.finfo(float).tiny
+    bound = np.broadcast_to(models.step_error_bound(t, rates), exact.shape)
+    assert np.all(np.abs(fast - exact)[normal] <= bound[normal] * exact[normal])
+    assert np.all(np.abs(fast - exact)[~normal] < 1e-300)
+    assert 'step tables' in models.describe_time_steps(t)
+
+    # the models on the step tables agree with exact exponentials
+    params = [[chi, 5e-7] for chi in np.logspace(-2, 1, 20)]
+    y = models.working_model(t, params, **consts)
+    y_exact = np.array([models.working_model(t, [p], **consts)[0] for p in params])
+    assert np.allclose(y, y_exact, rtol=1e-11, atol=1e-300)
+
+    # steps finer than the time stamp resolution, or a time reset, take the exact path
+    assert models.time_steps(time) is None
+    reset = np.concatenate([t[:2000], t[2000:] - t[2000]])
+    assert models.time_steps(reset) is None
+    assert np.array_equal(models.step_exp(reset, rates), np.exp(rates * reset))
+    assert 'exact exponentials' in models.describe_time_steps(reset)
+
+def test_step_exp_rows_independent_of_batch():
+    # each row gives the same bits alone, in small batches and in one batch,
+    # whichever way step_exp() runs the product
+    rng = np.random.default_rng(1)
+    t = np.round(np.cumsum(rng.choice([0.132, 0.133, 0.134, 0.21], 3000)), 3)
+    t -= t[0]
+    rates = -np.logspace(-4, 1, 60)[:, None]
+    rates[::7] *= -0.01 # growing rows take exp()
+    full = models.step_exp(t, rates)
+    for size in [1, 3, models.STEP_WIDE_SETS - 1, models.STEP_WIDE_SETS, 25]:
+        for start in range(0, len(rates), size):
+            assert np.array_equal(models.step_exp(t, rates[start:start + size]),
+                full[start:start + size])
+    params = [[chi, 5e-7] for chi in np.logspace(-2, 1, 20)]
+    y = models.working_model(t, params, **consts)
+    J = models.working_jacobian(t, params, **consts)
+    for i, p in enumerate(params):
+        assert np.array_equal(models.working_model(t, [p], **consts)[0], y[i])
+        assert np.array_equal(models.working_jacobian(t, [p], **consts)[0], J[i])
@@ -0,0 +1,298 @@
+# Tests for the multistart fitting engines
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import functools
+import warnings
+import numpy as np
+
+from map_fit import flags, models, multistart
+
+eta = 8.9e-4
+rho_p = 5170
+a = -13.66
+chi_s = -9.04e-6
+c0 = 0.1
+
+def make_data(chi=0.5, r=5e-7, num=2000, noise=1e-3):
+    time = np.linspace(0, 900, num)
+    model = functools.partial(models.working_model, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0)
+    rng = np.random.default_rng(0)
+    conc = model(time, [[chi, r]])[0] + rng.normal(0, noise, num)
+    return model, time, conc
+
+def best_mse(model, time, conc, fits):
+    return min(np.mean((conc - model(time, [popt])[0])**2)
+        for _, popt, _ in fits)
+
+def test_batched_matches_serial():
+    model, time, conc = make_data()
+    def single_model(t, chi_p, r):
+        return model(t, [[chi_p, r]])[0]
+
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-6, 2, 12)
+        for r in np.linspace(4e-7, 6e-7, 3)]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        serial = list(multistart.serial_fits(single_model, time, conc, guesses, bounds))
+    batched = list(multistart.batched_fits(model, time, conc, guesses, bounds))
+
+    assert len(batched) >= len(serial)
+    assert np.isclose(best_mse(model, time, conc, batched),
+        best_mse(model, time, conc, serial), rtol=1e-6)
+
+def test_batched_keeps_guess_order():
+    model, time, conc = make_data()
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, 5e-7] for c in np.logspace(-3, 1, 7)]
+    fits = list(multistart.batched_fits(model, time, conc, guesses, bounds,
+        batch_size=2))
+    used = [g for g, _, _ in fits]
+    assert used == [g for g in guesses if g in used]
+
+def test_singular_step_keeps_other_starts():
+    # a singular start in the batch must not change the steps of the others
+    rng = np.random.default_rng(1)
+    J = rng.normal(size=(4, 10, 2))
+    M = np.matmul(J.transpose(0, 2, 1), J)
+    M[2] = [[1.0, 2.0], [2.0, 4.0]]
+    b = rng.normal(size=(4, 2))
+    steps = multistart._solve(M, b)
+    for i in range(4):
+        assert np.array_equal(steps[i], multistart._solve(M[i:i + 1], b[i:i + 1])[0])
+    assert np.allclose(steps[2], np.linalg.pinv(M[2]) @ b[2])
+
+def test_pop_flags():
+    argv, opts = flags.pop_flags(['model_fits.py', 'log', '-serial', 'list', 'suffix'],
+        {'serial': False, 'workers': 1})
+    assert argv == ['model_fits.py', 'log', 'list', 'suffix']
+    assert opts == {'serial': True, 'workers': 1}
+
+def test_parallel_matches_single_process():
+    model, time, conc = make_data(num=500)
+    jac = functools.partial(models.working_jacobian, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-4, 1, 10)
+        for r in np.linspace(4e-7, 6e-7, 3)]
+
+    def single_model(t, chi_p, r):
+        return model(t, [[chi_p, r]])[0]
+    def single_jac(t, chi_p, r):
+        return jac(t, [[chi_p, r]])[0]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = {
+            'serial': list(multistart.serial_fits(single_model, time, conc,
+                guesses, bounds, jac=single_jac)),
+            'batched': list(multistart.batched_fits(model, time, conc,
+                guesses, bounds, jac=jac)),
+        }
+        for engine in ['serial', 'batched']:
+            fits = list(multistart.parallel_fits(model, time, conc, guesses,
+                bounds, jac=jac, workers=2, engine=engine))
+            assert [g for g, _, _ in fits] == [g for g, _, _ in expected[engine]]
+            for (_, popt, pcov), (_, popt_exp, pcov_exp) in zip(fits, expected[engine]):
+                assert np.array_equal(popt, popt_exp)
+                assert np.array_equal(pcov, pcov_exp)
+
+def test_batched_fits_independent_of_batches_and_workers():
+    # millisecond time stamps, so the models run on the step tables
+    rng = np.random.default_rng(0)
+    time = np.round(np.cumsum(rng.choice([0.132, 0.133, 0.134, 0.21], 1000)), 3)
+    time -= time[0]
+    assert models.time_steps(time) is not None
+    model = models.WorkingModel(eta, rho_p, a, chi_s, c0)
+    conc = model(time, [[0.5, 5e-7]])[0] + rng.normal(0, 1e-3, len(time))
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-3, 1, 8) for r in np.linspace(4e-7, 6e-7, 3)]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = list(multistart.batched_fits(model, time, conc, guesses,
+            bounds, jac=model.jacobian, progress=False))
+        runs = [
+            multistart.batched_fits(model, time, conc, guesses, bounds,
+                jac=model.jacobian, batch_size=7, progress=False),
+            multistart.parallel_fits(model, time, conc, guesses, bounds,
+                jac=model.jacobian, workers=1),
+            multistart.parallel_fits(model, time, conc, guesses, bounds,
+                jac=model.jacobian, workers=4),
+        ]
+        assert len(expected) >= 16
+        for fits in runs:
+            fits = list(fits)
+            assert [g for g, _, _ in fits] == [g for g, _, _ in expected]
+            for (_, popt, pcov), (_, popt_exp, pcov_exp) in zip(fits, expected):
+                assert np.array_equal(popt, popt_exp)
+                assert np.array_equal(pcov, pcov_exp)
+
+def test_screen_guesses():
+    model, time, conc = make_data(chi=0.5, r=5e-7, num=500)
+    chis = np.logspace(-3, 1, 40)
+    rs = np.linspace(4e-7, 6e-7, 5)
+    guesses = [[c, r] for c in chis for r in rs]
+
+    selected, summary = multistart.screen_guesses(model, time, conc, guesses,
+        grid_shape=(len(chis), len(rs)), top_k=5, rule='topk')
+    assert len(selected) == 5
+    assert selected == [g for g in guesses if g in selected]
+    sse = [np.sum((model(time, [g])[0] - conc)**2) for g in guesses]
+    assert guesses[int(np.argmin(sse))] in selected
+    assert 'rule topk, K=5' in summary
+
+    minima, _ = multistart.screen_guesses(model, time, conc, guesses,
+        grid_shape=(len(chis), len(rs)), rule='minima')
+    both, _ = multistart.screen_guesses(model, time, conc, guesses,
+        grid_shape=(len(chis), len(rs)), top_k=5, rule='both')
+    assert len(minima) > 0
+    assert set(map(tuple, both)) == set(map(tuple, minima)) | set(map(tuple, selected))
+
+def test_basin_fits_skips_repeated_basins():
+    model, time, conc = make_data(num=500)
+    jac = functools.partial(models.working_jacobian, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-2, 1, 10)
+        for r in np.linspace(4e-7, 6e-7, 3)]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        full = list(multistart.parallel_fits(model, time, conc, guesses,
+            bounds, jac=jac, workers=1, engine='serial'))
+        cache = multistart.BasinCache()
+        fits = list(multistart.basin_fits(model, time, conc, guesses, bounds,
+            jac=jac, cache=cache, progress=False))
+
+    fitted = sum(b['fitted'] for b in cache.basins)
+    skipped = sum(b['skipped'] for b in cache.basins)
+    assert fitted == len(fits)
+    assert skipped > 0
+    assert fitted + skipped <= len(guesses)
+    assert np.isclose(best_mse(model, time, conc, fits),
+        best_mse(model, time, conc, full), rtol=1e-6)
+    assert '{} skipped'.format(skipped) in cache.summary_lines(['chi_p', 'r'])[0]
+
+def test_scalar_fits_finds_every_minimum():
+    time = np.linspace(0, 10, 400)
+    conc = np.cos(2 * time)
+    def model(t, params):
+        return np.cos(np.atleast_2d(params)[:, 0:1] * t)
+    def jac(t, params):
+        p = np.atleast_2d(params)[:, 0:1]
+        return (-t * np.sin(p * t))[:, :, None]
+
+    grid = np.linspace(0.5, 4, 500)
+    fits = list(multistart.scalar_fits(model, time, conc, grid, ([0], [np.inf]),
+        jac=jac))
+    minima = [popt[0] for _, popt, _ in fits]
+    assert len(minima) > 1
+    assert minima == sorted(minima)
+    for x in minima[1:-1]:
+        gradient = 2 * np.sum((model(time, [[x]])[0] - conc) * jac(time, [[x]])[0, :, 0])
+        assert abs(gradient) < 1e-6
+    assert np.isclose(minima[int(np.argmin([best_mse(model, time, conc, [f])
+        for f in fits]))], 2, rtol=1e-10)
+
+def test_scalar_fits_matches_curve_fit():
+    r = 5e-7
+    model = functools.partial(models.single_var_model, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0, r=r)
+    jac = functools.partial(models.single_var_jacobian, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0, r=r)
+    time = np.linspace(0, 900, 500)
+    conc = model(time, [[0.5]])[0] + np.random.default_rng(0).normal(0, 1e-3, 500)
+    bounds = ([0], [np.inf])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        serial = list(multistart.parallel_fits(model, time, conc,
+            [[c] for c in np.logspace(-3, 1, 20)], bounds, jac=jac, workers=1,
+            engine='serial'))
+    fits = list(multistart.scalar_fits(model, time, conc, np.logspace(-9, 3, 2000),
+        bounds, jac=jac))
+    assert np.isclose(best_mse(model, time, conc, fits),
+        best_mse(model, time, conc, serial), rtol=1e-10)
+
+def test_early_stop_rules():
+    stopper = multistart.EarlyStop(patience=3)
+    assert not stopper.update(2.0)
+    assert np.isclose(stopper.probability(), 2 / 3)
+    assert not stopper.update(1.0)
+    assert [stopper.update(m) for m in [1.5, 1.0, 3.0]] == [False, False, True]
+    assert stopper.hits() == 2
+    assert 'no new best MSE in 3 fits: 5 fits from 10 guesses' in stopper.summary(10)
+
+    stopper = multistart.EarlyStop(confidence=0.99)
+    n = 0
+    while not stopper.update(1.0):
+        n += 1
+    assert stopper.probability() >= 0.99
+    assert n < 10
+
+def test_early_stop_closes_engine():
+    model, time, conc = make_data(num=500)
+    jac = functools.partial(models.working_jacobian, eta=eta, rho_p=rho_p,
+        a=a, chi_s=chi_s, c0=c0)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = multistart.shuffled([[c, r] for c in np.logspace(-2, 1, 20)
+        for r in np.linspace(4e-7, 6e-7, 5)])
+    assert sorted(guesses) != guesses
+
+    stopper = multistart.EarlyStop(confidence=0.99)
+    fits = multistart.batched_fits(model, time, conc, guesses, bounds, jac=jac,
+        batch_size=10, progress=False)
+    used = list(stopper.watch(fits, model, time, conc))
+    assert len(used) == len(stopper.mses) < len(guesses)
+    assert stopper.reason is not None
+    assert fits.gi_frame is None
+
+def test_early_stop_watches_decimated_fits():
+    # -decimate with -patience/-confidence: the refined fits come as a list
+    model, time, conc = make_data(num=2000)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = multistart.shuffled([[c, r] for c in np.logspace(-6, 2, 12)
+        for r in np.linspace(4e-7, 6e-7, 3)])
+    fits, _ = multistart.decimated_fits(model, time, conc, guesses, bounds,
+        factor=10, keep=5)
+    stopper = multistart.EarlyStop(patience=2)
+    used = list(stopper.watch(fits, model, time, conc))
+    assert 0 < len(used) == len(stopper.mses) <= len(fits)
+    assert used == fits[:len(used)]
+
+def test_local_guesses():
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses, shape = multistart.local_guesses([0.5, 5e-7], bounds, [0.5, 0.05], [11, 5])
+    assert shape == (11, 5)
+    assert len(guesses) == 55
+    assert [0.5, 5e-7] in [[float('{:0.12g}'.format(v)) for v in g] for g in guesses]
+
+    guesses, shape = multistart.local_guesses([0.5, 5.9e-7], bounds, [0.5, 0.05], [11, 5])
+    assert all(bounds[0][1] <= g[1] <= bounds[1][1] for g in guesses)
+    assert shape[1] < 5
+
+def test_decimate():
+    time = np.arange(10.0)
+    t_bin, c_bin, counts = multistart.decimate(time, 2 * time, 4)
+    assert list(counts) == [4, 4, 2]
+    assert np.allclose(t_bin, [1.5, 5.5, 8.5])
+    assert np.allclose(c_bin, 2 * t_bin)
+
+def test_decimated_fits_match_full_resolution():
+    model, time, conc = make_data(num=6000)
+    bounds = ([1e-5, 4e-7], [np.inf, 6e-7])
+    guesses = [[c, r] for c in np.logspace(-6, 2, 12)
+        for r in np.linspace(4e-7, 6e-7, 3)]
+    full = list(multistart.batched_fits(model, time, conc, guesses, bounds))
+    fits, summary = multistart.decimated_fits(model, time, conc, guesses, bounds,
+        factor=20, keep=5)
+    assert 0 < len(fits) <= 5
+    assert all(g in guesses for g, _, _ in fits)
+    assert np.isclose(best_mse(model, time, conc, fits),
+        best_mse(model, time, conc, full), rtol=1e-6)
+    assert 'factor 20 (6000 -> 300 points)' in summary
@@ -0,0 +1,38 @@
+# Tests for the run file reader
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import numpy as np
+
+from map_fit import runfile
+
+HEADER = '# run01.txt\n# Run time: 7 min, 00 sec\n###\n'
+
+def write_run(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_load_matches_genfromtxt(tmp_path):
+    rows = ''.join('{:0.3f}\t{:0.2f}\n'.format(0.135 * i, 4000 + i) for i in range(50))
+    path = write_run(tmp_path, 'run01.txt', HEADER + rows)
+    assert np.array_equal(runfile.load(path), np.genfromtxt(path))
+    assert runfile.read_header(path) == dict(name='run01.txt',
+        run_time='7 min, 00 sec', run_seconds=420.0)
+
+def test_partial_last_line(tmp_path):
+    rows = '0.005\t3996.69\n0.142\t4009.86\n0.280\t4006.74\n'
+    cut = write_run(tmp_path, 'cut.txt', HEADER + rows + '0.41')
+    assert np.array_equal(runfile.load(cut), np.genfromtxt(
+        write_run(tmp_path, 'full.txt', HEADER + rows)))
+    # a complete last line without a newline is kept
+    assert runfile.load(write_run(tmp_path, 'last.txt', HEADER + rows + '0.41\t4001.5')).shape == (4, 2)
+
+def test_load_many(tmp_path):
+    paths = [write_run(tmp_path, 'run{}.txt'.format(i), HEADER + '0.0\t{}\n1.0\t2.0\n'.format(i))
+        for i in range(5)]
+    data = runfile.load_many(paths, workers=3)
+    assert [d[0, 1] for d in data] == [0, 1, 2, 3, 4]
+    data = runfile.load_many(paths + [str(tmp_path / 'missing.txt')], keep_errors=True)
+    assert isinstance(data[-1], OSError)
@@ -0,0 +1,60 @@
+# Tests for the campaign run store
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from map_fit import runfile, runstore
+
+def make_campaign(tmp_path):
+    (tmp_path / 'runs').mkdir()
+    rows = []
+    for i, (sample, magnet) in enumerate([('S1', '1'), ('S1', '2'), ('S2', '1')]):
+        text = '# run{}.txt\n# Run time: 0 min, 02 sec\n###\n'.format(i)
+        text += ''.join('{:0.3f}\t{:0.2f}\n'.format(0.1 * j, 100 * i + j) for j in range(10 + i))
+        (tmp_path / 'runs' / 'run{}.txt'.format(i)).write_text(text)
+        rows.append(dict(File='run{}'.format(i), Directory='paper_data/runs',
+            Sample=sample, Magnet=magnet, Date=pd.Timestamp(2025, 12, 1 + i)))
+    return pd.DataFrame(rows)
+
+def test_pack_and_load(tmp_path):
+    log_df = make_campaign(tmp_path)
+    path = str(tmp_path / 'campaign.npz')
+    runstore.pack(log_df, path, data_dir=str(tmp_path) + '/')
+    store = runstore.open_store(path)
+
+    assert store.keys() == ['run0', 'run1', 'run2']
+    for key in store.keys():
+        expected = runfile.load(str(tmp_path / 'runs' / (key + '.txt')))
+        assert np.array_equal(store.load(key + '.txt'), expected)
+    assert store.header('run1')['run_seconds'] == 2.0
+    assert list(store.index['n_points']) == [10, 11, 12]
+
+    assert store.select(sample='S1') == ['run0', 'run1']
+    assert store.select(sample='S1', magnet=1) == ['run0']
+    assert store.select(date='2025.12.03') == ['run2']
+    assert 'run3' not in store
+    with pytest.raises(KeyError):
+        store.load('run3')
+
+def test_columns_are_read_only_views(tmp_path):
+    path = str(tmp_path / 'campaign.npz')
+    runstore.pack(make_campaign(tmp_path), path, data_dir=str(tmp_path) + '/')
+    store = runstore.RunStore(path)
+    time, lux = store.columns('run1')
+    assert isinstance(store.time, np.memmap)
+    assert np.shares_memory(time, store.time) and np.shares_memory(lux, store.lux)
+    assert np.shares_memory(time[3:], time) # truncating copies nothing
+    with pytest.raises(ValueError):
+        lux[0] = 0
+    in_memory = runstore.RunStore(path, mmap=False)
+    assert np.array_equal(in_memory.columns('run1')[1], lux)
+
+def test_pack_unknown_file(tmp_path):
+    log_df = make_campaign(tmp_path)
+    with pytest.raises(KeyError):
+        runstore.pack(log_df, str(tmp_path / 'campaign.npz'), keys=['run0', 'run9'],
+            data_dir=str(tmp_path) + '/')
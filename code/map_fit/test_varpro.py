@@ -0,0 +1,44 @@
+# Tests for the variable projection fits
+#
+# Run from the code/ folder:
+# >>> python -m pytest map_fit
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from map_fit import varpro
+
+t = np.linspace(0, 300, 1500)
+
+def transm(t, eps, S1, S2, omega):
+    return eps * (-(S1 / S2) * np.exp(S2 * t) + np.exp(S1 * t)) + omega
+
+def test_fit_transm_matches_curve_fit():
+    rng = np.random.default_rng(1)
+    y = transm(t, 0.02, -0.5, -0.01, 0.3) + rng.normal(0, 1e-3, len(t))
+    # eps is not searched, so a wrong eps guess makes no difference
+    popt, pcov = varpro.fit_transm(t, y, 123.0, -0.3, -0.02, 0.3)
+    assert np.allclose(popt, [0.02, -0.5, -0.01], rtol=0.05)
+
+    ref, ref_cov = curve_fit(lambda t, *p: transm(t, *p, 0.3), t, y, p0=popt)
+    assert np.allclose(popt, ref, rtol=1e-6)
+    assert np.allclose(pcov, ref_cov, rtol=1e-4)
+
+def test_fit_exponentials():
+    y = 0.4 * np.exp(-0.05 * t) + 0.6 * np.exp(-0.002 * t)
+    popt, pcov = varpro.fit_exponentials(t, y, [-0.1, -0.001])
+    assert np.allclose(popt, [0.4, -0.05, 0.6, -0.002], rtol=1e-6)
+    assert pcov.shape == (4, 4)
+
+def test_transm_scan_matches_single_fits():
+    rng = np.random.default_rng(2)
+    y = transm(t, 0.02, -0.5, -0.01, 0.3) + rng.normal(0, 1e-3, len(t))
+    s1_iter, s2_iter = [-2.0, -0.4], [-0.05, -0.005, -0.001]
+    popt, pcov, sse = varpro.transm_scan(t, y, 0.3, s1_iter, s2_iter)
+    assert popt.shape == (6, 3) and pcov.shape == (6, 3, 3)
+
+    best = np.argmin(sse)
+    single, single_cov = varpro.fit_transm(t, y, 0, *popt[best, 1:], 0.3)
+    assert np.allclose(popt[best], single, rtol=1e-6)
+    assert np.allclose(pcov[best], single_cov, rtol=1e-4)
+    assert np.isclose(sse[best], np.sum((transm(t, *single, 0.3) - y)**2))
@@ -0,0 +1,227 @@
+# varpro.py
+#
+# Variable projection (separable least squares) fits of sums of exponentials.
+#
+# simple_fit.og_model and lightFunctions.transm are linear in their
+# amplitudes (k1, k2 and eps) and nonlinear only in the decay rates:
+#
+#   y(t) = basis(t; rates) @ coefs + offset
+#
+# For any trial of the rates the best coefs are a linear least squares
+# solution, so varpro_fit() solves them in closed form at every step and
+# Levenberg-Marquardt only searches the rates (with Kaufman's approximation of
+# the Jacobian of the projected residual). That halves the number of searched
+# parameters of og_model (4 -> 2) and removes eps from the transm fits
+# (3 -> 2), and a start no longer fails because its amplitude guess was off.
+#
+# ProjectedTransm is the batched form of the transm fit, so transm_scan() can
+# run a whole grid of (S1, S2) starts at once with multistart.batched_curve_fit.
+#
+# Created: 2026.10.18
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from . import models, multistart
+
+def varpro_fit(t, y, basis, basis_jac, rates0, offset=0, max_nfev=None):
+    """Fit y = basis(t, rates) @ coefs + offset, searching only the rates.
+
+    Keyword arguments:
+    t, y - data
+    basis - basis(t, rates), shape (n_points, n_coefs)
+    basis_jac - basis_jac(t, rates), derivatives of the basis with respect to
+                each rate, shape (n_rates, n_points, n_coefs)
+    rates0 - initial guess of the rates
+    offset - fixed part of the model (e.g. omega of transm)
+    max_nfev - maximum number of residual evaluations (default 100 per rate)
+    Returns: (rates, coefs, pcov), pcov is the covariance of (coefs, rates)
+    estimated from the full problem's Jacobian, like curve_fit's
+    """
+    y = np.asarray(y, dtype=float) - offset
+    last = {}
+
+    def solve(rates):
+        # the jacobian is evaluated at the rates of the last residual
+        if last.get('rates') is None or not np.array_equal(last['rates'], rates):
+            Phi = basis(t, rates)
+            last.update(rates=np.array(rates), Phi=Phi,
+                coefs=np.linalg.lstsq(Phi, y, rcond=None)[0])
+        return last['Phi'], last['coefs']
+
+    def residual(rates):
+        Phi, coefs = solve(rates)
+        return Phi @ coefs - y
+
+    def jacobian(rates):
+        Phi, coefs = solve(rates)
+        dPhi_c = (basis_jac(t, rates) @ coefs).T
+        # the part of each column outside the span of the basis
+        return dPhi_c - Phi @ np.linalg.lstsq(Phi, dPhi_c, rcond=None)[0]
+
+    with np.errstate(all='ignore'):
+        res = least_squares(residual, np.asarray(rates0, dtype=float),
+            jac=jacobian, method='lm', x_scale='jac', max_nfev=max_nfev)
+        Phi, coefs = solve(res.x)
+        J = np.column_stack([Phi, (basis_jac(t, res.x) @ coefs).T])
+    return res.x, coefs, _covariance(J, res.fun)
+
+def exp_basis(t, rates):
+    """Columns exp(rate_k t), the basis of og_model."""
+    return _exp(np.outer(t, rates))
+
+def exp_basis_jac(t, rates):
+    E = exp_basis(t, rates)
+    dE = np.zeros((len(rates),) + E.shape)
+    for k in range(len(rates)):
+        dE[k, :, k] = t * E[:, k]
+    return dE
+
+def transm_basis(t, rates):
+    """lightFunctions.transm with eps = 1 and omega = 0, rates = (S1, S2)."""
+    S1, S2 = rates
+    return (_exp(S1 * t) - (S1 / S2) * _exp(S2 * t))[:, None]
+
+def transm_basis_jac(t, rates):
+    S1, S2 = rates
+    E1, E2 = _exp(S1 * t), _exp(S2 * t)
+    return np.stack([t * E1 - E2 / S2, (S1 / S2**2 - (S1 / S2) * t) * E2])[:, :, None]
+
+def fit_transm(t, y, eps, S1, S2, omega, max_nfev=None):
+    """Fit transm with a fixed omega; eps is solved for every (S1, S2).
+
+    The eps guess is not used (eps is not searched); it is kept so the call
+    matches curve_fit's p0 = (eps, S1, S2).
+    Returns: (popt, pcov) over (eps, S1, S2), like curve_fit
+    """
+    rates, coefs, pcov = varpro_fit(t, y, transm_basis, transm_basis_jac,
+        [S1, S2], offset=omega, max_nfev=max_nfev)
+    return np.array([coefs[0], rates[0], rates[1]]), pcov
+
+def fit_exponentials(t, y, rates0, max_nfev=None):
+    """Fit a sum of exponentials, sum_k coefs_k exp(rates_k t).
+
+    Returns: (popt, pcov) over (coef_1, rate_1, coef_2, rate_2, ...), the
+    parameter order of og_model
+    """
+    rates, coefs, pcov = varpro_fit(t, y, exp_basis, exp_basis_jac, rates0,
+        max_nfev=max_nfev)
+    m = len(rates)
+    order = np.ravel(np.column_stack([np.arange(m), m + np.arange(m)]))
+    return np.ravel(np.column_stack([coefs, rates])), pcov[np.ix_(order, order)]
+
+def _exp(u):
+    # trial rates can grow during the search; keep the basis finite
+    return np.exp(np.minimum(u, 600.0))
+
+def _covariance(J, residual):
+    # as in scipy's curve_fit: pseudo-inverse of J^T J from the SVD of J,
+    # scaled by the residual variance
+    n_points, n_params = J.shape
+    if not np.all(np.isfinite(J)) or n_points <= n_params:
+        return np.full((n_params, n_params), np.inf)
+    _, s, VT = np.linalg.svd(J, full_matrices=False)
+    keep = s > np.finfo(float).eps * max(J.shape) * s[0]
+    VT = VT[keep]
+    pcov = (VT.T / s[keep]**2) @ VT
+    return pcov * np.sum(residual**2) / (n_points - n_params)
+
+class ProjectedTransm:
+    """Batched transm with a fixed omega and eps solved for every (S1, S2).
+
+    Keyword arguments:
+    y - data the eps are fitted to
+    omega - fixed offset
+
+    model(t, rates) gives the transm curves of the (S1, S2) sets in rates,
+    shape (n_sets, 2), each with its least squares eps, so the rates can be
+    fitted on their own by the batched engines of multistart.py (with
+    jacobian, Kaufman's approximation, as jac).
+    """
+    def __init__(self, y, omega):
+        self.y = np.asarray(y, dtype=float) - omega
+        self.omega = omega
+
+    def __call__(self, t, rates):
+        phi = self.basis(t, rates)
+        phi *= self.eps(phi)
+        phi += self.omega
+        return phi
+
+    def basis(self, t, rates, derivatives=False):
+        """transm with eps = 1 and omega = 0 of each set, shape (n_sets,
+        n_points), and with derivatives its derivatives with respect to S1
+        and S2, shape (n_sets, n_points, 2)."""
+        rates = np.atleast_2d(rates)
+        S1, S2 = rates[:, 0:1], rates[:, 1:2]
+        E1 = np.exp(S1 * t)
+        E2 = np.exp(S2 * t)
+        with np.errstate(all='ignore'):
+            phi = E2 * (-S1 / S2)
+            phi += E1
+            if not derivatives:
+                return phi
+            dphi = np.empty(phi.shape + (2,))
+            np.multiply(t, E1, out=dphi[:, :, 0])
+            dphi[:, :, 0] -= E2 / S2
+            np.multiply((S1 / S2) * (1 / S2 - t), E2, out=dphi[:, :, 1])
+        return phi, dphi
+
+    def eps(self, phi):
+        with np.errstate(all='ignore'):
+            return (phi @ self.y / np.sum(phi**2, axis=1))[:, None]
+
+    def jacobian(self, t, rates):
+        phi, dphi = self.basis(t, rates, derivatives=True)
+        dphi *= self.eps(phi)[:, :, None]
+        # the part of each column outside the span of phi
+        with np.errstate(all='ignore'):
+            along = np.einsum('sn,snk->sk', phi, dphi) / np.sum(phi**2, axis=1)[:, None]
+        return dphi - phi[:, :, None] * along[:, None, :]
+
+    def full_fit(self, t, rates):
+        """(eps, S1, S2) and their covariance, as curve_fit of the full model."""
+        rates = np.atleast_2d(rates)
+        phi, dphi = self.basis(t, rates, derivatives=True)
+        eps = self.eps(phi)
+        J = np.concatenate([phi[:, :, None], dphi * eps[:, :, None]], axis=2)
+        with np.errstate(all='ignore'):
+            cost = np.sum((phi * eps - self.y)**2, axis=1)
+        pcov = np.full((len(rates), 3, 3), np.inf)
+        ok = np.all(np.isfinite(J), axis=(1, 2)) & np.isfinite(cost)
+        if np.any(ok):
+            pcov[ok] = multistart._covariance(J[ok], cost[ok], len(t))
+        return np.hstack([eps, rates]), pcov
+
+def transm_scan(t, y, omega, s1_iter, s2_iter):
+    """Fit transm with a fixed omega from every (S1, S2) of a grid at once.
+
+    Keyword arguments:
+    t, y - data
+    omega - fixed offset
+    s1_iter, s2_iter - grid of initial S1 and S2
+    Returns: (popt, pcov, sse) of every start in s1-major grid order; popt
+    over (eps, S1, S2) is nan and sse inf for starts that did not converge
+    """
+    model = ProjectedTransm(y, omega)
+    s1, s2 = np.meshgrid(s1_iter, s2_iter, indexing='ij')
+    guesses = np.column_stack([s1.ravel(), s2.ravel()])
+
+    rates = np.full(guesses.shape, np.nan)
+    batch_size = max(1, int(multistart.MAX_BATCH_VALUES // max(len(t), 1)))
+    for start in range(0, len(guesses), batch_size):
+        batch = slice(start, start + batch_size)
+        fitted, _, ok = multistart.batched_curve_fit(model, t, y, guesses[batch],
+            (-np.inf, np.inf), jac=model.jacobian)
+        rates[batch][ok] = fitted[ok]
+
+    popt = np.full((len(guesses), 3), np.nan)
+    pcov = np.full((len(guesses), 3, 3), np.inf)
+    sse = np.full(len(guesses), np.inf)
+    ok = np.all(np.isfinite(rates), axis=1)
+    if np.any(ok):
+        popt[ok], pcov[ok] = model.full_fit(t, rates[ok])
+        with np.errstate(all='ignore'):
+            sse[ok] = np.sum((model(t, rates[ok]) - y)**2, axis=1)
+    sse[~np.isfinite(sse)] = np.inf
+    return popt, pcov, sse
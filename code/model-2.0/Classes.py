@@ -82,9 +82,10 @@ class ParamGuesser:
 
         t_T, T_T = lf.trunc(minTrunc, maxTrunc, t_raw, T_raw)
         t_F, T_logF = lf.dataAdj(t_T, T_T)
+        omega = np.mean(T_logF[-101:-1])
 
         # meanVarArray = np.zeros(total_iters)
-        meanMatrix = np.zeros((total_iters, 3))
+        meanMatrix = np.zeros((total_iters, 4))
 
         print("\n")
         j=0
@@ -95,18 +96,24 @@ class ParamGuesser:
                 eps = s2*omega/(s1-s2)
                 guesses = eps, s1, s2
 
-                (poptG, pcovG) = curve_fit(transmOmega, t_F, T_logF, p0=guesses, maxfev=10000, bounds=(-np.inf,np.inf))
+                # eps is solved for, only s1 and s2 are searched
+                (poptG, pcovG) = lf.fit_transm_omega(t_F, T_logF, *guesses, omega)
 
                 meanVar = np.mean(np.diag(pcovG))
-                meanMatrix[count] = [j, k, abs(meanVar)]
+                sse = np.sum((lf.transm(t_F, *poptG, omega) - T_logF)**2)
+                meanMatrix[count] = [j, k, abs(meanVar), sse]
 
                 k+=1
                 count+=1
             j+=1
 
+        # only fits that reached the best residual count (a start can end
+        # in a degenerate fit with one rate running off and a tiny variance)
         meanVarArray = lf.column(meanMatrix, 2)
+        bestFits = meanMatrix[:, 3] <= np.nanmin(meanMatrix[:, 3])*1.001
+        meanVarArray = np.where(bestFits, meanVarArray, np.inf)
         indx_min = np.argmin(meanVarArray)
-        S1_gIndx, S2_gIndx, m = meanMatrix[indx_min]
+        S1_gIndx, S2_gIndx, m, sse = meanMatrix[indx_min]
         S1g = s1_iter[int(S1_gIndx)]
         S2g = s2_iter[int(S2_gIndx)]
         epsg = S2g*omega/(S1g-S2g)
@@ -1,5 +1,11 @@
+import os
+import sys
 import numpy as np
 
+# shared fitting code in code/map_fit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import varpro
+
 
 '''The idea for this program is to create a series of functions
    that do the certain tasks of analyzing the light curve data
@@ -38,6 +44,13 @@ def transm(t, eps, S1, S2, omega):
 
    return eps*(-(S1/S2)*np.exp(S2*t)+np.exp(S1*t)) + omega
 
+def fit_transm_omega(t, y, eps, S1, S2, omega):
+   '''Fits transm with a fixed omega by variable projection: eps is
+   solved in closed form for every (S1, S2), so only S1 and S2 are
+   searched. Returns popt = (eps, S1, S2) and pcov, like curve_fit'''
+
+   return varpro.fit_transm(t, y, eps, S1, S2, omega, max_nfev=10000)
+
 def transm2(t, S1, S2, omega):
    '''funtion that models log(1/T) and uses taylor expansion of exp'''
 
@@ -84,6 +97,13 @@ def trunc(low, high, x, y):
    if len(x)!=len(y):
       print("Array sizes do not match")
 
+   if np.all(x[1:] >= x[:-1]):
+      # sorted times: the window is a slice, so x and y are returned as
+      # views of the input arrays instead of copies
+      start = np.searchsorted(x, low, side='left')
+      end = np.searchsorted(x, high, side='right')
+      return x[start:end], y[start:end]
+
    indx = np.where((x>=low) & (x<=high))
 
    return x[indx], y[indx]
@@ -8,6 +8,11 @@ import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import font_manager as fm
 from lmfit import Model
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 # path = '../../../../test_data/paper_data/magob/'
 # files = ['magob138.txt', 'magob139.txt', 'magob140.txt']
@@ -54,7 +59,7 @@ def fit_file(file, color):
     print("fitting file: " + file)
     file_path = path + file
 
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0]
     lux = data[:, 1]
 
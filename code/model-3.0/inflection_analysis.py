@@ -8,6 +8,10 @@ import sys
 from tqdm import tqdm
 from scipy.optimize import curve_fit
 from scipy.signal import savgol_filter
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 n = 20
 
@@ -55,7 +59,7 @@ except:
 file_path = path + file
 print('\nnow processing ' + str(file_path))
 
-data = np.genfromtxt(file_path)
+data = runfile.load(file_path)
 time = data[:, 0]
 lux = data[:, 1]
 
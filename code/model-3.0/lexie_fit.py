@@ -9,6 +9,11 @@ from tqdm import tqdm
 from matplotlib import font_manager as fm
 from lmfit import Model
 import magnetic_analysis_single_param as ma
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 def calibrate(lux, c0):
     n = 20
@@ -155,7 +160,7 @@ def driver():
     ### CALIBRATION ###
     print("\nLoading file...")
     try:
-        data = np.genfromtxt(path + file)
+        data = runfile.load(path + file)
     except:
         print("ERROR: Could not load data file at:\n" + path + file)
     print("Successfully loaded " + file + '\n')
@@ -4,10 +4,14 @@ import single_magnetic_analysis as ma
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import font_manager as fm
 import sys
+import os
 from tqdm import tqdm
 from scipy.optimize import curve_fit
 from scipy.signal import savgol_filter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import models, runfile
+
 # fit params
 eta = 8.9e-4
 # rho_p = 5170
@@ -18,14 +22,6 @@ c0 = 0
 
 n = 20
 
-def working_model(t, chi_p, r):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -40,10 +36,10 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
+def fit_data(model, time, conc, init_guess):
     popt = (init_guess[0], init_guess[1])
     try:
-        (popt, pcov) = curve_fit(working_model, time, conc, p0=init_guess, bounds=bounds)
+        (popt, pcov) = curve_fit(model.single, time, conc, p0=init_guess, bounds=bounds)
     except ValueError:
         #print("ValueError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
@@ -51,7 +47,7 @@ def fit_data(time, conc, init_guess):
         #print("RuntimeError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
 
-    model_y = working_model(time, *popt)
+    model_y = model.single(time, *popt)
 
     residuals = conc - model_y
     ss_res = np.sum(residuals**2) # sum of square residuals
@@ -144,6 +140,11 @@ else:
     print('ERROR: invalid selction\n')
     sys.exit()
 
+# trials with the same material, magnet and concentration give nearly the same
+# fit, so each trial starts from the last adjusted fit of its group and only
+# falls back to the listed initial guess if r^2 drops by more than warm_tol
+warm_starts = {}
+warm_tol = 0.01
 
 for s in series:
     path_append = s[0]
@@ -234,11 +235,12 @@ for s in series:
     print('a = ' + str(a))
 
     bounds = ([0, 1e-9], [100, 5e-6])#([0, 0], [np.inf, np.inf])
+    model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
 
     file_path = path + file
     print('\nnow processing ' + str(file_path))
 
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0]
     lux = data[:, 1]
 
@@ -253,7 +255,7 @@ for s in series:
         print('found ' + str(neg_count) + ' negative concentration values. Continuing anyways.')
 
     # fit unadjusted data
-    selected_popt, r_sq = fit_data(time, conc, (chi_init, r_init))
+    selected_popt, r_sq = fit_data(model, time, conc, (chi_init, r_init))
 
     print("\nUNADJUSTEDMODEL")
     print("file: " + str(file))
@@ -262,7 +264,7 @@ for s in series:
         chi_guess=chi_init, r_guess=r_init, chi=selected_popt[0],
         r=selected_popt[1], r_sq=r_sq))
 
-    model_y = working_model(time, *selected_popt)
+    model_y = model.single(time, *selected_popt)
 
     # smooth data using the Savitzky-Golay filter
     window_size = 50
@@ -281,9 +283,22 @@ for s in series:
     time_shifted = time[global_min_index:] - time[global_min_index]
     conc_shifted = conc[global_min_index:]
     c0 = conc_shifted[0]
+    model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
 
     # fit the shifted data
-    adj_selected_popt, adj_r_sq = fit_data(time_shifted, conc_shifted, (chi_init, r_init))
+    group = (m_input, t_input, grade, c0_input)
+    if group in warm_starts:
+        warm = warm_starts[group]
+        adj_selected_popt, adj_r_sq = fit_data(model, time_shifted, conc_shifted, warm['popt'])
+        print('warm start from {}: r_sq {:0.6f} (last {:0.6f})'.format(warm['file'],
+            adj_r_sq, warm['r_sq']))
+        if adj_r_sq < warm['r_sq'] - warm_tol:
+            cold_popt, cold_r_sq = fit_data(model, time_shifted, conc_shifted, (chi_init, r_init))
+            if cold_r_sq > adj_r_sq:
+                adj_selected_popt, adj_r_sq = cold_popt, cold_r_sq
+    else:
+        adj_selected_popt, adj_r_sq = fit_data(model, time_shifted, conc_shifted, (chi_init, r_init))
+    warm_starts[group] = dict(popt=tuple(adj_selected_popt), r_sq=adj_r_sq, file=file)
 
     print("\nTWO-PHASE MODEL")
     print("file: " + str(file))
@@ -292,7 +307,7 @@ for s in series:
         chi_guess=chi_init, r_guess=r_init, chi=adj_selected_popt[0],
         r=adj_selected_popt[1], r_sq=adj_r_sq))
 
-    two_model_y = working_model(time_shifted, *adj_selected_popt)
+    two_model_y = model.single(time_shifted, *adj_selected_popt)
 
     # plot data
     f, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(10, 6))
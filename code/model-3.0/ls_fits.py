@@ -3,11 +3,15 @@ import matplotlib.pyplot as plt
 import single_magnetic_analysis as ma
 from mpl_toolkits.mplot3d import Axes3D
 import sys
+import os
 from tqdm import tqdm
 from scipy.optimize import curve_fit
 from scipy.signal import savgol_filter
 from matplotlib import font_manager as fm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import models, runfile
+
 # fit params
 eta = 8.9e-4
 # rho_p = 5170
@@ -18,14 +22,6 @@ c0 = 0
 
 n = 20
 
-def working_model(t, chi_p, r):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -40,10 +36,10 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
+def fit_data(model, time, conc, init_guess):
     popt = (init_guess[0], init_guess[1])
     try:
-        (popt, pcov) = curve_fit(working_model, time, conc, p0=init_guess, bounds=bounds)
+        (popt, pcov) = curve_fit(model.single, time, conc, p0=init_guess, bounds=bounds)
     except ValueError:
         #print("ValueError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
@@ -51,7 +47,7 @@ def fit_data(time, conc, init_guess):
         #print("RuntimeError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
 
-    model_y = working_model(time, *popt)
+    model_y = model.single(time, *popt)
 
     residuals = conc - model_y
     ss_res = np.sum(residuals**2) # sum of square residuals
@@ -180,7 +176,7 @@ bounds = ([0, 1e-9], [100, 5e-6])#([0, 0], [np.inf, np.inf])
 file_path = path + file
 print('\nnow processing ' + str(file_path))
 
-data = np.genfromtxt(file_path)
+data = runfile.load(file_path)
 time = data[:, 0]
 lux = data[:, 1]
 
@@ -197,13 +193,14 @@ else:
 best_guess = guesses[0]
 best_r_sq = -np.inf
 best_results = best_guess
+model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
 
 # # print('\n* indicates new best found')
 # print('init_chi\tinit_radius\tchi\t\tradius\t\tr_sq')
 
 for init_guess in tqdm(guesses):
     # # iterate over guesse
-    popt, r_sq = fit_data(time, conc, init_guess)
+    popt, r_sq = fit_data(model, time, conc, init_guess)
 
     if r_sq > best_r_sq:
         best_r_sq = r_sq
@@ -223,7 +220,7 @@ selected_popt = best_results
 # chi_init = best_guess[0]
 # r_init = best_guess[1]
 
-selected_popt, r_sq = fit_data(time, conc, (chi_init, r_init))
+selected_popt, r_sq = fit_data(model, time, conc, (chi_init, r_init))
 
 print("\nUNADJUSTED MODEL")
 print("file: " + str(file))
@@ -232,7 +229,7 @@ print('{chi_guess:0.4e}\t{r_guess:0.4e}\t{chi:0.4e}\t{r:0.4e}\t{r_sq:0.4f}'.form
     chi_guess=chi_init, r_guess=r_init, chi=selected_popt[0],
     r=selected_popt[1], r_sq=r_sq))
 
-model_y = working_model(time, *selected_popt)
+model_y = model.single(time, *selected_popt)
 
 # plot:
 # fig = plt.figure()
@@ -272,17 +269,17 @@ best_guess = guesses[0]
 best_r_sq = -np.inf
 best_results = best_guess
 c0 = conc_shifted[0]
+model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
 
 #print('\n* indicates new best found')
 print('init_chi\tinit_radius\tchi\t\tradius\t\tr_sq')
 
 for init_guess in tqdm(guesses):
     # iterate over guesses
-    popt, r_sq = fit_data(time_shifted, conc_shifted, init_guess)
+    popt, r_sq = fit_data(model, time_shifted, conc_shifted, init_guess)
 
-    # model = working_model
     try:
-        (popt, pcov) = curve_fit(working_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
+        (popt, pcov) = curve_fit(model.single, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
     except ValueError:
         #print("ValueError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
@@ -290,7 +287,7 @@ for init_guess in tqdm(guesses):
         #print("RuntimeError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
         pass
 
-    adj_model_y = working_model(time_shifted, *popt)
+    adj_model_y = model.single(time_shifted, *popt)
 
     residuals = conc_shifted - adj_model_y
     ss_res = np.sum(residuals**2) # sum of square residuals
@@ -311,7 +308,7 @@ print('Input selected initial conditions: ')
 chi_init = float(input('Initial chi: '))
 r_init = float(input('Initial r: '))
 #
-adj_selected_popt, adj_r_sq = fit_data(time_shifted, conc_shifted, (chi_init, r_init))
+adj_selected_popt, adj_r_sq = fit_data(model, time_shifted, conc_shifted, (chi_init, r_init))
 # selected_popt = best_results
 # chi_init = best_guess[0]
 # r_init = best_guess[1]
@@ -324,7 +321,7 @@ print('{chi_guess:0.4e}\t{r_guess:0.4e}\t{chi:0.4e}\t{r:0.4e}\t{r_sq:0.4f}'.form
     chi_guess=chi_init, r_guess=r_init, chi=adj_selected_popt[0],
     r=adj_selected_popt[1], r_sq=adj_r_sq))
 
-two_model_y = working_model(time_shifted, *adj_selected_popt)
+two_model_y = model.single(time_shifted, *adj_selected_popt)
 
 # plot data
 f, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(10, 6))
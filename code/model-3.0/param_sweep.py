@@ -3,14 +3,18 @@ import matplotlib.pyplot as plt
 import magnetic_analysis as ma
 from mpl_toolkits.mplot3d import Axes3D
 import sys
+import os
 from tqdm import tqdm
 
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import checkpoint, flags, runfile
 
-def main(path, file, c0, a):
+
+def main(path, file, c0, a, resume=False):
     eta = 8.9e-4
     #rho = 5170
     rho = 1400
@@ -62,7 +66,18 @@ def main(path, file, c0, a):
     best_guess = guesses[0]
     best_r_sq = -np.inf
 
-    for initial_guess in tqdm(guesses):
+    # progress of the sweep, so an interrupted sweep can be continued with -resume
+    run_checkpoint = checkpoint.Checkpoint(save_path + 'checkpoints/param_sweep-'
+        + file_name.split('.')[0] + '.pkl',
+        dict(file=file_path, c0=c0, a=a, guesses=guesses, bounds=bounds), resume=resume)
+    first_guess = run_checkpoint.state.get('done', 0)
+    if first_guess > 0:
+        fitted_params = run_checkpoint.state['fitted_params']
+        best_guess = run_checkpoint.state['best_guess']
+        best_r_sq = run_checkpoint.state['best_r_sq']
+
+    for i in tqdm(range(first_guess, len(guesses)), initial=first_guess, total=len(guesses)):
+        initial_guess = guesses[i]
         model_fitter = ma.ModelFitter(file_path, data_processor.time, conc, c0, eta, rho, mu0, Xs, a, regularization=1)
         chi, r = model_fitter.fit(initial_guess, bounds)
         fitted_params.append((chi, r))
@@ -75,6 +90,10 @@ def main(path, file, c0, a):
             best_guess = initial_guess
             best_r_sq = r_squared
             print(str(initial_guess[0]) + '\t' + str(initial_guess[1]) + '\t' + str(chi) + '\t' + str(r) + '\t' + str(r_squared))
+        run_checkpoint.state.update(done=i + 1, fitted_params=fitted_params,
+            best_guess=best_guess, best_r_sq=best_r_sq)
+        run_checkpoint.save()
+    run_checkpoint.remove()
     # model_fitter.plot_residuals()  # Plot residuals for each file
     # model_fitter.plot_parameter_convergence()  # Plot parameter convergence for each file
     # model_fitter.plot_fit()
@@ -106,7 +125,7 @@ def main(path, file, c0, a):
 
 
     # NOTE: assume final magmitus obsidian system configuration
-def command_line_interface():
+def command_line_interface(resume=False):
         # parameters
         eta = 8.9e-4
         rho_p = 5200
@@ -193,14 +212,16 @@ def command_line_interface():
         ### CALIBRATION ###
         print("\nLoading file...")
         try:
-            data = np.genfromtxt(path + file)
+            data = runfile.load(path + file)
         except:
             print("ERROR: Could not load data file at:\n" + path + file)
         print("Successfully loaded " + file + '\n')
 
 
-        main(path, file, c0, a)
+        main(path, file, c0, a, resume=resume)
 
 if __name__ == "__main__":
-    command_line_interface()
+    # -resume continues an interrupted sweep of the same file from its checkpoint
+    argv, opts = flags.pop_flags(sys.argv, {'resume': False})
+    command_line_interface(resume=opts['resume'])
     #main_flip()
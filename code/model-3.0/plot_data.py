@@ -2,6 +2,10 @@ import sys
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import font_manager as fm
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 n = 20
 
@@ -64,7 +68,7 @@ for file in file_list:
 
     file_path = path + file
 
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0] / 60 # convert to min
     lux = data[:, 1] / 1000 # convert to klux
     conc = calibrate(lux, c_i)
@@ -1,8 +1,11 @@
+import os
 import sys
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import font_manager as fm
-from scipy.optimize import curve_fit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile, varpro
 
 n = 20
 
@@ -78,7 +81,7 @@ for file in file_list:
 
     print(file)
 
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0] # convert to min
     lux = data[:, 1]  # convert to klux
     conc = calibrate(lux, c0)
@@ -88,8 +91,9 @@ for file in file_list:
 
     lux_ax.plot(time, lux)
 
-    # fit model
-    (popt, pcov) = curve_fit(og_model, time, conc, p0=[-1.93e-13, -1.5e7, 0.1, -2.9e-5]) #p0=[0, 0.1, 0, 0.1], bounds=([-1, 0, -1, 0], [1, 0.1, 1, 0.1]))
+    # fit model: k1, k2 are solved for each (d1, d2), so only the rates are
+    # searched (was curve_fit with p0=[-1.93e-13, -1.5e7, 0.1, -2.9e-5])
+    (popt, pcov) = varpro.fit_exponentials(time, conc, [-1.5e7, -2.9e-5])
     k1, d1, k2, d2 = popt
     model_y = og_model(time, k1, d1, k2, d2)
 
@@ -8,6 +8,10 @@ from tqdm import tqdm
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 
 def main(path, file, c0, a):
@@ -188,7 +192,7 @@ def command_line_interface():
         ### CALIBRATION ###
         print("\nLoading file...")
         try:
-            data = np.genfromtxt(path + file)
+            data = runfile.load(path + file)
         except:
             print("ERROR: Could not load data file at:\n" + path + file)
         print("Successfully loaded " + file + '\n')
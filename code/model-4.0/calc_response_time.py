@@ -1,5 +1,9 @@
 import sys
 import numpy as np
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 n = 20
 
@@ -22,7 +26,7 @@ def plot_data(time, lux, conc, label):
     conc_ax.plot(time, conc, label=label)
 
 def calculate_resp_time(file_path):
-    data = np.genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0]
     lux = data[:, 1]
 
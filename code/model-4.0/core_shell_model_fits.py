@@ -13,6 +13,9 @@ import time as pytime
 import pandas as pd
 import warnings
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import flags, globalopt, maplog, models, multistart, runfile
+
 ver = 1.0
 to_save = True
 
@@ -24,30 +27,37 @@ window_size = 50
 poly_order = 3 # polynomial order
 to_adj = True
 
-if len(sys.argv) > 1:
-    if '-n' in sys.argv[1]:
+# optional flags:
+#   -global de  search the chi range of the guesses with differential evolution
+#               instead of fitting from every guess (see map_fit/globalopt.py)
+argv, opts = flags.pop_flags(sys.argv, {'global': None})
+if opts['global'] is not None and opts['global'] not in globalopt.METHODS:
+    sys.exit('ERROR: -global must be one of ' + ', '.join(globalopt.METHODS))
+
+if len(argv) > 1:
+    if '-n' in argv[1]:
         try:
-            min_n = int(sys.argv[2])
-            file_suffix = sys.argv[1] + str(min_n)
+            min_n = int(argv[2])
+            file_suffix = argv[1] + str(min_n)
         except:
             min_n = 20
-    elif sys.argv[1] == '-window':
+    elif argv[1] == '-window':
         try:
-            window_size = int(sys.argv[2])
+            window_size = int(argv[2])
             file_suffix = '-window' + str(window_size)
         except:
             window_size = 50
-    elif sys.argv[1] == '-order':
+    elif argv[1] == '-order':
         try:
-            poly_order = int(sys.argv[2])
+            poly_order = int(argv[2])
             file_suffix = '-order' + str(poly_order)
         except:
             poly_order = 3
-    elif sys.argv[1] == '-unadj':
+    elif argv[1] == '-unadj':
         to_adj = False
-        file_suffix = sys.argv[1]
+        file_suffix = argv[1]
     else:
-        file_suffix = sys.argv[1]
+        file_suffix = argv[1]
 
 
 ### START SCRIPT
@@ -61,7 +71,7 @@ save_dir_base = '../../../../validation_data/model-4.0_results/'
 date_dir = datetime.now().strftime('%Y.%m.%d')
 save_dir = save_dir_base + date_dir + '/'
 if not os.path.isdir(save_dir):
-    os.mkdir(save_dir)
+    os.makedirs(save_dir, exist_ok=True)
 
 time_str = datetime.now().strftime('%H:%M')
 # fit params
@@ -85,14 +95,6 @@ plt.rcParams.update({'font.family': 'Avenir', 'figure.titlesize': 16,
 
 file_lines = []
 
-def core_shell_model(t, chi_p):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p * f) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -107,24 +109,6 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
-    popt = (init_guess[0], init_guess[1])
-    try:
-        (popt, pcov) = curve_fit(core_shell_model, time, conc, p0=init_guess, bounds=bounds)
-    except ValueError:
-        pass
-    except RuntimeError:
-        pass
-
-
-    model_y = core_shell_model(time, *popt)
-
-    residuals = conc - model_y
-    ss_res = np.sum(residuals**2) # sum of square residuals
-    ss_total = np.sum((conc - np.mean(conc)) ** 2) # total sum of squares
-    r_sq = 1 - ss_res / ss_total
-    return popt, r_sq
-
 def fit_mag_field(window, b_r, l, w, t):
     def B_field(x, B_r, L, W, T):
        return (B_r/np.pi)*(np.arctan((L*W)/(2*x*np.sqrt(4*x**2+L**2+W**2)))-np.arctan((L*W)/(2*(x+T)*np.sqrt(4*(x+T)**2+L**2+W**2))))
@@ -150,28 +134,19 @@ log_path = input('\nEnter test log file (including path):\n')
 if log_path[-5:] != '.xlsx':
     log_path += '.xlsx'
 
+# the log, samples and magnets sheets are read in one pass over the workbook
+# (or from its snapshot, see map_fit/maplog.py)
 try:
-    log_df = pd.read_excel(path + log_path, sheet_name='log',
-        dtype={'Magnet': str})
-    print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
-except:
-    print('\nERROR: Invalid log file.')
-    sys.exit()
-
-try:
-    sample_df = pd.read_excel(path + log_path, sheet_name='samples')
-    print('Sample sheet loaded.')
-except:
-    print('ERROR: Could not load sample sheet.')
-    sys.exit()
-
-try:
-    mag_df = pd.read_excel(path + log_path, sheet_name='magnets',
-        dtype={'ID': str, 'Grade': float})
-    print('Magnets sheet loaded.')
-except:
-    print('ERROR: Could not load magnet sheet.')
+    log_sheets = maplog.read_log(path + log_path)
+except Exception as e:
+    print('\nERROR: Invalid log file: {}'.format(e))
     sys.exit()
+log_df = log_sheets['log']
+print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
+sample_df = log_sheets['samples']
+print('Sample sheet loaded.')
+mag_df = log_sheets['magnets']
+print('Magnets sheet loaded.')
 
 # file name entry
 file = input('\nPlease enter file name: \n')
@@ -180,148 +155,40 @@ if file[-4:] != '.txt':
     file += '.txt'
 
 try:
-    entry = log_df.loc[log_df['File'] == file_key].iloc[0]
-    print('Entry for {} successfully found.'.format(file_key))
-except:
-    sys.exit('ERROR: Could not find file {} in log.'.format(file))
-
-try:
-    dir = str(entry['Directory'])
-    if dir[-1] != '/':
-        dir += '/'
-    if 'paper_data/' in dir:
-        dir = dir.replace('paper_data/', '') # fix duplicate
-    print('Directory: ' + dir)
-except:
-    sys.exit('ERROR: Invalid directory: {}.'.format(entry['Directory']))
-
-sample = str(entry['Sample'])
-magnet = str(entry['Magnet'])
-
-try:
-    sample_entry = sample_df.loc[sample_df['ID'] == sample].iloc[0]
-    print('\nSample: ' + sample)
-except:
-    print('ERROR: Could not find sample {} in sample log'.format(sample))
-    sys.exit()
-
-try:
-    material = str(sample_entry['Material'])
-    if 'Dynabeads' in material:
-        f = (1400-1040)/(5170-1040)
-        print('f: {}'.format(f))
-except:
-    print('ERROR: Invalid sample material.')
-    sys.exit()
-
-try:
-    rho_p = float(sample_entry['Density'])
-    print('Density: {} kg/m^3'.format(rho_p))
-except ValueError:
-    print('ERROR: Invalid density - should be a numerical value with units kg/m^3')
-    sys.exit()
-
-try:
-    solvent = sample_entry['Solvent']
-    if solvent.lower() == 'water':
-        solvent_type = 'Water'
-        eta = 8.9e-4
-        chi_s = -9.04e-6
-    elif solvent.lower() == 'dpbs':
-        solvent_type = 'DPBS'
-        eta = 0.89e-3
-        chi_s = -9.05e-6
-    else:
-        print('ERROR: Unknown solvent.')
-        sys.exit()
-    print('Solvent: ' + solvent_type)
-except:
-    print('ERROR: Solvent could not be found.')
-    sys.exit()
-
-try:
-    radius = float(sample_entry['Radius'])
-    print('Radius: {} m'.format(radius))
-    optimize_radius = True
-    if radius == 0:
-        radius = 'Unknown'
-        print('Radius: unknown')
-        optimize_radius = False
-except:
-    radius = 'Unknown'
-    print('Radius: unknown')
-    optimize_radius = False
+    run = maplog.LogIndex(log_sheets)[file_key]
+except (KeyError, ValueError) as e:
+    sys.exit('ERROR: ' + e.args[0])
+print(run.describe())
+if not run.optimize_radius:
     sys.exit('ERROR: Cannot proceed with unknown radius.')
+dir = run.dir
+sample = run.sample
+magnet = run.magnet
+material = run.material
+if 'Dynabeads' in material:
+    f = (1400-1040)/(5170-1040)
+    print('f: {}'.format(f))
+rho_p = run.rho_p
+solvent_type, eta, chi_s = run.solvent_type, run.eta, run.chi_s
+radius = run.radius
+optimize_radius = run.optimize_radius
 
 r = radius
 
-try:
-    batch = str(sample_entry['Batch-date/Lot'])
-except:
-    print('ERROR: Could not find Batch date/Lot')
-    sys.exit()
-
-try:
-    c0 = float(sample_entry['Conc.\n[mg/mL]'])
-except:
-    print('ERROR: Invalid initial concentration')
-    sys.exit()
+batch = run.batch
+c0 = run.c0
 
 # magnet parameters
-try:
-    mag_entry = mag_df.loc[mag_df['ID'] == magnet].iloc[0]
-    print('\nMagnet: ' + magnet)
-except:
-    print('ERROR: Could not find magnet {} in magnet log.'.format(magnet))
-    sys.exit()
-
-try:
-    mag_name = str(mag_entry['K&J magnet'])
-    print('K&J Magnet: ' + str(mag_name))
-except:
-    sys.exit('ERROR: Could not find name of magnet.')
+mag_name = run.mag_name
+l_in, w_in, t_in = run.l_in, run.w_in, run.t_in # inches
+grade = run.grade
+dist = run.dist # mm
+window = run.window
 
-try:
-    l_in = float(mag_entry['Length']) # inches
-    print('Length: {}"'.format(l_in))
-except:
-    sys.exit('ERROR: Invalid length.')
-
-try:
-    w_in = float(mag_entry['Width']) # inches
-    print('Width: {}"'.format(w_in))
-except:
-    sys.exit('ERROR: Invalid width.')
-
-try:
-    t_in = float(mag_entry['Height']) # inches
-    print('Thickness: {}"'.format(t_in))
-except:
-    sys.exit('ERROR: Invalid height.')
-
-try:
-    grade = int(mag_entry['Grade'])
-    print('Grade: N{:d}'.format(grade))
-except:
-    sys.exit('ERROR: Invalid grade: {}.'.format(mag_entry['Grade']))
-
-try:
-    dist = float(mag_entry['Distance']) # mm
-    window = [dist - 0.5, dist + 0.5]
-except:
-    sys.exit('ERROR: Invalid distance.')
-
-# magnet params
 l = l_in * in2m
 w = w_in * in2m
 t = t_in * in2m
-if grade == 52:
-    b_r = 1.48
-elif grade == 42:
-    b_r = 1.32
-else:
-    print('Unknown magnet grade of {}'.format(grade))
-    sys.exit()
+b_r = run.b_r
 
 a, fit_str = fit_mag_field(window, b_r, l, w, t)
 print('Fit magnetic field: a = {}'.format(a))
@@ -376,7 +243,7 @@ file_lines.append('Fit bounds: [{:0.2e}, {:0.2e}]'.format(bounds[0][0], bounds[1
 file_path = path + dir + file
 print('\nNow processing ' + str(file_path))
 
-data = np.genfromtxt(file_path)
+data = runfile.load(file_path)
 time = data[:, 0]
 lux = data[:, 1]
 
@@ -429,21 +296,22 @@ best_r_sq = -np.inf
 best_r_sq_result = [0, 0]
 
 c0 = conc_shifted[0]
+model = models.CoreShellModel(eta, rho_p, a, chi_s, c0, r, f, mu0)
 
 print_list = []
 
 start_time = pytime.time()
-for init_guess in tqdm(guesses):
-    try:
-        (popt, pcov) = curve_fit(core_shell_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
-    except ValueError:
-        pass
-    except RuntimeError:
-        pass
-    except ZeroDivisionError:
-        pass
-
-    adj_model_y = core_shell_model(time_shifted, *popt)
+global_summary = None
+if opts['global'] is not None:
+    box, log_scale = globalopt.search_box(guesses, bounds)
+    fits, global_summary = globalopt.global_fits(model, time_shifted,
+        conc_shifted, box, bounds, jac=model.jacobian, log_scale=log_scale,
+        method=opts['global'], n_grid=len(guesses))
+else:
+    fits = multistart.serial_fits(model.single, time_shifted, conc_shifted,
+        guesses, bounds, jac=model.single_jacobian)
+for init_guess, popt, pcov in fits:
+    adj_model_y = model.single(time_shifted, *popt)
 
     residuals = conc_shifted - adj_model_y
     ss_res = np.sum(residuals**2) # sum of square residuals
@@ -471,6 +339,8 @@ end_time = pytime.time()
 duration = end_time - start_time
 
 print('time to fit: ' + str(duration) + ' s')
+if global_summary is not None:
+    print(global_summary)
 
 # print results
 # print('\n*new best by r^2\n')
@@ -487,12 +357,14 @@ print('{chi_guess:0.4e}\t{chi:0.4e}\t{r_sq:0.12f}'.format(
     chi_guess=best_r_sq_guess[0], chi=best_r_sq_result[0],
     r_sq=best_r_sq))
 
-best_r_sq_y = core_shell_model(time_shifted, *best_r_sq_result)
+best_r_sq_y = model.single(time_shifted, *best_r_sq_result)
 
 
 ## update files
 file_lines.append('\n--- Model Results ---')
 file_lines.append('Time to fit: ' + str(duration) + ' s')
+if global_summary is not None:
+    file_lines.append(global_summary)
 
 file_lines.append('\nFINAL RESULTS')
 file_lines.append('init_chi\t\tchi\t\tr_sq')
@@ -13,6 +13,9 @@ import time as pytime
 import pandas as pd
 import warnings
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import flags, globalopt, joint, maplog, models, multistart, runfile, runstore
+
 ver = 3.0
 to_save = True
 
@@ -20,17 +23,42 @@ file_suffix = ''
 num_chi_guesses = 100
 num_r_guesses = 500
 
+# each line of the list file is one group of files that share chi and radius;
+# the group is fitted jointly, with c0 and an offset fitted for each file
+# optional flags:
+#   -workers N  split the guesses over N processes (default 1)
+#   -screen K   rank the guess grid by SSE and only fit from the selected guesses
+#   -screenrule topk|minima|both  which guesses -screen keeps (default both)
+#   -global de  search the box of the guess grid with differential evolution
+#               instead of fitting from every guess (see map_fit/globalopt.py)
+#   -store file read the runs from a run store instead of the data folders
+#               (see map_fit/runstore.py)
+#   -skipbad    skip the groups with a file with invalid log entries and fit
+#               the others
+#               (by default an invalid entry stops the run before any fit)
+argv, opts = flags.pop_flags(sys.argv, {'workers': 1, 'screen': 0,
+    'screenrule': 'both', 'global': None, 'store': None, 'skipbad': False})
+if opts['screenrule'] not in ['topk', 'minima', 'both']:
+    sys.exit('ERROR: -screenrule must be topk, minima or both')
+if opts['global'] is not None and opts['global'] not in globalopt.METHODS:
+    sys.exit('ERROR: -global must be one of ' + ', '.join(globalopt.METHODS))
+
 # load files to run from script
-if len(sys.argv) < 3:
-    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file>')
-log_path = sys.argv[1]
-to_run_file = sys.argv[2]
+if len(argv) < 3:
+    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python grouped_fits.py <log_file> <list file> [-workers N] [-screen K [-screenrule rule]] [-global de] [-store file] [-skipbad]')
+run_store = None
+if opts['store'] is not None:
+    if not os.path.isfile(opts['store']):
+        sys.exit('ERROR: no run store at ' + opts['store'])
+    run_store = runstore.open_store(opts['store'])
+log_path = argv[1]
+to_run_file = argv[2]
 print('log input: ' + log_path)
 print('list file: ' + to_run_file)
 
 # option to add suffix to file names to allow for duplicate runs
-if len(sys.argv) > 3:
-    file_suffix = sys.argv[3]
+if len(argv) > 3:
+    file_suffix = argv[3]
 
 if log_path[-5:] != '.xlsx':
     log_path += '.xlsx'
@@ -52,7 +80,7 @@ save_dir_base = '../../../../validation_data/model-4.0_results/'
 date_dir = datetime.today().strftime('%Y.%m.%d')
 save_dir = save_dir_base + date_dir + '/'
 if not os.path.isdir(save_dir):
-    os.mkdir(save_dir)
+    os.makedirs(save_dir, exist_ok=True)
 
 label_font = fm.FontProperties(family='Avenir', size=10)
 subtitle_font = fm.FontProperties(family='Avenir', size=12)
@@ -64,22 +92,6 @@ plt.rcParams.update({'font.family': 'Avenir', 'figure.titlesize': 16,
 
 file_lines = []
 
-def working_model(t, chi_p, r):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
-def single_var_model(t, chi_p):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -94,23 +106,6 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
-    popt = (init_guess[0], init_guess[1])
-    try:
-        (popt, pcov) = curve_fit(working_model, time, conc, p0=init_guess, bounds=bounds)
-    except ValueError:
-        pass
-    except RuntimeError:
-        pass
-
-    model_y = working_model(time, *popt)
-
-    residuals = conc - model_y
-    ss_res = np.sum(residuals**2) # sum of square residuals
-    ss_total = np.sum((conc - np.mean(conc)) ** 2) # total sum of squares
-    r_sq = 1 - ss_res / ss_total
-    return popt, r_sq
-
 def fit_mag_field(window, b_r, l, w, t):
     def B_field(x, B_r, L, W, T):
        return (B_r/np.pi)*(np.arctan((L*W)/(2*x*np.sqrt(4*x**2+L**2+W**2)))-np.arctan((L*W)/(2*(x+T)*np.sqrt(4*(x+T)**2+L**2+W**2))))
@@ -131,28 +126,33 @@ def fit_mag_field(window, b_r, l, w, t):
     return linreg.slope, fit_str
 
 ### READ LOG FILE
+# the log, samples and magnets sheets are read in one pass over the workbook
+# (or from its snapshot, see map_fit/maplog.py)
 try:
-    log_df = pd.read_excel(path + log_path, sheet_name='log',
-        dtype={'Magnet': str})
-    print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
-except:
-    print('\nERROR: Invalid log file.')
-    sys.exit()
-
-try:
-    sample_df = pd.read_excel(path + log_path, sheet_name='samples')
-    print('Sample sheet loaded.')
-except:
-    print('ERROR: Could not load sample sheet.')
-    sys.exit()
-
-try:
-    mag_df = pd.read_excel(path + log_path, sheet_name='magnets',
-        dtype={'ID': str, 'Grade': float})
-    print('Magnets sheet loaded.')
-except:
-    print('ERROR: Could not load magnet sheet.')
+    log_sheets = maplog.read_log(path + log_path)
+except Exception as e:
+    print('\nERROR: Invalid log file: {}'.format(e))
     sys.exit()
+log_df = log_sheets['log']
+print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
+sample_df = log_sheets['samples']
+print('Sample sheet loaded.')
+mag_df = log_sheets['magnets']
+print('Magnets sheet loaded.')
+
+### CHECK THE LOG ENTRIES OF ALL FILES
+# every file is looked up in the log, samples and magnets sheets before
+# anything is fitted, so all bad entries are reported now and not when the
+# run reaches them; a group with a bad file is skipped as a whole
+log_index = maplog.LogIndex(log_sheets)
+runs, bad_runs = log_index.resolve([g for f in to_run_list for g in f.split()])
+if bad_runs:
+    for key, error in bad_runs.items():
+        print('ERROR: {}: {}'.format(key, error))
+    if not opts['skipbad']:
+        sys.exit('ERROR: {} files with invalid log entries (skip their groups with -skipbad).'.format(len(bad_runs)))
+    to_run_list = [f for f in to_run_list
+        if not any(maplog.file_key(g) in bad_runs for g in f.split())]
 
 ### LOOP THROUGH ALL FILES
 for f in to_run_list:
@@ -191,6 +191,7 @@ for f in to_run_list:
     file_names = file_names[:-2]
     file_lines.append('Files: ' + file_names)
 
+    file_paths = []
     for g in group:
         file_key = g
         file = g
@@ -200,143 +201,32 @@ for f in to_run_list:
         else:
             file += '.txt'
 
-        try:
-            entry = log_df.loc[log_df['File'] == file_key].iloc[0]
-            print('Entry for {} successfully found.'.format(file_key))
-        except:
-            sys.exit('ERROR: Could not find file {} in log.'.format(file))
-
-        try:
-            dir = str(entry['Directory'])
-            if dir[-1] != '/':
-                dir += '/'
-            if 'paper_data/' in dir:
-                dir = dir.replace('paper_data/', '') # fix duplicate
-            print('Directory: ' + dir)
-        except:
-            sys.exit('ERROR: Invalid directory: {}.'.format(entry['Directory']))
-
-        sample = str(entry['Sample'])
-        magnet = str(entry['Magnet'])
-
-        try:
-            sample_entry = sample_df.loc[sample_df['ID'] == sample].iloc[0]
-            print('\nSample: ' + sample)
-        except:
-            print('ERROR: Could not find sample {} in sample log'.format(sample))
-            sys.exit()
-
-        try:
-            material = str(sample_entry['Material'])
-        except:
-            print('ERROR: Invalid sample material.')
-            sys.exit()
-
-        try:
-            rho_p = float(sample_entry['Density'])
-            print('Density: {} kg/m^3'.format(rho_p))
-        except ValueError:
-            print('ERROR: Invalid density - should be a numerical value with units kg/m^3')
-            sys.exit()
-
-        try:
-            solvent = sample_entry['Solvent']
-            if solvent.lower() == 'water':
-                solvent_type = 'Water'
-                eta = 8.9e-4
-                chi_s = -9.04e-6
-            elif solvent.lower() == 'dpbs':
-                solvent_type = 'DPBS'
-                eta = 0.89e-3
-                chi_s = -9.05e-6
-            else:
-                print('ERROR: Unknown solvent.')
-                sys.exit()
-            print('Solvent: ' + solvent_type)
-        except:
-            print('ERROR: Solvent could not be found.')
-            sys.exit()
-
-        try:
-            radius = float(sample_entry['Radius'])
-            print('Radius: {} m'.format(radius))
-            optimize_radius = True
-            if radius == 0:
-                radius = 'Unknown'
-                print('Radius: unknown')
-                optimize_radius = False
-        except:
-            radius = 'Unknown'
-            print('Radius: unknown')
-            optimize_radius = False
-
-        try:
-            batch = str(sample_entry['Batch-date/Lot'])
-        except:
-            print('ERROR: Could not find Batch date/Lot')
-            sys.exit()
-
-        try:
-            c0 = float(sample_entry['Conc.\n[mg/mL]'])
-        except:
-            print('ERROR: Invalid initial concentration')
-            sys.exit()
+        # entries of the file, looked up and checked before the loop
+        run = runs[file_key]
+        print(run.describe())
+        dir = run.dir
+        file_paths.append(path + dir + file)
+        sample = run.sample
+        magnet = run.magnet
+        material = run.material
+        rho_p = run.rho_p
+        solvent_type, eta, chi_s = run.solvent_type, run.eta, run.chi_s
+        radius = run.radius
+        optimize_radius = run.optimize_radius
+        batch = run.batch
+        c0 = run.c0
 
         # magnet parameters
-        try:
-            mag_entry = mag_df.loc[mag_df['ID'] == magnet].iloc[0]
-            print('\nMagnet: ' + magnet)
-        except:
-            print('ERROR: Could not find magnet {} in magnet log.'.format(magnet))
-            sys.exit()
-
-        try:
-            mag_name = str(mag_entry['K&J magnet'])
-            print('K&J Magnet: ' + str(mag_name))
-        except:
-            sys.exit('ERROR: Could not find name of magnet.')
-
-        try:
-            l_in = float(mag_entry['Length']) # inches
-            print('Length: {}"'.format(l_in))
-        except:
-            sys.exit('ERROR: Invalid length.')
-
-        try:
-            w_in = float(mag_entry['Width']) # inches
-            print('Width: {}"'.format(w_in))
-        except:
-            sys.exit('ERROR: Invalid width.')
-
-        try:
-            t_in = float(mag_entry['Height']) # inches
-            print('Thickness: {}"'.format(t_in))
-        except:
-            sys.exit('ERROR: Invalid height.')
-
-        try:
-            grade = int(mag_entry['Grade'])
-            print('Grade: N{:d}'.format(grade))
-        except:
-            sys.exit('ERROR: Invalid grade: {}.'.format(mag_entry['Grade']))
-
-        try:
-            dist = float(mag_entry['Distance']) # mm
-            window = [dist - 0.5, dist + 0.5]
-        except:
-            sys.exit('ERROR: Invalid distance.')
-
-        # magnet params
+        mag_name = run.mag_name
+        l_in, w_in, t_in = run.l_in, run.w_in, run.t_in # inches
+        grade = run.grade
+        dist = run.dist # mm
+        window = run.window
+
         l = l_in * in2m
         w = w_in * in2m
         t = t_in * in2m
-        if grade == 52:
-            b_r = 1.48
-        elif grade == 42:
-            b_r = 1.32
-        else:
-            print('Unknown magnet grade of {}'.format(grade))
-            sys.exit()
+        b_r = run.b_r
 
         a, fit_str = fit_mag_field(window, b_r, l, w, t)
         print('Fit magnetic field: a = {}'.format(a))
@@ -362,39 +252,43 @@ for f in to_run_list:
     ### INTIALIZE GUESSES & BOUNDS
     chis = np.logspace(-6, 2, num=num_chi_guesses)
     rs = np.logspace(-9, -4, num=num_r_guesses)
-    guesses = chis
-    # for i in range(len(chis)):
-        # for j in range(len(rs)):
-        #     guesses.append([chis[i], rs[j]])
+    guesses = []
+    for i in range(len(chis)):
+        for j in range(len(rs)):
+            guesses.append([chis[i], rs[j]])
     print("total number of guesses: " + str(len(guesses)))
 
-    bounds = ([0], [10])
-    #bounds = ([0, 1e-10], [100, 1e-4])#([0, 0], [np.inf, np.inf])
+    bounds = ([0, 1e-9], [10, 1e-4])
 
     ## update file lines
     file_lines.append('\n--- Fit parameters ---')
     file_lines.append('Guess ranges:')
     file_lines.append('\tChi: [{:0.2e}, {:0.2e}] ({:d} values with log spacing)'.format(chis[0], chis[-1], num_chi_guesses))
-    # file_lines.append('\tRadius: [{:0.6e}, {:0.6e} ({:d} values with log spacing)]'.format(rs[0], rs[-1], num_r_guesses))
+    file_lines.append('\tRadius: [{:0.6e}, {:0.6e}] ({:d} values with log spacing)'.format(rs[0], rs[-1], num_r_guesses))
     file_lines.append('Bounds: ')
     file_lines.append('\tChi: [{:0.2e}, {:0.2e}]'.format(bounds[0][0], bounds[1][0]))
-    # file_lines.append('\tRadius: [{:0.2e}, {:0.2e}]'.format(bounds[0][1], bounds[1][1]))
-    # file_lines.append('All values:')
-    # file_lines.append('\tChi: ' + str(chis))
-    # file_lines.append('\tRadius: ' + str(rs))
+    file_lines.append('\tRadius: [{:0.2e}, {:0.2e}]'.format(bounds[0][1], bounds[1][1]))
+    file_lines.append('Joint fit: shared chi and radius, c0 and offset fitted per file')
 
     file_lines.append('\n--- File Processing Information ---')
     processed_data = []
-    for g in group:
+    for g, file_path in zip(group, file_paths):
         ### IMPORT DATA
-        file_path = path + dir + file
-        print('\nnow processing ' + str(file_path))
-
-        data = np.genfromtxt(file_path)
-        time = data[:, 0]
-        lux = data[:, 1]
+        if run_store is not None:
+            print('\nnow processing ' + str(g) + ' from the run store ' + opts['store'])
+            # the file key, as in the log lookup above
+            store_key = maplog.file_key(g)
+            if store_key not in run_store:
+                sys.exit('ERROR: {} is not in the run store {}.'.format(store_key, opts['store']))
+            # read-only views of the memory-mapped columns of the store
+            time, lux = run_store.columns(store_key)
+        else:
+            print('\nnow processing ' + str(file_path))
+            data = runfile.load(file_path)
+            time = data[:, 0]
+            lux = data[:, 1]
 
-        print('successfully loaded: ' + str(file))
+        print('successfully loaded: ' + str(g))
 
         conc = calibrate(lux, c0)
         neg_count = (np.array(conc) < 0).sum()
@@ -412,8 +306,6 @@ for f in to_run_list:
         # compute first derivative of data
         conc_prime = savgol_filter(conc, window_size, poly_order, deriv=1,
             delta=time[1]-time[0])
-        conc_dbl_prime = savgol_filter(conc, window_size, poly_order, deriv=2,
-            delta=time[1]-time[0])
         min_n = 20
         print('Minimum inflection point: ' + str(min_n))
         global_min_index = np.argmin(conc_prime[min_n:])+min_n
@@ -421,7 +313,9 @@ for f in to_run_list:
 
         time_shifted = time[global_min_index:] - time[global_min_index]
         conc_shifted = conc[global_min_index:]
-        processed_data.append([time_shifted, conc_shifted])
+        processed_data.append(dict(file=g, time=time, conc=conc,
+            conc_prime=conc_prime, global_min_index=global_min_index,
+            time_shifted=time_shifted, conc_shifted=conc_shifted))
 
         ## update file lines
         file_lines.append('\nFile: ' + str(g))
@@ -430,122 +324,102 @@ for f in to_run_list:
         file_lines.append('Global min timepoint (after min {} values) is {} s.'.format(min_n, time[global_min_index]))
 
     ### FIT OPTIMIZATION
-    # fit the shifted data
-    best_r_sq_guess = guesses[0]
-    best_r_sq = np.inf
-    best_r_sq_result = [0, 0]
-    best_r_sq_rad = 0
-    best_dist_guess = guesses[0]
-    best_dist = np.inf
-    best_dist_r_sq = -np.inf
-    best_dist_result = [0, 0]
-    c0 = conc_shifted[0]
+    # fit all files of the group at once: one shared (chi, r) and a c0 and
+    # offset per file
+    joint_model = joint.JointModel([d['time_shifted'] for d in processed_data],
+        [d['conc_shifted'] for d in processed_data], eta, rho_p, a, chi_s, mu0)
+    counts = joint_model.counts
+
+    def file_mses(popt):
+        g = joint_model.shape([popt[:2]])
+        y = joint_model.curves(g, np.reshape(popt[2:], (1, -1, 2)))[0]
+        return np.add.reduceat((y - joint_model.y)**2, joint_model.starts) / counts
+
+    best_guess = guesses[0]
+    best_agg_mse = np.inf
+    best_result = None
 
     print_list = []
 
     start_time = pytime.time()
-    for r in tqdm(rs):
-        for init_guess in guesses:
-            # iterate over guesses
-            agg_r_sq = 0
-            res = []
-            for row in processed_data:
-                time_shifted = row[0]
-                conc_shifted = row[1]
-                try:
-                    (popt, pcov) = curve_fit(single_var_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
-                except ValueError:
-                    #print("ValueError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
-                    pass
-                except RuntimeError:
-                    #print("RuntimeError encountered at chi_init {chi:0.4f}, r_init {r:0.4f}".format(chi=init_guess[0], r=init_guess[1]))
-                    pass
-                except ZeroDivisionError:
-                    pass
-
-                adj_model_y = single_var_model(time_shifted, *popt)
-
-                residuals = conc_shifted - adj_model_y
-                ss_res = np.sum(residuals**2) # sum of square residuals
-                # ss_total = np.sum((conc_shifted - np.mean(conc_shifted)) ** 2) # total sum of squares
-                # r_sq = 1 - ss_res / ss_total
-                mse = ss_res / len(residuals)
-                r_sq = mse
-                agg_r_sq += r_sq
-                res.append(*popt)
-
-            # check conditionals
-            to_print = False
-            print_str = ''
-
-            if agg_r_sq < best_r_sq:
-                best_r_sq = agg_r_sq
-                best_r_sq_result = res
-                best_r_sq_rad = r
-                best_r_sq_guess = init_guess
-                to_print = True
-                print_str += '^'
-
-            # if optimize_radius:
-            #     r_result = popt[1]
-            #     distance = np.abs(radius - r_result)
-            #
-            #     if distance <= best_dist:
-            #         best_dist_guess = init_guess
-            #         best_dist_result = res
-            #         best_dist = distance
-            #         best_dist_r_sq = r_sq
-            #         to_print = True
-            #         print_str += '*'
-
-            if to_print:
-                print_str += '{r:0.2e}\t{chi_guess:0.2e}\t{chi:0.6e}\t{r_sq:0.12f}'.format(
-                    r=r, chi_guess=init_guess, chi=popt[0],
-                    r_sq=r_sq)
-                print_list.append(print_str)
+    screen_summary = None
+    if opts['global'] is not None:
+        box, log_scale = globalopt.search_box(guesses, bounds)
+        fits, screen_summary = globalopt.global_fits(joint_model, joint_model.t,
+            joint_model.y, box, bounds, log_scale=log_scale, method=opts['global'],
+            n_grid=len(guesses), refine=lambda starts: joint.joint_fits(joint_model,
+                starts, bounds, progress=False))
+        print(screen_summary)
+    else:
+        if opts['screen'] > 0:
+            guesses, screen_summary = multistart.screen_guesses(joint_model,
+                joint_model.t, joint_model.y, guesses,
+                grid_shape=(num_chi_guesses, num_r_guesses), top_k=opts['screen'],
+                rule=opts['screenrule'])
+            print(screen_summary)
+        fits = joint.joint_fits(joint_model, guesses, bounds, workers=opts['workers'])
+    for init_guess, popt, pcov in fits:
+        mses = file_mses(popt)
+        agg_mse = np.sum(mses)
+
+        # check conditionals
+        if agg_mse < best_agg_mse:
+            best_agg_mse = agg_mse
+            best_result = popt
+            best_pcov = pcov
+            best_guess = init_guess
+            print_list.append('^{chi_guess:0.2e}\t{r_guess:0.2e}\t{chi:0.6e}\t{r:0.6e}\t{mse:0.12f}'.format(
+                chi_guess=init_guess[0], r_guess=init_guess[1], chi=popt[0],
+                r=popt[1], mse=agg_mse))
 
     end_time = pytime.time()
     duration = end_time - start_time
 
-    # print results
-    # print('\n^new best by r^2\n')
-    # if optimize_radius:
-    #     print('*new best by radius\n')
-    # print('init_chi\tinit_radius\tchi\t\tradius\t\tr_sq\tdist_to_r')
-    # for s in print_list:
-    #     print(s)
-
     print('time to fit: ' + str(duration) + ' s')
 
-    def format_chi_str(result):
-        s = ''
-        for r in result:
-            s += '{:0.4e}'.format(r) + ', '
-        return s[:-2]
+    if best_result is None:
+        sys.exit('ERROR: no joint fit converged for files ' + file_names)
+
+    best_mses = file_mses(best_result)
+    best_r_sqs = []
+    for i, d in enumerate(processed_data):
+        ss_total = np.sum((d['conc_shifted'] - np.mean(d['conc_shifted']))**2)
+        best_r_sqs.append(1 - best_mses[i] * counts[i] / ss_total)
+    best_y = joint_model.curves(joint_model.shape([best_result[:2]]),
+        np.reshape(best_result[2:], (1, -1, 2)))[0]
+    chi_err, r_err = np.sqrt(np.diag(best_pcov))
 
     print("\nFINAL MODEL")
     print("files: " + str(file_names))
-    print('init_chi\t\tchi\t\tr_sq')
-    print('{r:0.4e}\t{chi_guess:0.4e}\t{chi}\t{r_sq:0.12f}'.format(
-        r=best_r_sq_rad, chi_guess=best_r_sq_guess, chi=format_chi_str(best_r_sq_result),
-        r_sq=best_r_sq))
-
-    # best_r_sq_y = working_model(time_shifted, *best_r_sq_result)
+    print('init_chi\tinit_radius\tchi\t\tradius\t\tagg_mse')
+    print('{chi_guess:0.4e}\t{r_guess:0.4e}\t{chi:0.6e}\t{r:0.6e}\t{mse:0.12f}'.format(
+        chi_guess=best_guess[0], r_guess=best_guess[1], chi=best_result[0],
+        r=best_result[1], mse=best_agg_mse))
+    print('file\tc0\t\toffset\t\tmse\t\tr_sq')
+    for i, d in enumerate(processed_data):
+        print('{}\t{:0.6e}\t{:0.6e}\t{:0.6e}\t{:0.6f}'.format(d['file'],
+            best_result[2 + 2 * i], best_result[3 + 2 * i], best_mses[i], best_r_sqs[i]))
 
     file_lines.append('\nFINAL RESULTS')
     file_lines.append('Files: ' + str(file_names))
-    file_lines.append('Opt. param.:\tinit_chi\tinit_radius\tchi\t\tradius\t\tr_sq')
-    file_lines.append('{r:0.4e}\t{chi_guess:0.4e}\t{chi}\t{r_sq:0.12f}'.format(
-        r=best_r_sq_rad, chi_guess=best_r_sq_guess, chi=format_chi_str(best_r_sq_result),
-        r_sq=best_r_sq))
+    file_lines.append('Opt. param.:\tinit_chi\tinit_radius\tchi\t\tradius\t\tagg_mse')
+    file_lines.append('{chi_guess:0.4e}\t{r_guess:0.4e}\t{chi:0.6e}\t{r:0.6e}\t{mse:0.12f}'.format(
+        chi_guess=best_guess[0], r_guess=best_guess[1], chi=best_result[0],
+        r=best_result[1], mse=best_agg_mse))
+    file_lines.append('Std. error:\tchi: {:0.4e}\tradius: {:0.4e}'.format(chi_err, r_err))
+    file_lines.append('Per file:\tfile\tc0\t\toffset\t\tmse\t\tr_sq')
+    for i, d in enumerate(processed_data):
+        file_lines.append('\t{}\t{:0.6e}\t{:0.6e}\t{:0.6e}\t{:0.6f}'.format(d['file'],
+            best_result[2 + 2 * i], best_result[3 + 2 * i], best_mses[i], best_r_sqs[i]))
 
     ## update files
     file_lines.append('\n--- Full Results ---')
     file_lines.append('Time to fit: ' + str(duration) + ' s')
-    file_lines.append('^new best by r^2')
-    # if optimize_radius:
-    #     file_lines.append('*new best by radius\n')
-    file_lines.append('init_chi\tchi\tr_sq')
+    file_lines.append('Fit workers: ' + str(opts['workers']))
+    if screen_summary is not None:
+        file_lines.append(screen_summary)
+    file_lines.append('^new best by aggregate MSE')
+    file_lines.append('init_chi\tinit_radius\tchi\tradius\tagg_mse')
     for s in print_list:
         file_lines.append(s)
 
@@ -553,16 +427,22 @@ for f in to_run_list:
     # plot data
     f, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(10, 4))
     f.suptitle(file_names)
-    ax2.plot(time, conc_prime * 1000, color='green', label='Data')
-    ax2.plot(time[global_min_index], conc_prime[global_min_index] * 1000, 'o', markersize=5, color='r', label='Inflection point')
+    for i, d in enumerate(processed_data):
+        time = d['time']
+        global_min_index = d['global_min_index']
+        color = 'C{}'.format(i)
+        ax2.plot(time, d['conc_prime'] * 1000, color=color, label=d['file'])
+        ax2.plot(time[global_min_index], d['conc_prime'][global_min_index] * 1000, 'o',
+            markersize=5, color='r')
+
+        ax3.plot(time, d['conc'], color=color, label=d['file'])
+        start = joint_model.starts[i]
+        ax3.plot(d['time_shifted'] + time[global_min_index],
+            best_y[start:start + counts[i]], '--', color='k')
     ax2.set_xlabel('Time (s)')
     ax2.set_ylabel('Conc. gradient (µg/mL per s)')
     ax2.legend(loc='lower right', handlelength=2)
-
-    ax3.plot(time, conc, color='green', label='Data')
-    ax3.plot(time_shifted + time[global_min_index], best_r_sq_y, '--', color='blue', label='Best $r^2$ fit')
-    if optimize_radius:
-        ax3.plot(time_shifted + time[global_min_index], best_dist_y, ':', color='red', label='Best radius fit')
+    ax3.plot([], [], '--', color='k', label='Joint fit')
     ax3.set_xlabel('Time (s)')
     ax3.set_ylabel('Concentration (mg/mL)')
     ax3.legend(loc='upper right', handlelength=2)
@@ -577,20 +457,14 @@ for f in to_run_list:
     text_kwargs = {'fontproperties': label_font,
         'verticalalignment': 'top', 'horizontalalignment': 'left',
         'transform': ax1.transAxes}
-    labels = 'chi_i:\nrad_i:\nchi:\nrad:\n$r^2$'
-    r_sq_str = '{chi_i:0.2e}\n{r_i:0.2e}\n{chi:0.6e}\n{rad:0.6e}\n{rsq:0.6f}'.format(
-        chi_i=best_r_sq_guess[0], r_i=best_r_sq_guess[1], chi=best_r_sq_result[0],
-        rad=best_r_sq_result[1], rsq=best_r_sq)
-    # rad_str = '{chi_i:0.2e}\n{r_i:0.2e}\n{chi:0.6e}\n{rad:0.6e}\n{rsq:0.6f}'.format(
-    #     chi_i=best_dist_guess[0], r_i=best_dist_guess[1], chi=best_dist_result[0],
-    #     rad=best_dist_result[1], rsq=best_dist_r_sq)
+    labels = 'chi_i:\nrad_i:\nchi:\nrad:\nMSE:'
+    mse_str = '{chi_i:0.2e}\n{r_i:0.2e}\n{chi:0.6e}\n{rad:0.6e}\n{mse:0.6e}'.format(
+        chi_i=best_guess[0], r_i=best_guess[1], chi=best_result[0],
+        rad=best_result[1], mse=best_agg_mse)
 
     ax1.text(0.02, 0.44, labels, **text_kwargs)
-    ax1.text(0.24, 0.54, 'Best $r^2$', **text_kwargs, fontsize=12)
-    ax1.text(0.24, 0.44, r_sq_str, **text_kwargs)
-    if optimize_radius:
-        ax1.text(0.65, 0.54, 'Best radius', **text_kwargs, fontsize=12)
-        ax1.text(0.65, 0.44, rad_str, **text_kwargs)
+    ax1.text(0.24, 0.54, 'Best joint fit', **text_kwargs, fontsize=12)
+    ax1.text(0.24, 0.44, mse_str, **text_kwargs)
     ax1.set_xlim([0, 1])
     ax1.set_ylim([0, 1])
     ax1.plot([0.2, 0.2], [0.1, 0.560], color='grey', linewidth=1, linestyle=':')
@@ -602,9 +476,9 @@ for f in to_run_list:
     r_params = '[' + str(rs[0]) + ', ' + str(rs[-1]) + ']'
     bounds_str = 'bounds'
     bounds_chi_str = 'chi: '
-    bounds_chi = str(bounds[0][0]) + ' - ' + str(bounds[0][1])
-    # bounds_rad_str = 'rad: '
-    # bounds_rad = str(bounds[1][0]) + ' - ' + str(bounds[1][1])
+    bounds_chi = str(bounds[0][0]) + ' - ' + str(bounds[1][0])
+    bounds_rad_str = 'rad: '
+    bounds_rad = str(bounds[0][1]) + ' - ' + str(bounds[1][1])
 
     ax1.text(0.02, 0.97, 'Fit parameters', **text_kwargs, fontsize=12)
     ax1.text(0.02, 0.87, chi_param_str, **text_kwargs)
@@ -614,8 +488,8 @@ for f in to_run_list:
     ax1.text(0.02, 0.72, bounds_str, **text_kwargs)
     ax1.text(0.24, 0.75, bounds_chi_str, **text_kwargs)
     ax1.text(0.4, 0.75, bounds_chi, **text_kwargs)
-    # ax1.text(0.24, 0.69, bounds_rad_str, **text_kwargs)
-    # ax1.text(0.4, 0.69, bounds_rad, **text_kwargs)
+    ax1.text(0.24, 0.69, bounds_rad_str, **text_kwargs)
+    ax1.text(0.4, 0.69, bounds_rad, **text_kwargs)
     ax1.plot([0.0, 1.0], [0.6, 0.6], color=grey, linewidth=1)
     ax1.plot([0.0, 1.0], [0.89, 0.89], color=grey, linewidth=1, linestyle=':')
     ax1.plot([0.35, 0.35], [0.63, 0.9], color=grey, linewidth=1, linestyle=':')
@@ -628,6 +502,6 @@ for f in to_run_list:
             for l in file_lines:
                 f.write(l + '\n')
 
-        plt.savefig(save_dir + file[:-4] + '-fit' + file_suffix + '.png', dpi=600)
+        plt.savefig(save_dir + file_names + '-fit' + file_suffix + '.png', dpi=600)
     else:
         plt.show()
@@ -13,22 +13,45 @@ import time as pytime
 import pandas as pd
 import warnings
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import checkpoint, flags, globalopt, maplog, models, multistart, runfile, runstore
+
 ver = '2.2-radius_sweep' # updated to include data truncation, sweep
 to_save = True
 
 file_suffix = ''
 
+# optional flags:
+#   -resume  continue an interrupted sweep of the same list file from its
+#            checkpoint (kept in <results dir>/checkpoints/)
+#   -global de  at each radius, search the box of the guess grid with
+#               differential evolution instead of fitting from every guess
+#               (see map_fit/globalopt.py)
+#   -store file read the runs from a run store instead of the data folders
+#               (see map_fit/runstore.py)
+#   -skipbad    skip the files with invalid log entries and fit the others
+#               (by default an invalid entry stops the run before any fit)
+argv, opts = flags.pop_flags(sys.argv, {'resume': False, 'global': None,
+    'store': None, 'skipbad': False})
+if opts['global'] is not None and opts['global'] not in globalopt.METHODS:
+    sys.exit('ERROR: -global must be one of ' + ', '.join(globalopt.METHODS))
+
 # load files to run from script
-if len(sys.argv) < 3:
-    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file>')
-log_path = sys.argv[1]
-to_run_file = sys.argv[2]
+if len(argv) < 3:
+    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file> [-resume] [-global de] [-store file] [-skipbad]')
+run_store = None
+if opts['store'] is not None:
+    if not os.path.isfile(opts['store']):
+        sys.exit('ERROR: no run store at ' + opts['store'])
+    run_store = runstore.open_store(opts['store'])
+log_path = argv[1]
+to_run_file = argv[2]
 print('log input: ' + log_path)
 print('list file: ' + to_run_file)
 
 # option to add suffix to file names to allow for duplicate runs
-if len(sys.argv) > 3:
-    file_suffix = sys.argv[3]
+if len(argv) > 3:
+    file_suffix = argv[3]
 
 if log_path[-5:] != '.xlsx':
     log_path += '.xlsx'
@@ -49,7 +72,16 @@ save_dir_base = '../../../../validation_data/model-4.0_results/'
 date_dir = datetime.today().strftime('%Y.%m.%d')
 save_dir = save_dir_base + date_dir + file_suffix + '/'
 if not os.path.isdir(save_dir):
-    os.mkdir(save_dir)
+    os.makedirs(save_dir, exist_ok=True)
+
+# progress of the sweep, for -resume: the results folder, the results of the
+# radii already swept and the fits of the current radius
+run_checkpoint = checkpoint.Checkpoint(save_dir_base + 'checkpoints/radius_sweep-'
+    + os.path.basename(to_run_file)[:-4] + file_suffix + '.pkl',
+    dict(ver=ver, log=log_path, files=[f.strip() for f in to_run_list],
+        suffix=file_suffix, search=opts['global']), resume=opts['resume'])
+save_dir = run_checkpoint.state.setdefault('save_dir', save_dir)
+swept_radii = run_checkpoint.state.setdefault('radii', {})
 
 label_font = fm.FontProperties(family='Avenir', size=10)
 subtitle_font = fm.FontProperties(family='Avenir', size=12)
@@ -61,14 +93,6 @@ plt.rcParams.update({'font.family': 'Avenir', 'figure.titlesize': 16,
 
 file_lines = []
 
-def working_model(t, chi_p, r):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -83,23 +107,6 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
-    popt = (init_guess[0], init_guess[1])
-    try:
-        (popt, pcov) = curve_fit(working_model, time, conc, p0=init_guess, bounds=bounds)
-    except ValueError:
-        pass
-    except RuntimeError:
-        pass
-
-    model_y = working_model(time, *popt)
-
-    residuals = conc - model_y
-    ss_res = np.sum(residuals**2) # sum of square residuals
-    ss_total = np.sum((conc - np.mean(conc)) ** 2) # total sum of squares
-    MSE = 1 - ss_res / ss_total
-    return popt, MSE
-
 def fit_mag_field(window, b_r, l, w, t):
     def B_field(x, B_r, L, W, T):
        return (B_r/np.pi)*(np.arctan((L*W)/(2*x*np.sqrt(4*x**2+L**2+W**2)))-np.arctan((L*W)/(2*(x+T)*np.sqrt(4*(x+T)**2+L**2+W**2))))
@@ -117,28 +124,32 @@ def fit_mag_field(window, b_r, l, w, t):
     return linreg.slope, fit_str
 
 ### READ LOG FILE
+# the log, samples and magnets sheets are read in one pass over the workbook
+# (or from its snapshot, see map_fit/maplog.py)
 try:
-    log_df = pd.read_excel(path + log_path, sheet_name='log',
-        dtype={'Magnet': str})
-    print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
-except:
-    print('\nERROR: Invalid log file.')
-    sys.exit()
-
-try:
-    sample_df = pd.read_excel(path + log_path, sheet_name='samples')
-    print('Sample sheet loaded.')
-except:
-    print('ERROR: Could not load sample sheet.')
-    sys.exit()
-
-try:
-    mag_df = pd.read_excel(path + log_path, sheet_name='magnets',
-        dtype={'ID': str, 'Grade': float})
-    print('Magnets sheet loaded.')
-except:
-    print('ERROR: Could not load magnet sheet.')
+    log_sheets = maplog.read_log(path + log_path)
+except Exception as e:
+    print('\nERROR: Invalid log file: {}'.format(e))
     sys.exit()
+log_df = log_sheets['log']
+print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
+sample_df = log_sheets['samples']
+print('Sample sheet loaded.')
+mag_df = log_sheets['magnets']
+print('Magnets sheet loaded.')
+
+### CHECK THE LOG ENTRIES OF ALL FILES
+# every file is looked up in the log, samples and magnets sheets before
+# anything is fitted, so all bad entries are reported now and not when the
+# run reaches them
+log_index = maplog.LogIndex(log_sheets)
+runs, bad_runs = log_index.resolve(to_run_list)
+if bad_runs:
+    for key, error in bad_runs.items():
+        print('ERROR: {}: {}'.format(key, error))
+    if not opts['skipbad']:
+        sys.exit('ERROR: {} files with invalid log entries (skip them with -skipbad).'.format(len(bad_runs)))
+    to_run_list = [f for f in to_run_list if maplog.file_key(f) not in bad_runs]
 
 ### LOOP THROUGH ALL FILES
 num_files = len(to_run_list)
@@ -171,145 +182,33 @@ for f in to_run_list:
     else:
         file += '.txt'
 
-    try:
-        entry = log_df.loc[log_df['File'] == file_key].iloc[0]
-        print('Entry for {} successfully found.'.format(file_key))
-    except:
-        sys.exit('ERROR: Could not find file {} in log.'.format(file))
-
-    try:
-        dir = str(entry['Directory'])
-        if dir[-1] != '/':
-            dir += '/'
-        if 'paper_data/' in dir:
-            dir = dir.replace('paper_data/', '') # fix duplicate
-        print('Directory: ' + dir)
-    except:
-        sys.exit('ERROR: Invalid directory: {}.'.format(entry['Directory']))
-
-    sample = str(entry['Sample'])
-    magnet = str(entry['Magnet'])
-
-    try:
-        sample_entry = sample_df.loc[sample_df['ID'] == sample].iloc[0]
-        print('\nSample: ' + sample)
-    except:
-        print('ERROR: Could not find sample {} in sample log'.format(sample))
-        sys.exit()
-
-    try:
-        material = str(sample_entry['Material'])
-    except:
-        print('ERROR: Invalid sample material.')
-        sys.exit()
-
-    try:
-        rho_p = float(sample_entry['Density'])
-        print('Density: {} kg/m^3'.format(rho_p))
-    except ValueError:
-        print('ERROR: Invalid density - should be a numerical value with units kg/m^3')
-        sys.exit()
-
-    try:
-        solvent = sample_entry['Solvent']
-        if solvent.lower() == 'water':
-            solvent_type = 'Water'
-            eta = 8.9e-4
-            chi_s = -9.04e-6
-        elif solvent.lower() == 'dpbs':
-            solvent_type = 'DPBS'
-            eta = 0.89e-3
-            chi_s = -9.05e-6
-        else:
-            print('ERROR: Unknown solvent.')
-            sys.exit()
-        print('Solvent: ' + solvent_type)
-    except:
-        print('ERROR: Solvent could not be found.')
-        sys.exit()
-
-    try:
-        radius = float(sample_entry['Radius'])
-        print('Radius: {} m'.format(radius))
-        radius_std = float(sample_entry['Radius-std'])
-        print('Radius std dev: {} m'.format(radius_std))
-        optimize_radius = True
-        if radius == 0:
-            radius = 'Unknown'
-            print('Radius: unknown')
-            optimize_radius = False
-    except:
-        radius = 'Unknown'
-        print('Radius: unknown')
-        optimize_radius = False
-
-    try:
-        batch = str(sample_entry['Batch-date/Lot'])
-    except:
-        print('ERROR: Could not find Batch date/Lot')
-        sys.exit()
-
-    try:
-        c0 = float(sample_entry['Conc.\n[mg/mL]'])
-    except:
-        print('ERROR: Invalid initial concentration')
-        sys.exit()
+    # entries of the file, looked up and checked before the loop
+    run = runs[file_key]
+    print(run.describe())
+    dir = run.dir
+    sample = run.sample
+    magnet = run.magnet
+    material = run.material
+    rho_p = run.rho_p
+    solvent_type, eta, chi_s = run.solvent_type, run.eta, run.chi_s
+    radius = run.radius
+    radius_std = run.radius_std
+    optimize_radius = run.optimize_radius
+
+    batch = run.batch
+    c0 = run.c0
 
     # magnet parameters
-    try:
-        mag_entry = mag_df.loc[mag_df['ID'] == magnet].iloc[0]
-        print('\nMagnet: ' + magnet)
-    except:
-        print('ERROR: Could not find magnet {} in magnet log.'.format(magnet))
-        sys.exit()
-
-    try:
-        mag_name = str(mag_entry['K&J magnet'])
-        print('K&J Magnet: ' + str(mag_name))
-    except:
-        sys.exit('ERROR: Could not find name of magnet.')
-
-    try:
-        l_in = float(mag_entry['Length']) # inches
-        print('Length: {}"'.format(l_in))
-    except:
-        sys.exit('ERROR: Invalid length.')
-
-    try:
-        w_in = float(mag_entry['Width']) # inches
-        print('Width: {}"'.format(w_in))
-    except:
-        sys.exit('ERROR: Invalid width.')
-
-    try:
-        t_in = float(mag_entry['Height']) # inches
-        print('Thickness: {}"'.format(t_in))
-    except:
-        sys.exit('ERROR: Invalid height.')
-
-    try:
-        grade = int(mag_entry['Grade'])
-        print('Grade: N{:d}'.format(grade))
-    except:
-        sys.exit('ERROR: Invalid grade: {}.'.format(mag_entry['Grade']))
-
-    try:
-        dist = float(mag_entry['Distance']) # mm
-        window = [dist - 0.5, dist + 0.5]
-    except:
-        sys.exit('ERROR: Invalid distance.')
-
-    # magnet params
+    mag_name = run.mag_name
+    l_in, w_in, t_in = run.l_in, run.w_in, run.t_in # inches
+    grade = run.grade
+    dist = run.dist # mm
+    window = run.window
+
     l = l_in * in2m
     w = w_in * in2m
     t = t_in * in2m
-    if grade == 52:
-        b_r = 1.48
-    elif grade == 42:
-        b_r = 1.32
-    else:
-        print('Unknown magnet grade of {}'.format(grade))
-        sys.exit()
+    b_r = run.b_r
 
     a, fit_str = fit_mag_field(window, b_r, l, w, t)
     print('Fit magnetic field: a = {}'.format(a))
@@ -347,11 +246,17 @@ for f in to_run_list:
 
     ### IMPORT DATA
     file_path = path + dir + file
-    print('\nnow processing ' + str(file_path))
-
-    data = np.genfromtxt(file_path)
-    time = data[:, 0]
-    lux = data[:, 1]
+    if run_store is not None:
+        print('\nnow processing ' + file_key + ' from the run store ' + opts['store'])
+        if file_key not in run_store:
+            sys.exit('ERROR: {} is not in the run store {}.'.format(file_key, opts['store']))
+        # read-only views of the memory-mapped columns of the store
+        time, lux = run_store.columns(file_key)
+    else:
+        print('\nnow processing ' + str(file_path))
+        data = runfile.load(file_path)
+        time = data[:, 0]
+        lux = data[:, 1]
 
     print('successfully loaded: ' + str(file))
 
@@ -408,8 +313,11 @@ for f in to_run_list:
     num_r = 50
     r_sweep = np.linspace(100e-9, 1000e-9, num_r)
     r_results = np.zeros((num_r, 3))
-    r_counter = 0
-    for radius in r_sweep:
+    r_done = swept_radii.setdefault(file_key, {})
+    for r_counter, radius in enumerate(r_sweep):
+        if r_counter in r_done:
+            r_results[r_counter] = r_done[r_counter]
+            continue
         print('\nr {:d}/{:d}: {:0.4e}'.format(r_counter+1, num_r, r_sweep[r_counter]))
         ### INTIALIZE GUESSES & BOUNDS
         low_r_bound = radius*(0.9)
@@ -451,19 +359,25 @@ for f in to_run_list:
         best_dist_r_sq = -np.inf
         best_dist_result = [0, 0]
         c0 = conc_shifted[0]
+        model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
 
         print_list = []
 
         start_time = pytime.time()
-        for init_guess in tqdm(guesses):
-            # iterate over guesses
-            # popt, MSE = fit_data(time_shifted, conc_shifted, init_guess)
-
-            model = working_model
+        global_summary = None
+        if opts['global'] is not None:
+            box, log_scale = globalopt.search_box(guesses, bounds)
+            fits, global_summary = globalopt.global_fits(model, time_shifted,
+                conc_shifted, box, bounds, jac=model.jacobian, log_scale=log_scale,
+                method=opts['global'], n_grid=len(guesses))
+        else:
+            fits = run_checkpoint.fits((file_key, r_counter), lambda g: multistart.serial_fits(
+                model.single, time_shifted, conc_shifted, g, bounds,
+                jac=model.single_jacobian), guesses)
+        for init_guess, popt, pcov in fits:
+            # iterate over fitted guesses
             try:
-                (popt, pcov) = curve_fit(working_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
-
-                adj_model_y = working_model(time_shifted, *popt)
+                adj_model_y = model.single(time_shifted, *popt)
 
                 residuals = conc_shifted - adj_model_y
                 ss_res = np.sum(residuals**2) # sum of square residuals
@@ -517,6 +431,8 @@ for f in to_run_list:
         duration = end_time - start_time
 
         print('time to fit: ' + str(duration) + ' s')
+        if global_summary is not None:
+            print(global_summary)
 
         print("\nFINAL MODEL")
         print("file: " + str(file))
@@ -532,6 +448,9 @@ for f in to_run_list:
         r_results[r_counter][0] = radius
         r_results[r_counter][1] = best_MSE_result[0]
         r_results[r_counter][2] = best_MSE_result[1]
+        r_done[r_counter] = r_results[r_counter].copy()
+        run_checkpoint.state.pop('fits', None)
+        run_checkpoint.save(force=True)
 
     r_results_file = 'rsweep_results' + str(file_key) + '.txt'
     with open(r_results_file, 'w') as f:
@@ -539,11 +458,12 @@ for f in to_run_list:
         for l in range(len(r_results)):
             row = r_results[l]
             f.write('{:0.4e}\t{:0.4e}\t{:0.4e}'.format(row[0], row[1], row[2]))
+    run_checkpoint.remove()
     sys.exit()
-    best_MSE_y = working_model(time_shifted, *best_MSE_result)
+    best_MSE_y = model.single(time_shifted, *best_MSE_result)
 
     if optimize_radius:
-        best_dist_y = working_model(time_shifted, *best_dist_result)
+        best_dist_y = model.single(time_shifted, *best_dist_result)
 
     file_lines.append('\nFINAL RESULTS')
     file_lines.append('Opt. param.:\tinit_chi\tinit_radius\tchi\t\tradius\t\tMSE')
@@ -1,7 +0,0 @@
-
-from playsound import playsound
-
-i = 0
-while i < 3:
-    playsound('notify.aiff')
-    i += 1
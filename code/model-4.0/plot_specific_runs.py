@@ -13,6 +13,9 @@ import os
 import time as pytime
 import pandas as pd
 from qc_formats import *
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 n = 20
 def calibrate(lux, c0):
     # convert to transmission
@@ -53,7 +56,7 @@ def working_model(t, chi_p, r):
 for fkey in files:
     fig, axes = plt.subplots(1, 2, figsize=(6, 4))
     dfile = files[fkey]
-    data = np.genfromtxt(path + dfile['file_name'])
+    data = runfile.load(path + dfile['file_name'])
 
     time = data[:, 0]
     lux = data[:, 1]
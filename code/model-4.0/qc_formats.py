@@ -1,8 +1,13 @@
 # thesis formatting
 from matplotlib import font_manager as fm
-from numpy import average, log10, sum, mean, genfromtxt, min
+from numpy import average, log10, sum, mean, min
 from matplotlib import pyplot as plt
 from matplotlib.legend_handler import HandlerLine2D, HandlerTuple
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import runfile
 
 ### DIMENSIONS ###
 full_width = 6.25
@@ -141,7 +146,7 @@ def calculate_rsq(slope, int, xs, ys):
     return r_sq
 
 def calculate_resp_time(file_path):
-    data = genfromtxt(file_path)
+    data = runfile.load(file_path)
     time = data[:, 0]
     lux = data[:, 1]
 
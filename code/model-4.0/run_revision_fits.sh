@@ -1,148 +1,8 @@
 #!/bin/bash
 #
-# printf "MAP_log_revisions\ndm81_2w1\n" | python3 single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\ndm81_2w2\n" | python3 single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\ndm81_2w3\n" | python3 single_var_model_fits.py -infbounds
-#
-# printf "MAP_log_revisions\n826_01\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_02\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_03\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_04\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_05\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_06\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_07\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_08\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_09\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_10\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_11\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_12\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_13\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_14\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_15\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_16\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_17\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n826_18\n" | python single_var_model_fits.py -infbounds
-#
-# printf "MAP_log_revisions\n827_01\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_02\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_03\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_04\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_05\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_06\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_07\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_08\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_09\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_10\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_11\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_12\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_13\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_14\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_15\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_16\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_17\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n827_18\n" | python single_var_model_fits.py -infbounds
-#
-# printf "MAP_log_revisions\n828_01\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_02\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_03\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_04\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_05\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_06\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_07\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_08\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_09\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_10\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_11\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_12\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_13\n" | python single_var_model_fits.py -infbounds
-# # printf "MAP_log_revisions\n828_14\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_15\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_16\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_17\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_18\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_19\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n828_20\n" | python single_var_model_fits.py -infbounds
-#
-# printf "MAP_log_revisions\n829_01\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_02\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_03\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_04\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_05\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_06\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_07\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_08\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_09\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_10\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_11\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_12\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_13\n" | python single_var_model_fits.py -infbounds
-# # printf "MAP_log_revisions\n829_14\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_15\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_16\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_17\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_18\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_19\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_20\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_21\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_22\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_23\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_24\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_25\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_26\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_27\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_28\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_29\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_30\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_31\n" | python single_var_model_fits.py -infbounds
-# printf "MAP_log_revisions\n829_32\n" | python single_var_model_fits.py -infbounds
-
-printf "MAP_log_revisions\n902_1\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n902_2\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n902_3\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n902_4\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n903_1\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n903_2\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n903_3\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n903_4\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n908_01a\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n908_02a\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n908_03a\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_01\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_02\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_03\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_04\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_05\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_06\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_07\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_08\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_09\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n909_10\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_02\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_03\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_04\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_05\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_06\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n910_07\n" | python single_var_model_fits.py -guessnum 10000
-
-printf "MAP_log_revisions\n424feo01\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo02\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo03\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo04\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo05\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo06\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo07\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo08\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo09\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n424feo10\n" | python single_var_model_fits.py -guessnum 10000
-
-printf "MAP_log_revisions\n912_01\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n912_02\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n912_03\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n912_04\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n912_05\n" | python single_var_model_fits.py -guessnum 10000
-printf "MAP_log_revisions\n912_06\n" | python single_var_model_fits.py -guessnum 10000
-
+# Fits the revision data files listed in revision_fits.txt (files commented
+# out there were fitted in earlier rounds) with single_var_model_fits.py.
+# All files are fitted in one batch, which loads the log once and prints a
+# summary of every file when it finishes (see ../map_fit/batch.py).
 
-python3 play_sound.py
-echo ""
-echo "finished analysis."
+PYTHONPATH="$(dirname "$0")/.." python -m map_fit batch MAP_log_revisions revision_fits.txt -workers 4 -- -guessnum 10000
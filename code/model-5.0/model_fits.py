@@ -13,22 +13,76 @@ import time as pytime
 import pandas as pd
 import warnings
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import checkpoint, fitcache, flags, globalopt, maplog, models, multistart, runfile, runstore
+from map_fit.batch import task_state
+
 ver = 2.2 # updated to include data truncation
 to_save = True
 
 file_suffix = ''
 
+# optional flags:
+#   -serial   fit one guess at a time with curve_fit instead of the batched engine
+#   -checkjac compare the analytic Jacobian against finite differences before fitting
+#   -workers N  split the guesses over N processes (default 1)
+#   -screen K   rank the guess grid by SSE and only fit from the selected guesses
+#   -screenrule topk|minima|both  which guesses -screen keeps (default both):
+#               the K lowest SSE guesses, the local minima of the SSE grid, or both
+#   -patience N stop after N consecutive fits without a new best MSE
+#   -confidence Q  stop once P(best MSE is the global minimum) >= Q, e.g. 0.99
+#               (with either rule the guesses are fitted in a shuffled order)
+#   -decimate F fit every guess to the series averaged over bins of F points
+#               (weighted by bin size) and refit only the best -keep distinct
+#               coarse optima on the full series
+#   -keep K     coarse optima refitted with -decimate (default 20)
+#   -warm       start each file from a small grid around the last fit of the same
+#               (sample, magnet, concentration) group, fitting the full grid
+#               only if that fit's r_sq is more than -warmtol below the last one
+#   -warmtol X  allowed r_sq drop for a warm start (default 0.01)
+#   -nocache    always refit instead of reusing cached fits of unchanged files
+#   -cachesize MB  size limit of the fit cache (default 1024)
+#   -resume     continue an interrupted run of the same list file and options
+#               from its checkpoint (not with -decimate)
+#   -global de  search the box of the guess grid with differential evolution
+#               instead of fitting from every guess (see map_fit/globalopt.py)
+# the fit cache is kept in <results dir>/fit_cache/; clear it with
+# >>> python ../map_fit/fitcache.py <cache dir> invalidate [file ...]
+# checkpoints are kept in <results dir>/checkpoints/ and removed when a run finishes
+#   -store file read the runs from a run store instead of the data folders
+#               (see map_fit/runstore.py)
+#   -skipbad    skip the files with invalid log entries and fit the others
+#               (by default an invalid entry stops the run before any fit)
+argv, opts = flags.pop_flags(sys.argv, {'serial': False, 'checkjac': False, 'workers': 1,
+    'screen': 0, 'screenrule': 'both', 'patience': 0, 'confidence': 0.0,
+    'decimate': 0, 'keep': 20, 'warm': False, 'warmtol': 0.01, 'nocache': False, 'cachesize': 1024,
+    'resume': False, 'global': None, 'store': None, 'skipbad': False})
+engine = 'serial' if opts['serial'] else 'batched'
+if opts['screenrule'] not in ['topk', 'minima', 'both']:
+    sys.exit('ERROR: -screenrule must be topk, minima or both')
+if opts['global'] is not None and opts['global'] not in globalopt.METHODS:
+    sys.exit('ERROR: -global must be one of ' + ', '.join(globalopt.METHODS))
+if opts['resume'] and opts['decimate'] > 1:
+    # the decimated fits are not saved to the checkpoint, so nothing could be resumed
+    sys.exit('ERROR: -resume does not work with -decimate')
+
 # load files to run from script
-if len(sys.argv) < 3:
-    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file>')
-log_path = sys.argv[1]
-to_run_file = sys.argv[2]
+if len(argv) < 3:
+    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file> [-serial] [-checkjac] [-workers N] [-screen K [-screenrule rule]] [-patience N] [-confidence Q] [-decimate F [-keep K]] [-warm [-warmtol X]] [-nocache] [-cachesize MB] [-resume] [-global de] [-store file] [-skipbad]')
+run_store = None
+if opts['store'] is not None:
+    if not os.path.isfile(opts['store']):
+        sys.exit('ERROR: no run store at ' + opts['store'])
+    run_store = runstore.open_store(opts['store'])
+log_path = argv[1]
+to_run_file = argv[2]
 print('log input: ' + log_path)
 print('list file: ' + to_run_file)
+print('fit engine: {} ({} workers)'.format(engine, opts['workers']))
 
 # option to add suffix to file names to allow for duplicate runs
-if len(sys.argv) > 3:
-    file_suffix = sys.argv[3]
+if len(argv) > 3:
+    file_suffix = argv[3]
 
 if log_path[-5:] != '.xlsx':
     log_path += '.xlsx'
@@ -49,7 +103,34 @@ save_dir_base = '../../../../validation_data/model-4.0_results/'
 date_dir = datetime.today().strftime('%Y.%m.%d')
 save_dir = save_dir_base + date_dir + file_suffix + '/'
 if not os.path.isdir(save_dir):
-    os.mkdir(save_dir)
+    os.makedirs(save_dir, exist_ok=True)
+
+if opts['nocache']:
+    fit_cache = None
+else:
+    fit_cache = fitcache.FitCache(save_dir_base + 'fit_cache/',
+        max_bytes=opts['cachesize'] * 1024**2)
+# part of every fit key, so cached fits are redone after a change to the fitting code
+fit_code_version = fitcache.code_version()
+
+# progress of the run, for -resume: the results folder, the files already
+# fitted, the warm starts and the fits of the current file
+run_checkpoint = checkpoint.Checkpoint(save_dir_base + 'checkpoints/model_fits-'
+    + os.path.basename(to_run_file)[:-4] + file_suffix + '.pkl',
+    dict(ver=ver, log=log_path, files=[f.strip() for f in to_run_list],
+        suffix=file_suffix, opts={k: v for k, v in opts.items()
+            if k not in ['workers', 'nocache', 'cachesize', 'resume']}),
+    resume=opts['resume'])
+save_dir = run_checkpoint.state.setdefault('save_dir', save_dir)
+done_files = run_checkpoint.state.setdefault('done', [])
+
+# last fit of each (sample, magnet, concentration) group, for -warm; the batch
+# runner fits each file as a run of its own, so there they are kept by the
+# runner across the files of the batch
+if task_state() is not None:
+    warm_starts = task_state().setdefault('warm_starts', {})
+else:
+    warm_starts = run_checkpoint.state.setdefault('warm_starts', {})
 
 label_font = fm.FontProperties(family='Avenir', size=10)
 subtitle_font = fm.FontProperties(family='Avenir', size=12)
@@ -61,14 +142,6 @@ plt.rcParams.update({'font.family': 'Avenir', 'figure.titlesize': 16,
 
 file_lines = []
 
-def working_model(t, chi_p, r):
-    alpha = (9 * eta) / (2 * rho_p * r**2)
-    beta = (2 * a**2 * chi_p) / (rho_p * mu0 * (1 + chi_s))
-    delta1 = 0.5 * (-alpha + np.sqrt(alpha**2 - 4 * beta))
-    delta2 = 0.5 * (-alpha - np.sqrt(alpha**2 - 4 * beta))
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -83,23 +156,6 @@ def calibrate(lux, c0):
     # convert attenuation to concentration
     return c0 / (att0 - attf) * att + attf * c0 / (attf - att0)
 
-def fit_data(time, conc, init_guess):
-    popt = (init_guess[0], init_guess[1])
-    try:
-        (popt, pcov) = curve_fit(working_model, time, conc, p0=init_guess, bounds=bounds)
-    except ValueError:
-        pass
-    except RuntimeError:
-        pass
-
-    model_y = working_model(time, *popt)
-
-    residuals = conc - model_y
-    ss_res = np.sum(residuals**2) # sum of square residuals
-    ss_total = np.sum((conc - np.mean(conc)) ** 2) # total sum of squares
-    MSE = 1 - ss_res / ss_total
-    return popt, MSE
-
 def fit_mag_field(window, b_r, l, w, t):
     def B_field(x, B_r, L, W, T):
        return (B_r/np.pi)*(np.arctan((L*W)/(2*x*np.sqrt(4*x**2+L**2+W**2)))-np.arctan((L*W)/(2*(x+T)*np.sqrt(4*(x+T)**2+L**2+W**2))))
@@ -117,28 +173,34 @@ def fit_mag_field(window, b_r, l, w, t):
     return linreg.slope, fit_str
 
 ### READ LOG FILE
+# the log, samples and magnets sheets are read in one pass over the workbook
+# (or from its snapshot, see map_fit/maplog.py)
 try:
-    log_df = pd.read_excel(path + log_path, sheet_name='log',
-        dtype={'Magnet': str})
-    print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
-except:
-    print('\nERROR: Invalid log file.')
-    sys.exit()
-
-try:
-    sample_df = pd.read_excel(path + log_path, sheet_name='samples')
-    print('Sample sheet loaded.')
-except:
-    print('ERROR: Could not load sample sheet.')
-    sys.exit()
-
-try:
-    mag_df = pd.read_excel(path + log_path, sheet_name='magnets',
-        dtype={'ID': str, 'Grade': float})
-    print('Magnets sheet loaded.')
-except:
-    print('ERROR: Could not load magnet sheet.')
+    log_sheets = maplog.read_log(path + log_path)
+except Exception as e:
+    print('\nERROR: Invalid log file: {}'.format(e))
     sys.exit()
+log_df = log_sheets['log']
+print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
+sample_df = log_sheets['samples']
+print('Sample sheet loaded.')
+mag_df = log_sheets['magnets']
+print('Magnets sheet loaded.')
+
+### CHECK THE LOG ENTRIES OF ALL FILES
+# every file is looked up in the log, samples and magnets sheets before
+# anything is fitted, so all bad entries are reported now and not when the
+# run reaches them
+log_index = maplog.LogIndex(log_sheets)
+# the radius bounds of the fits come from the radius and its std dev
+runs, bad_runs = log_index.resolve(to_run_list, require_radius=True,
+    require_radius_std=True)
+if bad_runs:
+    for key, error in bad_runs.items():
+        print('ERROR: {}: {}'.format(key, error))
+    if not opts['skipbad']:
+        sys.exit('ERROR: {} files with invalid log entries (skip them with -skipbad).'.format(len(bad_runs)))
+    to_run_list = [f for f in to_run_list if maplog.file_key(f) not in bad_runs]
 
 ### LOOP THROUGH ALL FILES
 num_files = len(to_run_list)
@@ -171,145 +233,37 @@ for f in to_run_list:
     else:
         file += '.txt'
 
-    try:
-        entry = log_df.loc[log_df['File'] == file_key].iloc[0]
-        print('Entry for {} successfully found.'.format(file_key))
-    except:
-        sys.exit('ERROR: Could not find file {} in log.'.format(file))
-
-    try:
-        dir = str(entry['Directory'])
-        if dir[-1] != '/':
-            dir += '/'
-        if 'paper_data/' in dir:
-            dir = dir.replace('paper_data/', '') # fix duplicate
-        print('Directory: ' + dir)
-    except:
-        sys.exit('ERROR: Invalid directory: {}.'.format(entry['Directory']))
-
-    sample = str(entry['Sample'])
-    magnet = str(entry['Magnet'])
-
-    try:
-        sample_entry = sample_df.loc[sample_df['ID'] == sample].iloc[0]
-        print('\nSample: ' + sample)
-    except:
-        print('ERROR: Could not find sample {} in sample log'.format(sample))
-        sys.exit()
-
-    try:
-        material = str(sample_entry['Material'])
-    except:
-        print('ERROR: Invalid sample material.')
-        sys.exit()
-
-    try:
-        rho_p = float(sample_entry['Density'])
-        print('Density: {} kg/m^3'.format(rho_p))
-    except ValueError:
-        print('ERROR: Invalid density - should be a numerical value with units kg/m^3')
-        sys.exit()
-
-    try:
-        solvent = sample_entry['Solvent']
-        if solvent.lower() == 'water':
-            solvent_type = 'Water'
-            eta = 8.9e-4
-            chi_s = -9.04e-6
-        elif solvent.lower() == 'dpbs':
-            solvent_type = 'DPBS'
-            eta = 0.89e-3
-            chi_s = -9.05e-6
-        else:
-            print('ERROR: Unknown solvent.')
-            sys.exit()
-        print('Solvent: ' + solvent_type)
-    except:
-        print('ERROR: Solvent could not be found.')
-        sys.exit()
-
-    try:
-        radius = float(sample_entry['Radius'])
-        print('Radius: {} m'.format(radius))
-        radius_std = float(sample_entry['Radius-std'])
-        print('Radius std dev: {} m'.format(radius_std))
-        optimize_radius = True
-        if radius == 0:
-            radius = 'Unknown'
-            print('Radius: unknown')
-            optimize_radius = False
-    except:
-        radius = 'Unknown'
-        print('Radius: unknown')
-        optimize_radius = False
-
-    try:
-        batch = str(sample_entry['Batch-date/Lot'])
-    except:
-        print('ERROR: Could not find Batch date/Lot')
-        sys.exit()
-
-    try:
-        c0 = float(sample_entry['Conc.\n[mg/mL]'])
-    except:
-        print('ERROR: Invalid initial concentration')
-        sys.exit()
+    if file_key in done_files:
+        print('{} already fitted in the resumed run, skipping.'.format(file))
+        continue
+
+    # entries of the file, looked up and checked before the loop
+    run = runs[file_key]
+    print(run.describe())
+    dir = run.dir
+    sample = run.sample
+    magnet = run.magnet
+    material = run.material
+    rho_p = run.rho_p
+    solvent_type, eta, chi_s = run.solvent_type, run.eta, run.chi_s
+    radius = run.radius
+    radius_std = run.radius_std
+    optimize_radius = run.optimize_radius
+
+    batch = run.batch
+    c0 = run.c0
 
     # magnet parameters
-    try:
-        mag_entry = mag_df.loc[mag_df['ID'] == magnet].iloc[0]
-        print('\nMagnet: ' + magnet)
-    except:
-        print('ERROR: Could not find magnet {} in magnet log.'.format(magnet))
-        sys.exit()
-
-    try:
-        mag_name = str(mag_entry['K&J magnet'])
-        print('K&J Magnet: ' + str(mag_name))
-    except:
-        sys.exit('ERROR: Could not find name of magnet.')
-
-    try:
-        l_in = float(mag_entry['Length']) # inches
-        print('Length: {}"'.format(l_in))
-    except:
-        sys.exit('ERROR: Invalid length.')
-
-    try:
-        w_in = float(mag_entry['Width']) # inches
-        print('Width: {}"'.format(w_in))
-    except:
-        sys.exit('ERROR: Invalid width.')
-
-    try:
-        t_in = float(mag_entry['Height']) # inches
-        print('Thickness: {}"'.format(t_in))
-    except:
-        sys.exit('ERROR: Invalid height.')
-
-    try:
-        grade = int(mag_entry['Grade'])
-        print('Grade: N{:d}'.format(grade))
-    except:
-        sys.exit('ERROR: Invalid grade: {}.'.format(mag_entry['Grade']))
-
-    try:
-        dist = float(mag_entry['Distance']) # mm
-        window = [dist - 0.5, dist + 0.5]
-    except:
-        sys.exit('ERROR: Invalid distance.')
-
-    # magnet params
+    mag_name = run.mag_name
+    l_in, w_in, t_in = run.l_in, run.w_in, run.t_in # inches
+    grade = run.grade
+    dist = run.dist # mm
+    window = run.window
+
     l = l_in * in2m
     w = w_in * in2m
     t = t_in * in2m
-    if grade == 52:
-        b_r = 1.48
-    elif grade == 42:
-        b_r = 1.32
-    else:
-        print('Unknown magnet grade of {}'.format(grade))
-        sys.exit()
+    b_r = run.b_r
 
     a, fit_str = fit_mag_field(window, b_r, l, w, t)
     print('Fit magnetic field: a = {}'.format(a))
@@ -347,11 +301,17 @@ for f in to_run_list:
 
     ### IMPORT DATA
     file_path = path + dir + file
-    print('\nnow processing ' + str(file_path))
-
-    data = np.genfromtxt(file_path)
-    time = data[:, 0]
-    lux = data[:, 1]
+    if run_store is not None:
+        print('\nnow processing ' + file_key + ' from the run store ' + opts['store'])
+        if file_key not in run_store:
+            sys.exit('ERROR: {} is not in the run store {}.'.format(file_key, opts['store']))
+        # read-only views of the memory-mapped columns of the store
+        time, lux = run_store.columns(file_key)
+    else:
+        print('\nnow processing ' + str(file_path))
+        data = runfile.load(file_path)
+        time = data[:, 0]
+        lux = data[:, 1]
 
     print('successfully loaded: ' + str(file))
 
@@ -433,6 +393,25 @@ for f in to_run_list:
     # file_lines.append('\tRadius: ' + str(rs))
 
 
+    group = (sample, magnet, c0)
+    warm = warm_starts.get(group) if opts['warm'] else None
+
+    # everything that determines the fits, for the fit cache
+    # (the data as read, so a run gives the same key from a file or the store,
+    # and the map_fit fitting code, so a solver change refits)
+    cache_key = fitcache.fit_key(fit_code_version, [time, lux],
+        dict(material=material, rho_p=rho_p, radius=radius,
+            radius_std=radius_std, batch=batch, c0=c0, eta=eta, chi_s=chi_s,
+            magnet=mag_name, size=[l_in, w_in, t_in], grade=grade,
+            dist=dist, a=a),
+        dict(n=n, min_n=min_n, window_size=window_size, poly_order=poly_order,
+            threshold=threshold, consec_vals=consec_vals),
+        dict(model='working_model', ver=ver, chis=chis, rs=rs, bounds=bounds,
+            engine=engine, screen=opts['screen'], screenrule=opts['screenrule'],
+            patience=opts['patience'], confidence=opts['confidence'],
+            decimate=opts['decimate'], keep=opts['keep'], search=opts['global'],
+            warm=None if warm is None else [warm['popt'], warm['r_sq'], opts['warmtol']]))
+
     ### FIT OPTIMIZATION --- UPDATED TO MEAN SQUARE ERROR (BUT MSE LABELS ARE UNCHANGED FOR NOW)
     # fit the shifted data
     best_MSE_guess = guesses[0]
@@ -448,16 +427,95 @@ for f in to_run_list:
 
     print_list = []
 
-    start_time = pytime.time()
-    for init_guess in tqdm(guesses):
-        # iterate over guesses
-        # popt, MSE = fit_data(time_shifted, conc_shifted, init_guess)
+    batch_model = models.WorkingModel(eta, rho_p, a, chi_s, c0, mu0)
+    batch_jac = batch_model.jacobian
+    steps_str = models.describe_time_steps(time_shifted)
+    print(steps_str)
+    file_lines.append(steps_str)
+    if opts['checkjac']:
+        jac_errors = models.check_jacobian(batch_model, batch_jac, time_shifted,
+            guesses[::max(1, len(guesses) // 100)])
+        jac_check = models.format_jacobian_check(['chi_p', 'r'], jac_errors)
+        print(jac_check)
+        file_lines.append(jac_check)
 
-        model = working_model
+    start_time = pytime.time()
+    cached = None if fit_cache is None else fit_cache.load(cache_key)
+    if cached is not None:
+        screen_summary, fits, stop_summary, warm_summary = cached
+        stopper = None
+        print('Fits loaded from cache ({}).'.format(cache_key[:12]))
+        file_lines.append('Fits loaded from cache ({}).'.format(cache_key[:12]))
+    else:
+        screen_summary = None
+        stop_summary = None
+        warm_summary = None
+        stopper = None
+        fits = None
+        if warm is not None:
+            # fit a small grid around the last fit of this group first
+            warm_guesses, _ = multistart.local_guesses(warm['popt'], bounds,
+                [0.5, 0.05], [11, 5])
+            warm_fits = list(multistart.parallel_fits(batch_model, time_shifted,
+                conc_shifted, warm_guesses, bounds, jac=batch_jac,
+                workers=opts['workers'], engine=engine))
+            ss_total = np.sum((conc_shifted - np.mean(conc_shifted)) ** 2)
+            warm_r_sq = max([1 - np.sum((batch_model(time_shifted, [popt])[0]
+                - conc_shifted)**2) / ss_total for _, popt, _ in warm_fits] + [-np.inf])
+            warm_summary = ('Warm start from {} (chi {:0.4e}, r {:0.4e}, r_sq {:0.6f}): '
+                '{} local guesses, best r_sq {:0.6f}').format(warm['file'],
+                warm['popt'][0], warm['popt'][1], warm['r_sq'], len(warm_guesses),
+                warm_r_sq)
+            if warm_r_sq >= warm['r_sq'] - opts['warmtol']:
+                guesses = warm_guesses
+                fits = warm_fits
+            else:
+                warm_summary += ' -> more than {} below, fitting the full grid'.format(
+                    opts['warmtol'])
+
+        if fits is None and opts['global'] is not None:
+            box, log_scale = globalopt.search_box(guesses, bounds)
+            fits, screen_summary = globalopt.global_fits(batch_model, time_shifted,
+                conc_shifted, box, bounds, jac=batch_jac, log_scale=log_scale,
+                method=opts['global'], n_grid=len(guesses))
+        elif fits is None:
+            if opts['screen'] > 0:
+                guesses, screen_summary = multistart.screen_guesses(batch_model,
+                    time_shifted, conc_shifted, guesses,
+                    grid_shape=(num_chi_guesses, num_r_guesses),
+                    top_k=opts['screen'], rule=opts['screenrule'])
+
+            if opts['patience'] > 0 or opts['confidence'] > 0:
+                # the stopping rules assume the starts come in random order
+                stopper = multistart.EarlyStop(patience=opts['patience'],
+                    confidence=opts['confidence'])
+                guesses = multistart.shuffled(guesses)
+
+            # the batched model and Jacobian give the same fits for any number of workers
+            if opts['decimate'] > 1:
+                fits, decimate_summary = multistart.decimated_fits(batch_model,
+                    time_shifted, conc_shifted, guesses, bounds, jac=batch_jac,
+                    factor=opts['decimate'], keep=opts['keep'],
+                    workers=opts['workers'], engine=engine)
+                screen_summary = '\n'.join(s for s in [screen_summary, decimate_summary]
+                    if s is not None)
+            else:
+                fits = run_checkpoint.fits(cache_key, lambda g: multistart.parallel_fits(
+                    batch_model, time_shifted, conc_shifted, g, bounds, jac=batch_jac,
+                    workers=opts['workers'], engine=engine), guesses)
+            if stopper is not None:
+                fits = stopper.watch(fits, batch_model, time_shifted, conc_shifted)
+            if fit_cache is not None:
+                fits = list(fits)
+    for summary in [warm_summary, screen_summary]:
+        if summary is not None:
+            print(summary)
+            file_lines.append(summary)
+
+    for init_guess, popt, pcov in fits:
+        # iterate over fitted guesses
         try:
-            (popt, pcov) = curve_fit(working_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
-
-            adj_model_y = working_model(time_shifted, *popt)
+            adj_model_y = batch_model(time_shifted, [popt])[0]
 
             residuals = conc_shifted - adj_model_y
             ss_res = np.sum(residuals**2) # sum of square residuals
@@ -507,8 +565,15 @@ for f in to_run_list:
         except ZeroDivisionError:
             pass
 
+    if stopper is not None:
+        stop_summary = stopper.summary(len(guesses))
+    if cached is None and fit_cache is not None:
+        fit_cache.store(cache_key, (screen_summary, fits, stop_summary,
+            warm_summary), label=file)
     end_time = pytime.time()
     duration = end_time - start_time
+    if stop_summary is not None:
+        print(stop_summary)
 
     print('time to fit: ' + str(duration) + ' s')
 
@@ -523,10 +588,13 @@ for f in to_run_list:
             chi_guess=best_dist_guess[0], r_guess=best_dist_guess[1], chi=best_dist_result[0],
             r=best_dist_result[1], MSE=best_dist_MSE, r_sq=best_dist_r_sq))
 
-    best_MSE_y = working_model(time_shifted, *best_MSE_result)
+    best_MSE_y = batch_model(time_shifted, [best_MSE_result])[0]
+    if np.isfinite(best_MSE):
+        warm_starts[group] = dict(popt=list(best_MSE_result), r_sq=best_MSE_r_sq,
+            file=file)
 
     if optimize_radius:
-        best_dist_y = working_model(time_shifted, *best_dist_result)
+        best_dist_y = batch_model(time_shifted, [best_dist_result])[0]
 
     file_lines.append('\nFINAL RESULTS')
     file_lines.append('Opt. param.:\tinit_chi\tinit_radius\tchi\t\tradius\t\tMSE')
@@ -540,7 +608,10 @@ for f in to_run_list:
 
     ## update files
     file_lines.append('\n--- Full Results ---')
+    file_lines.append('Fit engine: {} ({} workers)'.format(engine, opts['workers']))
     file_lines.append('Time to fit: ' + str(duration) + ' s')
+    if stop_summary is not None:
+        file_lines.append(stop_summary)
     file_lines.append('^new best by MSE')
     if optimize_radius:
         file_lines.append('*new best by radius\n')
@@ -633,3 +704,8 @@ for f in to_run_list:
     else:
         plt.show()
         plt.close()
+
+    done_files.append(file_key)
+    run_checkpoint.save(force=True)
+
+run_checkpoint.remove()
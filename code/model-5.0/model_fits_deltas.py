@@ -40,6 +40,9 @@ import time as pytime
 import pandas as pd
 import warnings
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_fit import flags, globalopt, maplog, models, multistart, runfile, runstore
+
 ver = 1.0 # updated to read analysis files from txt file.
 # to do: implement flags allowing usage: single_var_model_fits.py -single <log_file> <data file name>
 # to do: also implement flag allowing radius + some std dev and radius - std dev
@@ -72,10 +75,40 @@ for d1 in d1_guesses:
 bounds = ([-np.inf, -np.inf], [0, 0])
 
 # LOAD COMMAND LINE ARGUMENTS
-if len(sys.argv) < 3:
-    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file>')
-log_path = sys.argv[1]
-to_run_file = sys.argv[2]
+# optional flags:
+#   -checkjac compare the analytic Jacobian against finite differences before fitting
+#   -workers N  split the guesses over N processes (default 1)
+#   -basins     skip guesses that head into the basin of an earlier fit
+#               (single process)
+#   -basintol X relative tolerance for matching a basin (default 0.05)
+#   -probe N    model evaluations per guess before checking the basins (default 5)
+#   -patience N stop after N consecutive fits without a new best MSE
+#   -confidence Q  stop once P(best MSE is the global minimum) >= Q, e.g. 0.99
+#               (with either rule the guesses are fitted in a shuffled order)
+#   -global de  search the box of the guess grid with differential evolution
+#               instead of fitting from every guess (see map_fit/globalopt.py)
+#   -store file read the runs from a run store instead of the data folders
+#               (see map_fit/runstore.py)
+#   -skipbad    skip the files with invalid log entries and fit the others
+#               (by default an invalid entry stops the run before any fit)
+argv, opts = flags.pop_flags(sys.argv, {'checkjac': False, 'workers': 1,
+    'basins': False, 'basintol': 0.05, 'probe': 5,
+    'patience': 0, 'confidence': 0.0, 'global': None, 'store': None, 'skipbad': False})
+
+if len(argv) < 3:
+    sys.exit('ERROR: too few arguments.\nExpected usage:\n>>> python model_fits.py <log_file> <list file> [-checkjac] [-workers N] [-patience N] [-confidence Q] [-basins] [-basintol X] [-probe N] [-global de] [-store file] [-skipbad]')
+run_store = None
+if opts['store'] is not None:
+    if not os.path.isfile(opts['store']):
+        sys.exit('ERROR: no run store at ' + opts['store'])
+    run_store = runstore.open_store(opts['store'])
+if opts['global'] is not None and opts['global'] not in globalopt.METHODS:
+    sys.exit('ERROR: -global must be one of ' + ', '.join(globalopt.METHODS))
+if opts['patience'] > 0 or opts['confidence'] > 0:
+    # the stopping rules assume the starts come in random order
+    guesses = multistart.shuffled(guesses)
+log_path = argv[1]
+to_run_file = argv[2]
 print('log input: ' + log_path)
 print('list file: ' + to_run_file)
 
@@ -97,8 +130,8 @@ vib_grey = '#bbbbbb'
 black = '#000000'
 
 # option to add suffix to file names to allow for duplicate runs
-if len(sys.argv) > 3:
-    file_suffix = sys.argv[3]
+if len(argv) > 3:
+    file_suffix = argv[3]
 
 # adjust file names if necessary
 if log_path[-5:] != '.xlsx':
@@ -121,7 +154,7 @@ save_dir_base = '../../../../validation_data/model-5.0_results/'
 date_dir = datetime.today().strftime('%Y.%m.%d')
 save_dir = save_dir_base + date_dir + file_suffix + '/'
 if not os.path.isdir(save_dir):
-    os.mkdir(save_dir)
+    os.makedirs(save_dir, exist_ok=True)
 
 label_font = fm.FontProperties(family='Avenir', size=10)
 subtitle_font = fm.FontProperties(family='Avenir', size=12)
@@ -133,10 +166,6 @@ plt.rcParams.update({'font.family': 'Avenir', 'figure.titlesize': 16,
 
 file_lines = []
 
-def deltas_model(t, delta1, delta2):
-    k = delta2 * c0 / (delta2 - delta1)
-    return k * np.exp(delta1 * t) + (c0 - k) * np.exp(delta2 * t)
-
 def calibrate(lux, c0):
     # convert to transmission
     e_0 = np.average(lux[-n:]) # "water" value
@@ -167,28 +196,30 @@ def fit_mag_field(window, b_r, l, w, t):
     return linreg.slope, fit_str
 
 ### READ TEST PARAMETERS
-try: # read excel file
-    log_df = pd.read_excel(path + log_path, sheet_name='log',
-        dtype={'Magnet': str})
-    print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
-except:
-    print('\nERROR: Invalid log file.')
-    sys.exit()
-
-try: # read sample sheet
-    sample_df = pd.read_excel(path + log_path, sheet_name='samples')
-    print('Sample sheet loaded.')
-except:
-    print('ERROR: Could not load sample sheet.')
-    sys.exit()
-
-try: # read magnets sheet
-    mag_df = pd.read_excel(path + log_path, sheet_name='magnets',
-        dtype={'ID': str, 'Grade': float})
-    print('Magnets sheet loaded.')
-except:
-    print('ERROR: Could not load magnet sheet.')
+try: # read the log, samples and magnets sheets in one pass over the workbook
+    log_sheets = maplog.read_log(path + log_path)
+except Exception as e:
+    print('\nERROR: Invalid log file: {}'.format(e))
     sys.exit()
+log_df = log_sheets['log']
+print('\nLog file {:s} loaded.'.format(log_path.split('/')[-1]))
+sample_df = log_sheets['samples']
+print('Sample sheet loaded.')
+mag_df = log_sheets['magnets']
+print('Magnets sheet loaded.')
+
+### CHECK THE LOG ENTRIES OF ALL FILES
+# every file is looked up in the log, samples and magnets sheets before
+# anything is fitted, so all bad entries are reported now and not when the
+# run reaches them
+log_index = maplog.LogIndex(log_sheets)
+runs, bad_runs = log_index.resolve(to_run_list, require_radius=True)
+if bad_runs:
+    for key, error in bad_runs.items():
+        print('ERROR: {}: {}'.format(key, error))
+    if not opts['skipbad']:
+        sys.exit('ERROR: {} files with invalid log entries (skip them with -skipbad).'.format(len(bad_runs)))
+    to_run_list = [f for f in to_run_list if maplog.file_key(f) not in bad_runs]
 
 ### LOOP THROUGH ALL FILES
 for f in to_run_list:
@@ -212,146 +243,35 @@ for f in to_run_list:
     else:
         file += '.txt'
 
-    try: # find file name
-        entry = log_df.loc[log_df['File'] == file_key].iloc[0]
-        print('Entry for {} successfully found.'.format(file_key))
-    except:
-        sys.exit('ERROR: Could not find file {} in log.'.format(file))
-
-    try: # find directory name
-        dir = str(entry['Directory'])
-        if dir[-1] != '/':
-            dir += '/'
-        if 'paper_data/' in dir:
-            dir = dir.replace('paper_data/', '') # fix duplicate
-        print('Directory: ' + dir)
-    except:
-        sys.exit('ERROR: Invalid directory: {}.'.format(entry['Directory']))
-
-    sample = str(entry['Sample'])
-    magnet = str(entry['Magnet'])
-
-    try: # find sample ID
-        sample_entry = sample_df.loc[sample_df['ID'] == sample].iloc[0]
-        print('\nSample: ' + sample)
-    except:
-        print('ERROR: Could not find sample {} in sample log'.format(sample))
-        sys.exit()
-
-    try: # find material
-        material = str(sample_entry['Material'])
-    except:
-        print('ERROR: Invalid sample material.')
-        sys.exit()
-
-    try: # find density
-        rho_p = float(sample_entry['Density'])
-        print('Density: {} kg/m^3'.format(rho_p))
-    except ValueError:
-        print('ERROR: Invalid density - should be a numerical value with units kg/m^3')
-        sys.exit()
-
-    try: # find solvent
-        solvent = sample_entry['Solvent']
-        if solvent.lower() == 'water':
-            solvent_type = 'Water'
-            eta = 8.9e-4
-            chi_s = -9.04e-6
-        elif solvent.lower() == 'dpbs':
-            solvent_type = 'DPBS'
-            eta = 0.89e-3
-            chi_s = -9.05e-6
-        else:
-            print('ERROR: Unknown solvent.')
-            sys.exit()
-        print('Solvent: ' + solvent_type)
-    except:
-        print('ERROR: Solvent could not be found.')
-        sys.exit()
-
-    try: # find radius
-        radius = float(sample_entry['Radius'])
-        print('Radius: {} m'.format(radius))
-        optimize_radius = True
-        if radius == 0:
-            radius = 'Unknown'
-            print('Radius: unknown')
-            optimize_radius = False
-    except:
-        radius = 'Unknown'
-        print('Radius: unknown')
-        optimize_radius = False
-        sys.exit('ERROR: Cannot proceed with unknown radius.')
+    # entries of the file, looked up and checked before the loop
+    run = runs[file_key]
+    print(run.describe())
+    dir = run.dir
+    sample = run.sample
+    magnet = run.magnet
+    material = run.material
+    rho_p = run.rho_p
+    solvent_type, eta, chi_s = run.solvent_type, run.eta, run.chi_s
+    radius = run.radius
+    radius_std = run.radius_std
+    optimize_radius = run.optimize_radius
 
     r = radius
 
-    try: # find batch date
-        batch = str(sample_entry['Batch-date/Lot'])
-    except:
-        print('ERROR: Could not find Batch date/Lot')
-        sys.exit()
-
-    try: # find c0
-        c0 = float(sample_entry['Conc.\n[mg/mL]'])
-    except:
-        print('ERROR: Invalid initial concentration')
-        sys.exit()
+    batch = run.batch
+    c0 = run.c0
 
     # magnet parameters
-    try: # find magnet ID
-        mag_entry = mag_df.loc[mag_df['ID'] == magnet].iloc[0]
-        print('\nMagnet: ' + magnet)
-    except:
-        print('ERROR: Could not find magnet {} in magnet log.'.format(magnet))
-        sys.exit()
-
-    try: # find magnet K&J product number
-        mag_name = str(mag_entry['K&J magnet'])
-        print('K&J Magnet: ' + str(mag_name))
-    except:
-        sys.exit('ERROR: Could not find name of magnet.')
-
-    try: # find magnet length
-        l_in = float(mag_entry['Length']) # inches
-        print('Length: {}"'.format(l_in))
-    except:
-        sys.exit('ERROR: Invalid length.')
-
-    try: # find magnet width
-        w_in = float(mag_entry['Width']) # inches
-        print('Width: {}"'.format(w_in))
-    except:
-        sys.exit('ERROR: Invalid width.')
-
-    try: # find magnet height
-        t_in = float(mag_entry['Height']) # inches
-        print('Thickness: {}"'.format(t_in))
-    except:
-        sys.exit('ERROR: Invalid height.')
-
-    try: # find magnet grade
-        grade = int(mag_entry['Grade'])
-        print('Grade: N{:d}'.format(grade))
-    except:
-        sys.exit('ERROR: Invalid grade: {}.'.format(mag_entry['Grade']))
-
-    try: # find magnet distance
-        dist = float(mag_entry['Distance']) # mm
-        window = [dist - 0.5, dist + 0.5]
-    except:
-        sys.exit('ERROR: Invalid distance.')
-
-    # magnet params
+    mag_name = run.mag_name
+    l_in, w_in, t_in = run.l_in, run.w_in, run.t_in # inches
+    grade = run.grade
+    dist = run.dist # mm
+    window = run.window
+
     l = l_in * in2m
     w = w_in * in2m
     t = t_in * in2m
-    if grade == 52:
-        b_r = 1.48
-    elif grade == 42:
-        b_r = 1.32
-    else:
-        print('Unknown magnet grade of {}'.format(grade))
-        sys.exit()
+    b_r = run.b_r
 
     a, fit_str = fit_mag_field(window, b_r, l, w, t)
     print('Fit magnetic field: a = {}'.format(a))
@@ -401,11 +321,17 @@ for f in to_run_list:
 
     ### IMPORT DATA
     file_path = path + dir + file
-    print('\nNow processing ' + str(file_path))
-
-    data = np.genfromtxt(file_path)
-    time = data[:, 0]
-    lux = data[:, 1]
+    if run_store is not None:
+        print('\nNow processing ' + file_key + ' from the run store ' + opts['store'])
+        if file_key not in run_store:
+            sys.exit('ERROR: {} is not in the run store {}.'.format(file_key, opts['store']))
+        # read-only views of the memory-mapped columns of the store
+        time, lux = run_store.columns(file_key)
+    else:
+        print('\nNow processing ' + str(file_path))
+        data = runfile.load(file_path)
+        time = data[:, 0]
+        lux = data[:, 1]
     print('Successfully loaded: ' + str(file))
 
     ### PRE-PROCESS DATA
@@ -457,12 +383,43 @@ for f in to_run_list:
 
     print_list = []
     c0 = conc_shifted[0]
-    counter = 0
+    batch_model = models.DeltasModel(c0, eta, rho_p, a, chi_s, mu0)
+    batch_jac = batch_model.jacobian
+    if opts['checkjac']:
+        jac_errors = models.check_jacobian(batch_model, batch_jac, time_shifted,
+            guesses[::max(1, len(guesses) // 100)])
+        jac_check = models.format_jacobian_check(['delta1', 'delta2'], jac_errors)
+        print(jac_check)
+        file_lines.append(jac_check)
     start_time = pytime.time()
-    for init_guess in tqdm(guesses):
+    global_summary = None
+    n_starts = len(guesses)
+    if opts['global'] is not None:
+        box, log_scale = globalopt.search_box(guesses, bounds)
+        fits, global_summary = globalopt.global_fits(batch_model, time_shifted,
+            conc_shifted, box, bounds, jac=batch_jac, log_scale=log_scale,
+            method=opts['global'], n_grid=len(guesses))
+        n_starts = len(fits) # refined starts of the search
+    elif opts['basins']:
+        if opts['workers'] > 1:
+            print('Basin cache runs in a single process; ignoring -workers.')
+        cache = multistart.BasinCache(tol=opts['basintol'])
+        fits = multistart.basin_fits(batch_model, time_shifted, conc_shifted,
+            guesses, bounds, jac=batch_jac, cache=cache, probe_nfev=opts['probe'])
+    else:
+        # the batched model and Jacobian give the same fits for any number of workers
+        fits = multistart.parallel_fits(batch_model, time_shifted, conc_shifted,
+            guesses, bounds, jac=batch_jac, workers=opts['workers'], engine='serial')
+
+    stopper = None
+    if opts['patience'] > 0 or opts['confidence'] > 0:
+        stopper = multistart.EarlyStop(patience=opts['patience'],
+            confidence=opts['confidence'])
+        fits = stopper.watch(fits, batch_model, time_shifted, conc_shifted)
+
+    for init_guess, popt, pcov in fits:
         try:
-            (popt, pcov) = curve_fit(deltas_model, time_shifted, conc_shifted, p0=init_guess, bounds=bounds)
-            adj_model_y = deltas_model(time_shifted, *popt)
+            adj_model_y = batch_model.single(time_shifted, *popt)
 
             delta1 = popt[0]
             delta2 = popt[1]
@@ -476,8 +433,7 @@ for f in to_run_list:
             mse = ss_res / len(residuals)
             # fit_err = (pcov[0][0] + pcov[1][1]) ** (1/2) # NEED TO CHECK THIS
 
-            chi = (delta1 * delta2 * rho_p * mu0 * (1+chi_s)) / (2 * (a**2))
-            r = ( ((delta1 + delta2) * 2 * rho_p) / (-9) ) ** (1/2)
+            chi, r = [x[0] for x in batch_model.chi_r(popt)]
 
             # define some error-related constants
             cov_00 = pcov[0][0]
@@ -537,8 +493,11 @@ for f in to_run_list:
         except ZeroDivisionError:
             pass
 
-        counter += 1
-
+    counter = n_starts
+    if stopper is not None and stopper.reason is not None:
+        # the refined starts of a global search are not guesses of the grid
+        counter = len(stopper.mses) if global_summary is not None \
+            else guesses.index(list(init_guess)) + 1
     end_time = pytime.time()
     duration = end_time - start_time
 
@@ -565,6 +524,16 @@ for f in to_run_list:
     file_lines.append('\n--- Model Results ---')
     file_lines.append('Time to fit: ' + str(duration) + ' s')
     file_lines.append('Actual number of guesses used: ' + str(counter))
+    if global_summary is not None:
+        print(global_summary)
+        file_lines.append(global_summary)
+    if stopper is not None:
+        print(stopper.summary(n_starts))
+        file_lines.append(stopper.summary(n_starts))
+    if opts['basins']:
+        basin_lines = cache.summary_lines(['delta1', 'delta2'])
+        print('\n'.join(basin_lines))
+        file_lines.extend(basin_lines)
 
     file_lines.append('\nFINAL RESULTS')
     file_lines.append('error_metric\tchi\tr\tguess_d1\tguess_d2\td1\td2\tcov_00'
@@ -613,7 +582,7 @@ for f in to_run_list:
     ax3.plot(time, conc, color=orange, label='Data')
     for key in best_fits:
         d = best_fits[key]
-        ax3.plot(time_shifted, deltas_model(time_shifted, d['d1'], d['d2']),
+        ax3.plot(time_shifted, batch_model.single(time_shifted, d['d1'], d['d2']),
             linestyle=':', color=d['color'], label='best ' + key)
     ax3.set_xlabel('Time (s)')
     ax3.set_ylabel('Concentration (mg/mL)')